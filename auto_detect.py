@@ -0,0 +1,74 @@
+
+import cv2
+import numpy as np
+
+# Detection runs on a small downscale of the preview, so it stays in the
+# low milliseconds even for large pages
+DETECT_MAX_SIDE = 400
+# Regions smaller than this fraction of the page are ignored
+MIN_AREA_FRACTION = 0.05
+
+
+def snap_to_aspect(box, aspect_ratio, width, height):
+    # Grow the shorter side of `box` around its center to match aspect_ratio,
+    # then shift/shrink it so it stays inside the (width x height) image
+    x1, y1, x2, y2 = box
+    w, h = x2 - x1, y2 - y1
+    if w / h > aspect_ratio:
+        h = w / aspect_ratio
+    else:
+        w = h * aspect_ratio
+
+    # Too big for the page: shrink, keeping the ratio
+    fit = min(1.0, width / w, height / h)
+    w, h = w * fit, h * fit
+
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    x1 = min(max(0, cx - w / 2), width - w)
+    y1 = min(max(0, cy - h / 2), height - h)
+    return (x1, y1, x1 + w, y1 + h)
+
+
+def detect_certificate(image, aspect_ratio):
+    """Propose a crop box for the certificate on a rendered page.
+
+    Finds the largest roughly rectangular region via edge/contour detection
+    and snaps it to `aspect_ratio`. Returns ((x1, y1, x2, y2) in the image's
+    pixel coordinates, confidence 0..1), or None if nothing plausible was
+    found.
+    """
+    pixels = np.asarray(image)
+    gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY) if pixels.ndim == 3 else pixels
+    height, width = gray.shape
+
+    scale = min(1.0, DETECT_MAX_SIDE / max(height, width))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    small_h, small_w = small.shape
+
+    edges = cv2.Canny(cv2.GaussianBlur(small, (5, 5), 0), 50, 150)
+    # Close small gaps so a certificate's border forms one contour
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    page_area = small_w * small_h
+    best = None
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        area = w * h
+        if area < MIN_AREA_FRACTION * page_area:
+            continue
+        # How much of its bounding box the region actually fills
+        rectangularity = cv2.contourArea(cv2.convexHull(contour)) / area
+        if best is None or area > best[0]:
+            best = (area, rectangularity, (x, y, x + w, y + h))
+
+    if best is None:
+        return None
+
+    area, rectangularity, (x1, y1, x2, y2) = best
+    ratio = (x2 - x1) / (y2 - y1)
+    aspect_match = min(ratio, aspect_ratio) / max(ratio, aspect_ratio)
+    confidence = max(0.0, min(1.0, rectangularity)) * aspect_match
+
+    box = snap_to_aspect((x1 / scale, y1 / scale, x2 / scale, y2 / scale), aspect_ratio, width, height)
+    return box, confidence
@@ -0,0 +1,102 @@
+
+# Compare cropping from a page's embedded JPEG with rendering the region.
+#
+#   python benchmarks/bench_embedded.py [--input input_pdfs] [--repeat 3] [--color rgb]
+#                                       [--renderer poppler --poppler-embedded]
+#
+# For the first page of every PDF this reports which path load_region_array
+# takes ("embedded" for a single full-page JPEG scan, "render" otherwise), the
+# median time of that path and of a plain render_region_array of the same
+# region at OUTPUT_DPI, the speedup, and for embedded crops how far they are
+# from the render (mean absolute difference in grey levels, after scaling the
+# crop to the render's size). The region is the middle half of the page, a
+# typical certificate-sized selection.
+#
+# The poppler backend only takes the embedded path with --poppler-embedded
+# (see PopplerRenderer). Its first crop of a page also checks the page (four
+# poppler runs), later ones only extract the JPEG: "first ms" is the first
+# run, "fast ms" the median of all of them.
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crop_pdfs import INPUT_FOLDER, POPPLER_PATH
+from image_core import COLOR_MODES, convert, resize
+from pdf_render import OUTPUT_DPI, RENDERERS, get_renderer, load_region_array
+
+
+def median_ms(func, repeat):
+    # (median ms, first run ms, result)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, timings[0] * 1000, result
+
+
+def grey_difference(pixels, rendered):
+    # Mean absolute difference in grey levels, at the render's size
+    height, width = rendered.shape[:2]
+    pixels = convert(resize(pixels, (width, height)), "gray").astype(np.int16)
+    return np.abs(pixels - convert(rendered, "gray")).mean()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the embedded-JPEG crop path against rendering.")
+    parser.add_argument("--input", default=INPUT_FOLDER, help=f"Folder with PDF files (default: {INPUT_FOLDER})")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per file and path (default: 3)")
+    parser.add_argument("--renderer", default="auto", choices=["auto", *RENDERERS], help="Rendering backend (default: auto)")
+    parser.add_argument("--color", default="rgb", choices=COLOR_MODES, help="Crop in colour or grayscale (default: rgb)")
+    parser.add_argument("--poppler-embedded", action="store_true", help="Let the poppler backend crop from embedded JPEGs too (off in the tools)")
+    args = parser.parse_args()
+
+    pdf_files = sorted(f for f in os.listdir(args.input) if f.lower().endswith(".pdf"))
+    if not pdf_files:
+        print(f"No PDF files found in {args.input}.")
+        return
+
+    renderer = get_renderer(args.renderer, POPPLER_PATH)
+    if args.poppler_embedded:
+        renderer.embedded_jpegs = True
+    print(f"{len(pdf_files)} PDFs with {renderer.name}, {args.color}, region at {OUTPUT_DPI} DPI, median of {args.repeat} runs")
+    print(f"{'file':<32} {'path':<9} {'first ms':>9} {'fast ms':>9} {'render ms':>10} {'speedup':>8} {'diff':>6}")
+    fast_total = render_total = 0.0
+    embedded = 0
+    differences = []
+    for pdf_file in pdf_files:
+        pdf_path = os.path.join(args.input, pdf_file)
+        try:
+            w, h = renderer.page_info(pdf_path)["page_size"]
+            box = (w * 0.25, h * 0.25, w * 0.75, h * 0.75)
+            fast_ms, first_ms, (pixels, source) = median_ms(lambda: load_region_array(renderer, pdf_path, box, dpi=OUTPUT_DPI, color=args.color), args.repeat)
+            render_ms, _, rendered = median_ms(lambda: renderer.render_region_array(pdf_path, box, dpi=OUTPUT_DPI, color=args.color), args.repeat)
+        except Exception as e:
+            print(f"{pdf_file:<32} error: {e}")
+            continue
+        diff = ""
+        if source == "embedded":
+            embedded += 1
+            differences.append(grey_difference(pixels, rendered))
+            diff = f"{differences[-1]:.2f}"
+        fast_total += fast_ms
+        render_total += render_ms
+        print(f"{pdf_file:<32} {source:<9} {first_ms:>9.1f} {fast_ms:>9.1f} {render_ms:>10.1f} {render_ms / fast_ms:>7.1f}x {diff:>6}")
+    renderer.close()
+    if fast_total:
+        print(f"{embedded} of {len(pdf_files)} files took the embedded path; "
+              f"overall {render_total / fast_total:.1f}x faster than rendering every region")
+    if differences:
+        print(f"Embedded crops differ from renders by {statistics.mean(differences):.2f} grey levels on average "
+              f"(the two paths resample the region differently, so noisy scans differ most)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+
+# Benchmark the render -> crop -> resize -> encode -> write path of both croppers.
+#
+#   python benchmarks/bench_pipeline.py [--count 24] [--dpi 150,300] [--workers 1,4]
+#                                       [--json results.json] [--compare baseline.json]
+#
+# Synthetic certificate PDFs are generated locally (or --input points at real
+# ones), and each file goes through the save path of the tools, headless:
+# "core" is the shared image_core/output_encoder path all entry points use
+# now; "cv2" and "pil" are the earlier crop_pdfs.py (OpenCV) and
+# crop_pdfs_gui.py (PIL) paths, kept for comparison. For every pipeline,
+# DPI and worker count this reports per-stage latency percentiles, peak RSS of
+# the worker processes and files/s. --json writes the results; --compare
+# checks them against an earlier run and exits with status 1 on a regression.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crop_pdfs import POPPLER_PATH, TARGET_HEIGHT, TARGET_WIDTH
+from image_core import convert, resize, to_pil
+from pdf_render import PREVIEW_DPI, RENDERERS, get_renderer, pixels_to_points, rotate_image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PIPELINES = ("core", "cv2", "pil")
+STAGES = ("preview", "render", "convert", "resize", "encode", "write")
+
+
+def make_certificate_pdf(path, index, size=(850, 1100)):
+    # A page-sized image with a bordered, certificate-like block on it, placed
+    # a little differently on every page
+    page = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(page)
+    x = 80 + (index * 37) % 120
+    y = 150 + (index * 53) % 300
+    w, h = 600, 400
+    draw.rectangle((x, y, x + w, y + h), fill=(250, 245, 230), outline=(120, 90, 30), width=8)
+    draw.rectangle((x + 20, y + 20, x + w - 20, y + h - 20), outline=(160, 130, 60), width=3)
+    for line in range(6):
+        ly = y + 80 + line * 45
+        draw.line((x + 60, ly, x + w - 60 - (line * 31) % 150, ly), fill=(40, 40, 40), width=4)
+    draw.ellipse((x + w - 150, y + h - 150, x + w - 60, y + h - 60), outline=(180, 30, 30), width=6)
+    draw.text((40, 40), f"Synthetic certificate #{index}", fill="black")
+    page.save(path, "PDF", resolution=100.0)
+
+
+def make_synthetic_pdfs(folder, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"cert_{i:04d}.pdf")
+        make_certificate_pdf(path, i)
+        paths.append(path)
+    return paths
+
+
+# Each worker process keeps its own renderer, like crop_pdfs_batch.py
+renderer = None
+
+
+def init_worker(renderer_name):
+    global renderer
+    renderer = get_renderer(renderer_name, POPPLER_PATH)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_file(pdf_path, output_path, pipeline, dpi):
+    # Runs in a worker process; returns ({stage: seconds}, peak RSS in MB)
+    times = {}
+    start = time.perf_counter()
+    info = renderer.page_info(pdf_path)
+    preview = renderer.render_page(pdf_path, dpi=PREVIEW_DPI)
+    times["preview"] = time.perf_counter() - start
+
+    # Select the middle of the preview with the target aspect ratio, as a user would
+    pw, ph = preview.size
+    sel_w = pw * 0.7
+    sel_h = sel_w * TARGET_HEIGHT / TARGET_WIDTH
+    box = ((pw - sel_w) / 2, (ph - sel_h) / 2, (pw + sel_w) / 2, (ph + sel_h) / 2)
+
+    start = time.perf_counter()
+    if pipeline == "core":
+        region = renderer.render_region_array(pdf_path, pixels_to_points(box, PREVIEW_DPI), dpi=dpi)
+    else:
+        region = renderer.render_region(pdf_path, pixels_to_points(box, PREVIEW_DPI), dpi=dpi)
+    times["render"] = time.perf_counter() - start
+
+    if pipeline == "core":
+        # output_encoder.write_outputs: area resize of the array view, colour
+        # conversion (a no-op for RGB) on the small result, PIL PNG encode
+        start = time.perf_counter()
+        resized = resize(region, (TARGET_WIDTH, TARGET_HEIGHT))
+        times["resize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        resized = convert(resized, "rgb")
+        times["convert"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        buffer = BytesIO()
+        to_pil(resized).save(buffer, "PNG", compress_level=6)
+        data = buffer.getvalue()
+        times["encode"] = time.perf_counter() - start
+    elif pipeline == "cv2":
+        # crop_pdfs.py: PIL -> BGR array, INTER_AREA resize, cv2 PNG encode
+        start = time.perf_counter()
+        crop = cv2.cvtColor(np.array(region), cv2.COLOR_RGB2BGR)
+        times["convert"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        resized = cv2.resize(crop, (TARGET_WIDTH, TARGET_HEIGHT), interpolation=cv2.INTER_AREA)
+        times["resize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ok, encoded = cv2.imencode(".png", resized)
+        if not ok:
+            raise IOError(f"Could not encode {output_path}")
+        data = encoded.tobytes()
+        times["encode"] = time.perf_counter() - start
+    else:
+        # crop_pdfs_gui.py's write_crop: rotate (a no-op at 0), LANCZOS resize, PIL PNG encode
+        start = time.perf_counter()
+        crop = rotate_image(region, 0)
+        times["convert"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        resized = crop.resize((TARGET_WIDTH, TARGET_HEIGHT), Image.Resampling.LANCZOS)
+        times["resize"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        buffer = BytesIO()
+        resized.save(buffer, "PNG")
+        data = buffer.getvalue()
+        times["encode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(output_path, "wb") as f:
+        f.write(data)
+    times["write"] = time.perf_counter() - start
+    return times, peak_rss_mb()
+
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(values):
+    ms = sorted(v * 1000 for v in values)
+    return {
+        "p50_ms": percentile(ms, 50),
+        "p90_ms": percentile(ms, 90),
+        "p99_ms": percentile(ms, 99),
+        "mean_ms": sum(ms) / len(ms) if ms else 0.0,
+    }
+
+
+def run_config(pdf_paths, output_folder, pipeline, dpi, workers, renderer_name):
+    stage_times = {stage: [] for stage in STAGES}
+    peak = None
+    # A fresh pool per configuration, so RSS and warm caches don't carry over
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(renderer_name,)) as executor:
+        futures = [
+            executor.submit(run_file, pdf_path, os.path.join(output_folder, f"{i:04d}_{pipeline}.png"), pipeline, dpi)
+            for i, pdf_path in enumerate(pdf_paths)
+        ]
+        for future in futures:
+            times, rss = future.result()
+            for stage, seconds in times.items():
+                stage_times[stage].append(seconds)
+            if rss is not None:
+                peak = max(peak or 0.0, rss)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "pipeline": pipeline,
+        "dpi": dpi,
+        "workers": workers,
+        "files": len(pdf_paths),
+        "seconds": elapsed,
+        "files_per_s": len(pdf_paths) / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak,
+        "stages": {stage: summarize(values) for stage, values in stage_times.items()},
+    }
+
+
+def config_key(result):
+    return (result["pipeline"], result["dpi"], result["workers"])
+
+
+def compare(results, baseline, threshold):
+    # Returns a list of regression messages: files/s dropped, or a stage's
+    # median got slower, by more than `threshold` (a fraction)
+    previous = {config_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(config_key(result))
+        if old is None:
+            continue
+        name = "{}@{}dpi x{}".format(*config_key(result))
+        if result["files_per_s"] < old["files_per_s"] * (1 - threshold):
+            regressions.append(f"{name}: files/s {old['files_per_s']:.2f} -> {result['files_per_s']:.2f}")
+        for stage, stats in result["stages"].items():
+            old_ms = old["stages"].get(stage, {}).get("p50_ms")
+            # Ignore sub-millisecond stages, where noise dominates
+            if old_ms and max(old_ms, stats["p50_ms"]) >= 1.0 and stats["p50_ms"] > old_ms * (1 + threshold):
+                regressions.append(f"{name}: {stage} p50 {old_ms:.1f} ms -> {stats['p50_ms']:.1f} ms")
+    return regressions
+
+
+def print_result(result):
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+    print(f"{result['pipeline']} @ {result['dpi']} DPI, {result['workers']} workers: "
+          f"{result['files_per_s']:.2f} files/s, peak RSS {rss}")
+    print(f"  {'stage':<8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<8} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['mean_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the render -> crop -> resize -> encode pipeline.")
+    parser.add_argument("--input", help="Folder with PDF files to use instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=24, help="Number of synthetic PDFs to generate (default: 24)")
+    parser.add_argument("--dpi", default="150,300", help="Comma-separated output DPIs (default: 150,300)")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count()}", help="Comma-separated worker counts (default: 1 and all cores)")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help="Comma-separated pipelines: core (shared image core), cv2 (old crop_pdfs.py), pil (old crop_pdfs_gui.py)")
+    parser.add_argument("--renderer", default="auto", choices=["auto", *RENDERERS], help="Rendering backend (default: auto)")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown that counts as a regression (default: 0.15)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as scratch:
+        if args.input:
+            pdf_paths = [os.path.join(args.input, f) for f in sorted(os.listdir(args.input)) if f.lower().endswith('.pdf')]
+        else:
+            pdf_paths = make_synthetic_pdfs(scratch, args.count)
+        if not pdf_paths:
+            print(f"No PDF files found in {args.input}.")
+            return
+
+        output_folder = os.path.join(scratch, "out")
+        os.makedirs(output_folder)
+        print(f"{len(pdf_paths)} PDFs, renderer {args.renderer}, output {TARGET_WIDTH}x{TARGET_HEIGHT} PNG")
+        results = []
+        for pipeline in args.pipelines.split(","):
+            for dpi in (int(v) for v in args.dpi.split(",")):
+                for workers in (int(v) for v in args.workers.split(",")):
+                    result = run_config(pdf_paths, output_folder, pipeline, dpi, workers, args.renderer)
+                    print_result(result)
+                    results.append(result)
+
+    if args.json:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "renderer": args.renderer,
+            "synthetic": not args.input,
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (threshold {args.threshold:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+
+# Compare per-page latency of the rendering backends.
+#
+#   python benchmarks/bench_renderers.py [--input input_pdfs] [--repeat 3]
+#
+# For every available backend this times a full-page preview render and a
+# full-DPI region render (the two calls the croppers make per file),
+# starting from a fresh renderer so document-open cost is included.
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crop_pdfs import INPUT_FOLDER, POPPLER_PATH
+from pdf_render import OUTPUT_DPI, PREVIEW_DPI, RENDERERS, get_renderer
+
+
+def bench_backend(name, pdf_paths, repeat):
+    timings = {"preview": [], "region": []}
+    for _ in range(repeat):
+        renderer = get_renderer(name, POPPLER_PATH)
+        for pdf_path in pdf_paths:
+            start = time.perf_counter()
+            info = renderer.page_info(pdf_path)
+            renderer.render_page(pdf_path, dpi=PREVIEW_DPI)
+            timings["preview"].append(time.perf_counter() - start)
+
+            # A typical certificate-sized selection: the middle half of the page
+            w, h = info["page_size"]
+            start = time.perf_counter()
+            renderer.render_region(pdf_path, (w * 0.25, h * 0.25, w * 0.75, h * 0.75), dpi=OUTPUT_DPI)
+            timings["region"].append(time.perf_counter() - start)
+        renderer.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rendering backends.")
+    parser.add_argument("--input", default=INPUT_FOLDER, help=f"Folder with PDF files (default: {INPUT_FOLDER})")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the folder per backend (default: 3)")
+    parser.add_argument("--renderers", default=",".join(RENDERERS), help="Comma-separated backends to compare")
+    args = parser.parse_args()
+
+    pdf_paths = [os.path.join(args.input, f) for f in sorted(os.listdir(args.input)) if f.lower().endswith('.pdf')]
+    if not pdf_paths:
+        print(f"No PDF files found in {args.input}.")
+        return
+
+    print(f"{len(pdf_paths)} PDFs x {args.repeat} passes, preview at {PREVIEW_DPI} DPI, region at {OUTPUT_DPI} DPI")
+    print(f"{'backend':<10} {'stage':<8} {'median ms':>10} {'mean ms':>10} {'max ms':>10}")
+    for name in args.renderers.split(","):
+        try:
+            timings = bench_backend(name, pdf_paths, args.repeat)
+        except Exception as e:
+            print(f"{name:<10} unavailable: {e}")
+            continue
+        for stage, values in timings.items():
+            ms = [v * 1000 for v in values]
+            print(f"{name:<10} {stage:<8} {statistics.median(ms):>10.1f} {statistics.mean(ms):>10.1f} {max(ms):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
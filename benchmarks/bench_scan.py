@@ -0,0 +1,73 @@
+
+# Time the lazy input scan (pdf_scanner.scan_pdfs) on a large tree.
+#
+#   python benchmarks/bench_scan.py [--files 100000] [--folders 100] [--input tree]
+#
+# Builds a tree of empty .pdf files in a temp folder (or scans --input as it
+# is) and reports how long the first path takes to come back (what the GUI
+# and crop_pdfs.py wait for before showing a page) and the full walk, next to
+# a plain sorted os.walk listing of the same tree for comparison.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_scanner import natural_key, scan_pdfs
+
+
+def build_tree(root, files, folders):
+    per_folder = max(1, files // folders)
+    for f in range(folders):
+        folder = os.path.join(root, f"batch{f}")
+        os.makedirs(folder)
+        for i in range(per_folder):
+            with open(os.path.join(folder, f"cert{i}.pdf"), "wb"):
+                pass
+    return per_folder * folders
+
+
+def walk_all(root):
+    # The eager alternative: list everything, then sort
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        paths.extend(name if rel == "." else f"{rel}/{name}" for name in filenames if name.lower().endswith(".pdf"))
+    return sorted(paths, key=natural_key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lazy input folder scan.")
+    parser.add_argument("--files", type=int, default=100000, help="Files in the generated tree (default: 100000)")
+    parser.add_argument("--folders", type=int, default=100, help="Folders they are spread over (default: 100)")
+    parser.add_argument("--input", help="Scan this folder instead of generating one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.input
+        if root is None:
+            root = tmp
+            start = time.perf_counter()
+            count = build_tree(root, args.files, args.folders)
+            print(f"Generated {count} files in {args.folders} folders in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        scan = scan_pdfs(root)
+        first = next(scan, None)
+        first_ms = (time.perf_counter() - start) * 1000
+        total = (first is not None) + sum(1 for _ in scan)
+        scan_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        walked = walk_all(root)
+        walk_s = time.perf_counter() - start
+
+    print(f"scan_pdfs: first path after {first_ms:.1f} ms, all {total} after {scan_s:.2f}s")
+    print(f"os.walk + sort: all {len(walked)} after {walk_s:.2f}s (first path only then)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 
+import argparse
 import cv2
-import numpy as np
 import os
-from pdf2image import convert_from_path
 from pdf2image.exceptions import PDFInfoNotInstalledError
 import sys
+import time
+
+from auto_detect import detect_certificate
+from crop_template import normalize_box, save_template
+from dedupe import Deduplicator
+from image_core import resize, to_bgr
+from output_encoder import OutputSettings, describe, write_outputs
+from pdf_scanner import scan_pdfs
+from pdf_render import OUTPUT_DPI, PREVIEW_DPI, SOURCES, get_renderer, load_page_array, load_region_array, pixels_to_points
+from render_cache import RenderCache
+from render_prefetch import RenderPrefetcher
+from session_journal import SessionJournal
+from timing import Instrumentation, add_arguments as add_timing_arguments, recorder
+from work_items import WorkList, output_name
 
 # Configuration
 INPUT_FOLDER = "input_pdfs"
@@ -17,6 +30,78 @@ ASPECT_RATIO = TARGET_WIDTH / TARGET_HEIGHT  # 1.5
 # POPPLER_PATH = r"C:\path\to\poppler-xx\bin" 
 POPPLER_PATH = r"c:\Users\rasheeque raheem\Downloads\PDF CUTTER\poppler-25.12.0\Library\bin"
 
+# Rendering backend: "pdfium" (in-process, needs pypdfium2), "poppler", or
+# "auto" to use pdfium when it is installed and poppler otherwise
+RENDERER = "auto"
+
+# Pre-place the crop box on the detected certificate (press 's' to accept)
+AUTO_DETECT = True
+
+# Pages that are a single scanned JPEG are cropped from the JPEG itself
+# instead of being rendered (falls back to rendering for any other page)
+EMBEDDED_IMAGES = True
+
+# Render this many upcoming pages in the background while you crop
+PREFETCH_COUNT = 2
+
+# On-disk cache of rendered previews, reused across sessions (0 disables it)
+CACHE_FOLDER = ".render_cache"
+CACHE_MAX_MB = 1024
+
+# Output format: "png" (PNG_COMPRESSION 0-9), "jpeg" (JPEG_QUALITY 1-100) or
+# "webp" (lossless). EXTRA_SIZES are made from the same crop in one pass,
+# e.g. [("_thumb", 150, 100)] also writes name_thumb.png at 150x100.
+OUTPUT_FORMAT = "png"
+PNG_COMPRESSION = 6
+JPEG_QUALITY = 90
+EXTRA_SIZES = []
+ENCODE_WORKERS = 2
+OUTPUT_COLOR = "rgb"  # or "gray": rendered and written as 8-bit grayscale
+
+# Input scanning: walk subfolders too (outputs mirror the folder layout),
+# keeping files that match INCLUDE and none of EXCLUDE (glob patterns)
+RECURSIVE = True
+INCLUDE = ["*.pdf"]
+EXCLUDE = []
+
+# A file with the same content as one already cropped (another name for the
+# same upload) gets a copy of its outputs instead of being shown again. With
+# PERCEPTUAL_DEDUPE, files whose pages merely look the same count too; that
+# renders every page at low resolution while scanning.
+DEDUPLICATE = True
+PERCEPTUAL_DEDUPE = False
+
+# The page is shown downscaled to fit this size, and only redrawn when the
+# selection changes; the event loop sleeps up to REDRAW_WAIT_MS between checks
+DISPLAY_MAX_WIDTH = 1200
+DISPLAY_MAX_HEIGHT = 800
+REDRAW_WAIT_MS = 20
+RECT_COLOR = (0, 255, 0)
+RECT_THICKNESS = 2
+
+
+def output_settings():
+    return OutputSettings(OUTPUT_FORMAT, [("", TARGET_WIDTH, TARGET_HEIGHT), *EXTRA_SIZES],
+                          PNG_COMPRESSION, JPEG_QUALITY, ENCODE_WORKERS, OUTPUT_COLOR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crop PDF certificates interactively in an OpenCV window.")
+    add_timing_arguments(parser)
+    return parser.parse_args()
+
+
+def restore_region(frame, base, rect):
+    # Copy the part of `base` under a previously drawn rectangle back into
+    # `frame`, instead of copying the whole page for every redraw
+    (x1, y1), (x2, y2) = rect
+    h, w = base.shape[:2]
+    pad = RECT_THICKNESS + 1
+    xa, xb = max(0, min(x1, x2) - pad), min(w, max(x1, x2) + pad + 1)
+    ya, yb = max(0, min(y1, y2) - pad), min(h, max(y1, y2) + pad + 1)
+    if xa < xb and ya < yb:
+        frame[ya:yb, xa:xb] = base[ya:yb, xa:xb]
+
 def main():
     # Create output directory if it doesn't exist
     if not os.path.exists(OUTPUT_FOLDER):
@@ -27,38 +112,97 @@ def main():
         print(f"Created {INPUT_FOLDER}. Please add PDF files there.")
         return
 
-    pdf_files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith('.pdf')]
+    # Resume: leave out files (and pages) already saved/skipped in a previous session
+    journal = SessionJournal(OUTPUT_FOLDER)
+
+    renderer = get_renderer(RENDERER, POPPLER_PATH)
+    render_cache = RenderCache(CACHE_FOLDER, CACHE_MAX_MB * 1024 * 1024) if CACHE_MAX_MB > 0 else None
+    settings = output_settings()
+    dedupe = None
+    if DEDUPLICATE:
+        dedupe = Deduplicator(journal, INPUT_FOLDER, [suffix for suffix, _, _ in settings.sizes], renderer, PERCEPTUAL_DEDUPE)
+    
+    copied = set() # Files left out of the work list because they were copies
     
-    if not pdf_files:
-        print(f"No PDF files found in {INPUT_FOLDER}.")
+    def keep_file(pdf_file):
+        if journal.is_finished(pdf_file, os.path.join(INPUT_FOLDER, pdf_file)):
+            return False
+        if dedupe and dedupe.copy_finished(pdf_file):
+            copied.add(pdf_file)
+            return False
+        return True
+    
+    # Files come from a lazy scan and each is split into pages lazily; pages
+    # are rendered only when visited, plus a small prefetch window
+    work = WorkList(
+        scan_pdfs(INPUT_FOLDER, RECURSIVE, INCLUDE, EXCLUDE),
+        page_count=lambda f: renderer.page_info(os.path.join(INPUT_FOLDER, f))["pages"],
+        keep=lambda item: not journal.is_finished(item.file, os.path.join(INPUT_FOLDER, item.file), item.page),
+        keep_file=keep_file,
+    )
+    if not work.get(0):
+        if work.files_seen:
+            print(f"All {work.files_seen} PDF files were already done in a previous session or copies of done ones (see {journal.path}).")
+        else:
+            print(f"No PDF files found in {INPUT_FOLDER}.")
         return
+    def render(item):
+        # Runs on a prefetch thread: render the preview (an RGB array, see
+        # image_core) and propose a crop box
+        label = output_name(item, '')
+        with recorder.span("render", label):
+            pixels, info = load_page_array(renderer, os.path.join(INPUT_FOLDER, item.file), dpi=PREVIEW_DPI, page=item.page, cache=render_cache)
+        with recorder.span("detect", label):
+            proposal = detect_certificate(pixels, ASPECT_RATIO) if AUTO_DETECT else None
+        return pixels, info, proposal
+    
+    prefetcher = RenderPrefetcher(render, max_ahead=PREFETCH_COUNT)
 
-    print(f"Found {len(pdf_files)} PDF files.")
     print("Controls:")
     print("  Drag mouse to select area (forces 3:2 aspect ratio)")
     print("  's': Save selection and Next")
     print("  'n': Next (skip current)")
     print("  'q' or ESC: Quit")
 
-    for pdf_file in pdf_files:
+    index = 0
+    last_file = None
+    while work.get(index):
+        item = work.get(index)
+        index += 1
+        pdf_file = item.file
         pdf_path = os.path.join(INPUT_FOLDER, pdf_file)
-        print(f"Processing: {pdf_file}")
+        label = output_name(item, '')
+        
+        # A copy of a document cropped since this file was queued: reuse its crops
+        if pdf_file != last_file and dedupe and dedupe.copy_finished(pdf_file):
+            print(f"Copied: {pdf_file} is the same document as one already cropped")
+            while work.get(index) and work.get(index).file == pdf_file:
+                index += 1
+            continue
+        last_file = pdf_file
+        if item.pages > 1:
+            print(f"Processing: {pdf_file} (page {item.page}/{item.pages})")
+        else:
+            print(f"Processing: {pdf_file}")
         
         try:
-            # Convert first page to image
-            # 300 DPI for high resolution
-            images = convert_from_path(pdf_path, first_page=1, last_page=1, dpi=300, poppler_path=POPPLER_PATH)
+            # Convert the page to a screen-resolution preview
+            # The selected region is rendered again at OUTPUT_DPI on save
+            future = prefetcher.update(item, work.upcoming(index - 1, PREFETCH_COUNT))
+            with recorder.span("render_wait", label):
+                pixels, _, proposal = future.result()
+            img_h, img_w = pixels.shape[:2]
             
-            if not images:
-                print(f"  Could not convert {pdf_file}")
-                continue
-                
-            pil_image = images[0]
-            # Convert PIL image to OpenCV format (BGR)
-            img = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+            # Cached display-resolution base frame, plus one reusable buffer the
+            # rectangle is drawn into. Mouse coordinates are in display pixels.
+            # Only the downscaled frame is converted to OpenCV's BGR order.
+            display_scale = min(1.0, DISPLAY_MAX_WIDTH / img_w, DISPLAY_MAX_HEIGHT / img_h)
+            with recorder.span("display", label):
+                base = to_bgr(resize(pixels, (max(1, int(img_w * display_scale)), max(1, int(img_h * display_scale)))))
+            frame = base.copy()
             
             # Setup interactive window
-            window_name = f"Crop: {pdf_file}"
+            window_name = f"Crop: {label}"
             cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
             cv2.resizeWindow(window_name, 1200, 800) # Initial window size
             
@@ -66,14 +210,24 @@ def main():
             rect_start = None
             rect_end = None
             drawing = False
+            dirty = True # Frame needs redrawing
+            drawn_rect = None # Rectangle currently drawn into `frame`
+            
+            # Pre-place the detected box; 's' accepts it as-is
+            if proposal:
+                box, confidence = proposal
+                rect_start = (int(box[0] * display_scale), int(box[1] * display_scale))
+                rect_end = (int(box[2] * display_scale), int(box[3] * display_scale))
+                print(f"  Auto-detected box ({confidence:.0%} confidence) - press 's' to accept or draw a new one")
             
             def mouse_callback(event, x, y, flags, param):
-                nonlocal rect_start, rect_end, drawing
+                nonlocal rect_start, rect_end, drawing, dirty
                 
                 if event == cv2.EVENT_LBUTTONDOWN:
                     drawing = True
                     rect_start = (x, y)
                     rect_end = (x, y)
+                    dirty = True
                 
                 elif event == cv2.EVENT_MOUSEMOVE:
                     if drawing and rect_start:
@@ -96,43 +250,61 @@ def main():
                         sign_y = 1 if height_diff >= 0 else -1
                         
                         new_y = rect_start[1] + (abs_height * sign_y)
-                        rect_end = (current_x, new_y)
+                        if (current_x, new_y) != rect_end:
+                            rect_end = (current_x, new_y)
+                            dirty = True
                         
                 elif event == cv2.EVENT_LBUTTONUP:
                     drawing = False
 
             cv2.setMouseCallback(window_name, mouse_callback)
+            shown = time.perf_counter() # Interaction time runs until 's' or 'n'
             
             while True:
-                display_img = img.copy()
-                
-                if rect_start and rect_end:
-                    cv2.rectangle(display_img, rect_start, rect_end, (0, 255, 0), 2)
+                # Redraw only when the selection changed: restore the pixels
+                # under the old rectangle and draw the new one on top
+                if dirty:
+                    if drawn_rect:
+                        restore_region(frame, base, drawn_rect)
+                        drawn_rect = None
+                    if rect_start and rect_end:
+                        cv2.rectangle(frame, rect_start, rect_end, RECT_COLOR, RECT_THICKNESS)
+                        drawn_rect = (rect_start, rect_end)
+                    cv2.imshow(window_name, frame)
+                    dirty = False
                 
-                cv2.imshow(window_name, display_img)
-                key = cv2.waitKey(1) & 0xFF
+                key = cv2.waitKey(REDRAW_WAIT_MS) & 0xFF
                 
                 # 's' to save
                 if key == ord('s'):
                     if rect_start and rect_end:
-                        # Calculate crop coordinates
-                        x1 = min(rect_start[0], rect_end[0])
-                        y1 = min(rect_start[1], rect_end[1])
-                        x2 = max(rect_start[0], rect_end[0])
-                        y2 = max(rect_start[1], rect_end[1])
+                        # Calculate crop coordinates (display -> preview pixels)
+                        x1 = int(min(rect_start[0], rect_end[0]) / display_scale)
+                        y1 = int(min(rect_start[1], rect_end[1]) / display_scale)
+                        x2 = int(round(max(rect_start[0], rect_end[0]) / display_scale))
+                        y2 = int(round(max(rect_start[1], rect_end[1]) / display_scale))
+                        
+                        # Clamp to the page
+                        x1, y1 = max(0, x1), max(0, y1)
+                        x2, y2 = min(img_w, x2), min(img_h, y2)
                         
                         # Ensure we have some area
                         if x2 > x1 and y2 > y1:
-                            crop = img[y1:y2, x1:x2]
+                            recorder.add("interaction", label, shown, time.perf_counter() - shown)
+                            
+                            # Render only the selection at full resolution
+                            box = pixels_to_points((x1, y1, x2, y2), PREVIEW_DPI)
+                            with recorder.span("crop", label):
+                                region, source = load_region_array(renderer, pdf_path, box, item.page, OUTPUT_DPI, OUTPUT_COLOR, EMBEDDED_IMAGES)
                             
-                            # Resize to 600x400
-                            # Use INTER_AREA for shrinking, INTER_CUBIC for enlarging
-                            resized = cv2.resize(crop, (TARGET_WIDTH, TARGET_HEIGHT), interpolation=cv2.INTER_AREA)
+                            # Resize to 600x400 (plus any EXTRA_SIZES) and encode
+                            outputs = write_outputs(region, OUTPUT_FOLDER, label, settings)
+                            output_filename = os.path.relpath(outputs[0].path, OUTPUT_FOLDER)  # Mirrors the input subfolder
+                            print(f"  Saved {outputs[0].path} ({describe(outputs)}, {SOURCES[source]})")
                             
-                            output_filename = os.path.splitext(pdf_file)[0] + ".png"
-                            output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-                            cv2.imwrite(output_path, resized)
-                            print(f"  Saved {output_path}")
+                            # Remember this crop so crop_pdfs_batch.py can apply it to the rest
+                            save_template((x1, y1, x2, y2), (img_w, img_h))
+                            journal.record(pdf_file, pdf_path, "saved", normalize_box((x1, y1, x2, y2), (img_w, img_h)), output=output_filename, page=item.page, pages=item.pages)
                             break
                         else:
                             print("  Invalid selection. Please draw a rectangle.")
@@ -141,11 +313,14 @@ def main():
                 
                 # 'n' for next
                 elif key == ord('n'):
+                    recorder.add("interaction", label, shown, time.perf_counter() - shown)
+                    journal.record(pdf_file, pdf_path, "skipped", page=item.page, pages=item.pages)
                     print("  Skipped.")
                     break
                 
                 # 'q' or ESC to quit
                 elif key == ord('q') or key == 27:
+                    prefetcher.shutdown()
                     cv2.destroyAllWindows()
                     print("Exiting...")
                     return
@@ -156,15 +331,26 @@ def main():
             print("Error: Poppler is not installed or not found in PATH.")
             print("Please install Poppler and add it to your PATH, or set POPPLER_PATH in the script.")
             print("See INSTRUCTIONS.md for details.")
+            prefetcher.shutdown()
             return
 
         except Exception as e:
+            cv2.destroyAllWindows()
+            journal.record(pdf_file, pdf_path, "error", error=str(e), page=item.page, pages=item.pages)
             print(f"Error processing {pdf_file}: {e}")
             # import traceback
             # traceback.print_exc()
 
+    prefetcher.shutdown()
     cv2.destroyAllWindows()
+    if work.files_skipped > len(copied):
+        print(f"Resumed: {work.files_skipped - len(copied)} of {work.files_seen} files were already done in a previous session (see {journal.path}).")
+    if dedupe and dedupe.files:
+        print(f"Duplicates: {dedupe.files} files were copies of documents already cropped; their {dedupe.pages} "
+              f"pages were copied instead of being rendered and shown again.")
     print("All done!")
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    with Instrumentation(args.trace, args.profile):
+        main()
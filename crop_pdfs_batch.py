@@ -0,0 +1,379 @@
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pdf2image.exceptions import PDFInfoNotInstalledError
+
+from auto_detect import detect_certificate
+from crop_pdfs import (ASPECT_RATIO, ENCODE_WORKERS, EXCLUDE, EXTRA_SIZES, INCLUDE, INPUT_FOLDER, JPEG_QUALITY, OUTPUT_COLOR,
+                       OUTPUT_FOLDER, OUTPUT_FORMAT, PNG_COMPRESSION, POPPLER_PATH, RECURSIVE, TARGET_WIDTH, TARGET_HEIGHT)
+from crop_template import TEMPLATE_FILE, denormalize_box, load_template, normalize_box
+from dedupe import Deduplicator
+from image_core import COLOR_MODES
+from output_encoder import FORMATS, OutputSettings, describe, parse_size, write_outputs
+from pdf_render import OUTPUT_DPI, RENDERERS, SOURCES, get_renderer, load_region_array
+from pdf_scanner import scan_pdfs
+from render_cache import source_digest
+from session_journal import SessionJournal
+from timing import Instrumentation, add_arguments as add_timing_arguments, configure_worker, recorder, traced_call
+from work_items import WorkItem, output_name
+
+# Auto mode detects the certificate on a render at this resolution
+DETECT_DPI = 50
+
+# Each worker process keeps its own renderer (and its open documents)
+renderer = None
+
+
+def init_worker(renderer_name, timing_options=(False, False)):
+    # timing_options: Instrumentation.worker_options() of the parent process
+    global renderer
+    renderer = get_renderer(renderer_name, POPPLER_PATH)
+    configure_worker(*timing_options)
+
+
+def crop_page(pdf_path, page, page_size, output_folder, name, box, rotation, settings, embedded=True):
+    # Render only the template region of one page (or cut it from the page's
+    # JPEG scan, with `embedded`), resize, rotate, encode. Returns
+    # ([EncodedOutput], main output first, source, seconds to get the region);
+    # source is "embedded" or "render", see load_region_array.
+    box_pts = denormalize_box(box, page_size)
+    start = time.perf_counter()
+    with recorder.span("crop", name):
+        region, source = load_region_array(renderer, pdf_path, box_pts, page, OUTPUT_DPI, settings.color, embedded)
+    crop_seconds = time.perf_counter() - start
+    return write_outputs(region, output_folder, name, settings, rotation), source, crop_seconds
+
+
+def detect_box(pdf_path, page, min_confidence, label="", rotation=0):
+    # Auto mode: find the certificate on a low-res render of the page, as a
+    # box that gives the output's shape once turned by `rotation`.
+    # Returns (normalized box, confidence); box is None below the threshold.
+    with recorder.span("render", label):
+        preview = renderer.render_page_array(pdf_path, page, dpi=DETECT_DPI, color="gray")
+    with recorder.span("detect", label):
+        proposal = detect_certificate(preview, ASPECT_RATIO if rotation % 180 == 0 else 1 / ASPECT_RATIO)
+    if not proposal:
+        return None, 0.0
+    box, confidence = proposal
+    if confidence < min_confidence:
+        return None, confidence
+    height, width = preview.shape
+    return normalize_box(box, (width, height)), confidence
+
+
+def crop_pdf(pdf_path, pdf_file, output_folder, box, rotation, settings, pages=None, min_confidence=None, embedded=True):
+    # Runs in a worker process. Crops `pages` (default: all pages, one at a
+    # time) with `box`, or with an auto-detected box per page if box is None.
+    # Returns [(item, status, output filename, box, detail)]; for saved pages
+    # detail is crop_page's (EncodedOutputs, source, crop seconds).
+    info = renderer.page_info(pdf_path)
+    results = []
+    for page in pages or range(1, info["pages"] + 1):
+        item = WorkItem(pdf_file, page, info["pages"])
+        output_filename = output_name(item, settings.extension)
+        page_box = box
+        try:
+            if page_box is None:
+                page_box, confidence = detect_box(pdf_path, page, min_confidence, output_name(item, ''), rotation)
+                if page_box is None:
+                    results.append((item, "low_confidence", None, None, f"confidence {confidence:.0%}"))
+                    continue
+            page_size = info["page_size"] if page == 1 else renderer.page_info(pdf_path, page)["page_size"]
+            saved = crop_page(pdf_path, page, page_size, output_folder, output_name(item, ''), page_box, rotation, settings, embedded)
+            results.append((item, "saved", output_filename, page_box, saved))
+        except PDFInfoNotInstalledError:
+            raise
+        except Exception as e:
+            results.append((item, "error", None, page_box, str(e)))
+    return results
+
+
+def add_crop_arguments(parser, processes=True):
+    # Options shared with the watch-folder daemon (crop_pdfs_watch.py) and
+    # the cluster's enqueue; `processes` adds the ones for a local process
+    # pool, which enqueue doesn't have
+    parser.add_argument("--template", default=TEMPLATE_FILE, help=f"Crop template saved by an interactive session (default: {TEMPLATE_FILE})")
+    parser.add_argument("--input", default=INPUT_FOLDER, help=f"Folder with PDF files (default: {INPUT_FOLDER})")
+    parser.add_argument("--output", default=OUTPUT_FOLDER, help=f"Folder for cropped images (default: {OUTPUT_FOLDER})")
+    if processes:
+        parser.add_argument("--renderer", default="auto", choices=["auto", *RENDERERS], help="Rendering backend (default: auto)")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes (default: all cores)")
+    parser.add_argument("--auto", action="store_true", help="Detect the certificate on every page instead of using a template")
+    parser.add_argument("--min-confidence", type=float, default=0.6, help="With --auto, leave pages below this detection confidence for interactive review (default: 0.6)")
+    parser.add_argument("--format", default=OUTPUT_FORMAT, choices=list(FORMATS), help=f"Output format; webp is lossless (default: {OUTPUT_FORMAT})")
+    parser.add_argument("--png-compression", type=int, default=PNG_COMPRESSION, help=f"PNG compression level 0-9 (default: {PNG_COMPRESSION})")
+    parser.add_argument("--jpeg-quality", type=int, default=JPEG_QUALITY, help=f"JPEG quality 1-100 (default: {JPEG_QUALITY})")
+    parser.add_argument("--extra-size", action="append", type=parse_size, metavar="WxH", help="Also write this size from the same crop, as name_WxH (repeatable)")
+    parser.add_argument("--color", default=OUTPUT_COLOR, choices=COLOR_MODES, help=f"Render and write in colour or grayscale (default: {OUTPUT_COLOR})")
+    parser.add_argument("--no-embedded", dest="embedded", action="store_false", help="Render every page, even ones that are a single JPEG scan that could be cropped directly")
+    parser.add_argument("--encode-workers", type=int, default=ENCODE_WORKERS, help=f"Encoder threads per worker process (default: {ENCODE_WORKERS})")
+
+
+def add_scan_arguments(parser):
+    # Which files of the input folder to crop; see scan_files()
+    parser.add_argument("--include", action="append", help=f"Only crop files matching this glob, e.g. '2024/*.pdf' (repeatable, default: {' '.join(INCLUDE)})")
+    parser.add_argument("--exclude", action="append", help="Leave out files and folders matching this glob (repeatable)")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false", default=RECURSIVE, help="Don't look in subfolders of the input folder")
+
+
+def scan_files(args):
+    return scan_pdfs(args.input, args.recursive, args.include or INCLUDE, args.exclude or EXCLUDE)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply a saved crop template to every PDF in a folder.")
+    add_crop_arguments(parser)
+    parser.add_argument("--force", action="store_true", help="Also redo files the session journal marks as done")
+    parser.add_argument("--from-journal", action="store_true", help="Re-export every saved crop in the session journal, each with its own box and rotation")
+    add_scan_arguments(parser)
+    parser.add_argument("--no-dedupe", dest="dedupe", action="store_false", help="Crop identical files again instead of copying the first one's outputs")
+    parser.add_argument("--perceptual", action="store_true", help="Also treat files whose pages look the same as duplicates (renders every page at low resolution)")
+    add_timing_arguments(parser)
+    return parser.parse_args()
+
+
+def output_settings(args):
+    # OutputSettings from the command line; raises ValueError on bad options
+    extra_sizes = [(f"_{w}x{h}", w, h) for w, h in args.extra_size] if args.extra_size else EXTRA_SIZES
+    return OutputSettings(args.format, [("", TARGET_WIDTH, TARGET_HEIGHT), *extra_sizes],
+                          args.png_compression, args.jpeg_quality, args.encode_workers, args.color)
+
+
+def load_crop_box(args):
+    # (box, rotation) from the template, or (None, 0) with --auto; raises
+    # ValueError with a message for the user if the template is unusable
+    if args.auto:
+        return None, 0
+    try:
+        return load_template(args.template)
+    except FileNotFoundError:
+        raise ValueError(f"Template {args.template} not found. Crop one file interactively first, or use --auto.")
+    except (ValueError, KeyError) as e:
+        raise ValueError(f"Invalid template {args.template}: {e}")
+
+
+def file_rotation(journal, pdf_file, template_rotation, box):
+    # The rotation chosen for the file in an interactive session, else the
+    # template's. A template box only fits pages turned the way it was drawn
+    # for (or upside down), so a quarter turn either way is a ValueError.
+    rotation = journal.rotation_for(pdf_file, template_rotation)
+    if box is not None and (rotation - template_rotation) % 180:
+        raise ValueError(f"rotated by {rotation} in an interactive session, but the template box is for a rotation of "
+                         f"{template_rotation}; crop it in the GUI")
+    return rotation
+
+
+def record_results(pdf_file, pdf_path, rotation, results, output_folder, journal):
+    # Print and journal the per-page results of crop_pdf(). Returns counts
+    # by status, plus bytes written and encode time of the saved pages, and
+    # their count and crop time by source (embedded JPEG or render).
+    totals = {"saved": 0, "low_confidence": 0, "error": 0, "bytes": 0, "encode_seconds": 0.0,
+              "embedded": 0, "embedded_seconds": 0.0, "render": 0, "render_seconds": 0.0}
+    source_hash = source_digest(pdf_path)  # Hashed once for all the file's pages
+    for item, status, output_filename, page_box, detail in results:
+        totals[status] += 1
+        if status == "saved":
+            outputs, source, crop_seconds = detail
+            print(f"  Saved {os.path.join(output_folder, output_filename)} "
+                  f"({describe(outputs)}; {SOURCES[source]} in {crop_seconds * 1000:.1f} ms)")
+            totals["bytes"] += sum(o.bytes for o in outputs)
+            totals["encode_seconds"] += sum(o.encode_seconds for o in outputs)
+            totals[source] += 1
+            totals[source + "_seconds"] += crop_seconds
+            journal.record(pdf_file, pdf_path, "saved", page_box, rotation, output_filename, page=item.page, pages=item.pages, source_hash=source_hash)
+        elif status == "low_confidence":
+            # Not finished, so the interactive tools will offer it
+            print(f"  Needs review: {pdf_file} page {item.page} ({detail})")
+            journal.record(pdf_file, pdf_path, "low_confidence", rotation=rotation, error=detail, page=item.page, pages=item.pages, source_hash=source_hash)
+        else:
+            print(f"  Error processing {pdf_file} page {item.page}: {detail}")
+            journal.record(pdf_file, pdf_path, "error", page_box, rotation, error=detail, page=item.page, pages=item.pages, source_hash=source_hash)
+    return totals
+
+
+def crop_paths(sources, source_seconds):
+    # Summary of how the saved pages were cropped: how many came straight
+    # from an embedded JPEG, and how much faster that was than rendering
+    embedded = source_seconds["embedded"] / sources["embedded"]
+    text = f"Crop path: {sources['embedded']} pages from embedded JPEGs ({embedded * 1000:.1f} ms each)"
+    if not sources["render"]:
+        return text + ", none rendered"
+    rendered = source_seconds["render"] / sources["render"]
+    text += f", {sources['render']} rendered ({rendered * 1000:.1f} ms each"
+    if embedded > 0:
+        text += f", {rendered / embedded:.1f}x as long"
+    return text + ")"
+
+
+def run_jobs(jobs, args, journal, instrumentation, on_file_done=None):
+    # jobs: iterable of (pdf_file, normalized box, rotation, pages or None for all).
+    # It is consumed lazily, keeping only a few jobs per worker in flight, so
+    # a scan of a huge tree streams straight into the pool. Spans and profile
+    # stats of the workers are handed to `instrumentation`. on_file_done(pdf_file),
+    # if given, is called as each file finishes and returns more jobs to run
+    # (see dedupe).
+    workers = max(1, args.workers or 1)
+    done = failed = review = files = 0
+    written = encode_seconds = 0.0
+    sources = dict.fromkeys(SOURCES, 0)
+    source_seconds = dict.fromkeys(SOURCES, 0.0)
+    start = time.perf_counter()
+    jobs = iter(jobs)
+    extra = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(args.renderer, instrumentation.worker_options())) as executor:
+        futures = {}
+        while True:
+            while len(futures) < workers * 4:
+                job = extra.popleft() if extra else next(jobs, None)
+                if job is None:
+                    break
+                pdf_file, box, rotation, pages = job
+                pdf_path = os.path.join(args.input, pdf_file)
+                future = executor.submit(traced_call, crop_pdf, pdf_path, pdf_file, args.output, box, rotation, args.settings, pages,
+                                         args.min_confidence, args.embedded)
+                futures[future] = (pdf_file, pdf_path, box, rotation)
+            if not futures:
+                break
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pdf_file, pdf_path, box, rotation = futures.pop(future)
+                try:
+                    results, spans, stats = future.result()
+                except PDFInfoNotInstalledError:
+                    print("Error: Poppler is not installed or not found in PATH.")
+                    print("Please install Poppler and add it to your PATH, or set POPPLER_PATH in crop_pdfs.py.")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return
+                except Exception as e:
+                    print(f"  Error processing {pdf_file}: {e}")
+                    # pages=0: the page count isn't known, so a rerun retries every page
+                    journal.record(pdf_file, pdf_path, "error", box, rotation, error=str(e), pages=0)
+                    failed += 1
+                else:
+                    instrumentation.collect(spans, stats)
+                    files += 1
+                    totals = record_results(pdf_file, pdf_path, rotation, results, args.output, journal)
+                    done += totals["saved"]
+                    review += totals["low_confidence"]
+                    failed += totals["error"]
+                    written += totals["bytes"]
+                    encode_seconds += totals["encode_seconds"]
+                    for source in SOURCES:
+                        sources[source] += totals[source]
+                        source_seconds[source] += totals[source + "_seconds"]
+                if on_file_done is not None:
+                    extra.extend(on_file_done(pdf_file))
+
+    elapsed = time.perf_counter() - start
+    rate = files / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {done} pages saved from {files} files, {failed} failed in {elapsed:.1f}s ({rate:.2f} files/s)")
+    if done:
+        print(f"Wrote {written / (1024 * 1024):.1f} MB as {args.format}, "
+              f"{written / done / 1024:.1f} KB and {encode_seconds / done * 1000:.1f} ms of encoding per page")
+    if sources["embedded"]:
+        print(crop_paths(sources, source_seconds))
+    if review:
+        print(f"{review} pages were below --min-confidence; open the GUI to crop them by hand.")
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Input folder {args.input} does not exist.")
+        return
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    journal = SessionJournal(args.output)
+    try:
+        args.settings = output_settings(args)
+        instrumentation = Instrumentation(args.trace, args.profile)
+    except ValueError as e:
+        print(e)
+        return
+
+    if args.from_journal:
+        # Re-export every saved crop with its own box and rotation
+        jobs = [(r["file"], tuple(r["box"]), r["rotation"], [r.get("page", 1)]) for r in journal.saved()
+                if os.path.exists(os.path.join(args.input, r["file"]))]
+        if not jobs:
+            print(f"No saved crops to re-export in {journal.path}.")
+            return
+        print(f"Re-exporting {len(jobs)} crops from {journal.path} with {args.workers} workers")
+        with instrumentation:
+            run_jobs(jobs, args, journal, instrumentation)
+        return
+
+    try:
+        box, rotation = load_crop_box(args)
+    except ValueError as e:
+        print(e)
+        return
+
+    # Files are found by a lazy scan that feeds the workers as it goes.
+    # Resume: pages already saved/skipped (and unchanged) are left alone.
+    # A rotation chosen for a file in an interactive session overrides the
+    # template's, if the template box fits it (see file_rotation).
+    # Copies of a document are cropped once: the others get its outputs when it
+    # is done (or right away if it was done before; with --force, in this run).
+    counts = {"found": 0, "skipped": 0, "rotated": 0}
+    dedupe = None
+    if args.dedupe:
+        dedupe = Deduplicator(journal, args.input, [suffix for suffix, _, _ in args.settings.sizes],
+                              renderer=get_renderer(args.renderer, POPPLER_PATH) if args.perceptual else None,
+                              perceptual=args.perceptual, since=time.time() if args.force else None)
+
+    def job(pdf_file):
+        # None for a file the template box doesn't fit, reported here
+        pdf_path = os.path.join(args.input, pdf_file)
+        pages = None if args.force else journal.pending_pages(pdf_file, pdf_path)
+        try:
+            return pdf_file, box, file_rotation(journal, pdf_file, rotation, box), pages
+        except ValueError as e:
+            if pages == []:
+                return pdf_file, box, rotation, pages
+            counts["rotated"] += 1
+            print(f"  Error processing {pdf_file}: {e}")
+            journal.record(pdf_file, pdf_path, "error", box, journal.rotation_for(pdf_file), error=str(e), pages=0)
+            return None
+
+    def pending_jobs():
+        for pdf_file in scan_files(args):
+            counts["found"] += 1
+            pdf_job = job(pdf_file)
+            if pdf_job is None:
+                continue
+            if pdf_job[3] == []:
+                counts["skipped"] += 1
+                continue
+            if dedupe is not None and dedupe.check(pdf_file) != "new":
+                continue  # Copied now, or once the first copy is done
+            yield pdf_job
+
+    def copies_left(pdf_file):
+        # The first copy is done: the rest are copied, unless it failed
+        return [pdf_job for pdf_job in map(job, dedupe.original_done(pdf_file)) if pdf_job is not None]
+
+    if args.auto:
+        print(f"Cropping PDF files in {args.input} with {args.workers} workers (auto-detect, min confidence {args.min_confidence:.0%})")
+    else:
+        print(f"Cropping PDF files in {args.input} with {args.workers} workers (box={box}, rotation={rotation})")
+    with instrumentation:
+        run_jobs(pending_jobs(), args, journal, instrumentation, copies_left if dedupe is not None else None)
+    if dedupe is not None and dedupe.files:
+        print(f"Duplicates: {dedupe.files} files were copies of another document; "
+              f"their {dedupe.pages} pages were copied instead of rendered again.")
+    if not counts["found"]:
+        print(f"No PDF files found in {args.input}.")
+    elif counts["skipped"]:
+        print(f"Skipped {counts['skipped']} of {counts['found']} files already done (use --force to redo them).")
+    if counts["rotated"]:
+        print(f"Left out {counts['rotated']} files rotated a quarter turn from the template in the GUI; crop them there.")
+
+
+if __name__ == "__main__":
+    main()
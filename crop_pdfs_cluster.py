@@ -0,0 +1,334 @@
+
+# Batch cropping spread over several machines that share one job queue.
+#
+#   python crop_pdfs_cluster.py enqueue --queue /mnt/share/jobs.sqlite [--auto] [crop options]
+#   python crop_pdfs_cluster.py work --queue /mnt/share/jobs.sqlite [--workers 8]   (on every machine)
+#   python crop_pdfs_cluster.py status --queue /mnt/share/jobs.sqlite [--watch 10]
+#   python crop_pdfs_cluster.py collect --queue /mnt/share/jobs.sqlite
+#
+# enqueue scans the input folder once and stores a job per file still to do,
+# along with the crop settings, in a SQLite file on a filesystem every machine
+# can reach (input and output folders are usually shared the same way). Each
+# worker leases a few jobs at a time, crops them with a local process pool
+# like crop_pdfs_batch.py and marks them done; failed files are retried by
+# whichever worker leases them next, and the files of a worker that dies are
+# taken over once its leases run out. Outputs are written to a temp file and
+# renamed, so a file cropped twice (e.g. after a lost lease) just ends up with
+# the same outputs. Each worker journals to its own session_journal.<worker>.jsonl,
+# since appends from several machines to one file aren't safe on network
+# filesystems; collect merges them into the session journal once the queue is done.
+
+import argparse
+import glob
+import json
+import os
+import re
+import signal
+import socket
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pdf2image.exceptions import PDFInfoNotInstalledError
+
+from crop_pdfs_batch import (add_crop_arguments, add_scan_arguments, crop_pdf, file_rotation, init_worker, load_crop_box,
+                             output_settings, record_results, scan_files)
+from job_queue import LEASE_SECONDS, MAX_ATTEMPTS, JobQueue
+from pdf_render import RENDERERS
+from session_journal import JOURNAL_FILE, SessionJournal
+
+QUEUE_FILE = "crop_jobs.sqlite"
+WORKER_JOURNAL = "session_journal.{}.jsonl"
+POLL_INTERVAL = 10  # Seconds between looks at the queue while there is nothing to lease
+# A queue call that fails (busy timeout, lock failure on a network
+# filesystem) is retried after this many seconds, doubling up to the maximum
+QUEUE_RETRY_DELAY = 2
+QUEUE_RETRY_MAX = 60
+STATUS_WINDOW = 300  # Throughput is measured over this many recent seconds
+
+# Crop settings stored in the queue by enqueue, so every worker crops the same way
+SETTINGS = ("input", "output", "box", "rotation", "min_confidence", "format", "png_compression",
+            "jpeg_quality", "extra_size", "color", "encode_workers", "embedded")
+
+
+def init_cluster_worker(renderer_name):
+    # Ctrl+C is handled by the worker's main process, which hands its leases back
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(renderer_name)
+
+
+def retry_queue(call, *args):
+    # Run a JobQueue call, waiting out sqlite3.OperationalError instead of
+    # letting it kill the worker (which would leave its leases idle until they
+    # expire). Every call is one transaction, so retrying it is safe.
+    delay = QUEUE_RETRY_DELAY
+    while True:
+        try:
+            return call(*args)
+        except sqlite3.OperationalError as e:
+            print(f"  Job queue unavailable ({e}); retrying in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, QUEUE_RETRY_MAX)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def enqueue(args, queue):
+    if not os.path.exists(args.input):
+        print(f"Input folder {args.input} does not exist.")
+        return
+    os.makedirs(args.output, exist_ok=True)
+    try:
+        output_settings(args)
+        box, rotation = load_crop_box(args)
+    except ValueError as e:
+        print(e)
+        return
+    args.box = list(box) if box is not None else None
+    args.rotation = rotation
+    queue.set_settings({name: getattr(args, name) for name in SETTINGS})
+
+    # Like a batch run: pages already finished in the session journal are left
+    # out, and a rotation chosen interactively overrides the template's (if
+    # the template box fits it, see file_rotation)
+    journal = SessionJournal(args.output)
+    counts = {"found": 0, "skipped": 0}
+
+    def jobs():
+        for pdf_file in scan_files(args):
+            counts["found"] += 1
+            pdf_path = os.path.join(args.input, pdf_file)
+            pages = None if args.force else journal.pending_pages(pdf_file, pdf_path)
+            if pages == []:
+                counts["skipped"] += 1
+                continue
+            try:
+                yield pdf_file, file_rotation(journal, pdf_file, rotation, box), pages
+            except ValueError as e:
+                print(f"  Not queued: {pdf_file}: {e}")
+                journal.record(pdf_file, pdf_path, "error", box, journal.rotation_for(pdf_file), error=str(e), pages=0)
+
+    added = queue.add(jobs(), requeue=args.force)
+    print(f"Queued {added} of {counts['found']} files in {queue.path}"
+          + (f" ({counts['skipped']} already done)" if counts["skipped"] else ""))
+    print_status(queue)
+
+
+def work(args, queue):
+    settings = queue.settings()
+    if settings is None:
+        print(f"No jobs in {queue.path}; run enqueue first.")
+        return
+    # Paths may be mounted elsewhere on this machine
+    run = argparse.Namespace(**settings)
+    run.input = args.input or settings["input"]
+    run.output = args.output or settings["output"]
+    run.settings = output_settings(run)
+    box = tuple(run.box) if run.box is not None else None
+    os.makedirs(run.output, exist_ok=True)
+
+    name = args.name or f"{socket.gethostname()}-{os.getpid()}"
+    journal = SessionJournal(run.output, WORKER_JOURNAL.format(re.sub(r"[^\w.-]", "_", name)))
+    workers = max(1, args.workers or 1)
+    print(f"Worker {name}: cropping jobs from {queue.path} with {workers} processes, journal {journal.path}")
+
+    retry_queue(queue.heartbeat, name)
+    files = pages = failed = 0
+    start = time.perf_counter()
+    renewed = time.monotonic()
+    in_flight = {}  # future -> (job id, pdf_file, pdf_path, rotation)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_cluster_worker, initargs=(args.renderer,))
+    try:
+        while True:
+            if len(in_flight) < workers * 2:
+                for job_id, pdf_file, rotation, job_pages in retry_queue(queue.lease, name, workers * 2 - len(in_flight)):
+                    pdf_path = os.path.join(run.input, pdf_file)
+                    future = executor.submit(crop_pdf, pdf_path, pdf_file, run.output, box, rotation, run.settings,
+                                             job_pages, run.min_confidence, run.embedded)
+                    in_flight[future] = (job_id, pdf_file, pdf_path, rotation)
+            if not in_flight:
+                if not args.wait and not retry_queue(queue.remaining):
+                    break
+                time.sleep(args.poll)  # Other workers' jobs may still fail and come back
+                retry_queue(queue.heartbeat, name)
+                continue
+
+            finished, _ = wait(in_flight, timeout=queue.lease_seconds / 3, return_when=FIRST_COMPLETED)
+            done_files = done_pages = 0
+            for future in finished:
+                job_id, pdf_file, pdf_path, rotation = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except PDFInfoNotInstalledError:
+                    print("Error: Poppler is not installed or not found in PATH.")
+                    print("Please install Poppler and add it to your PATH, or set POPPLER_PATH in crop_pdfs.py.")
+                    return
+                except Exception as e:
+                    print(f"  Error processing {pdf_file}: {e}")
+                    journal.record(pdf_file, pdf_path, "error", box, rotation, error=str(e), pages=0)
+                    retry_queue(queue.fail, job_id, name, str(e))
+                    failed += 1
+                    continue
+                totals = record_results(pdf_file, pdf_path, rotation, results, run.output, journal)
+                if totals["error"]:
+                    # Retried as a whole; pages already saved are just written again
+                    error = next(detail for _, status, _, _, detail in results if status == "error")
+                    retry_queue(queue.fail, job_id, name, f"{totals['error']} pages failed: {error}")
+                    failed += 1
+                else:
+                    retry_queue(queue.complete, job_id, name, totals["saved"], totals["low_confidence"])
+                    done_files += 1
+                    done_pages += totals["saved"]
+            files += done_files
+            pages += done_pages
+            if done_files or time.monotonic() - renewed > queue.lease_seconds / 3:
+                retry_queue(queue.renew, name, [job_id for job_id, _, _, _ in in_flight.values()])
+                retry_queue(queue.heartbeat, name, done_files, done_pages)
+                renewed = time.monotonic()
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            released = queue.release(name)
+        except sqlite3.OperationalError as e:
+            print(f"Could not hand unfinished jobs back ({e}); they return to the queue when their leases run out")
+        else:
+            if released:
+                print(f"Handed {released} unfinished jobs back to the queue")
+
+    elapsed = time.perf_counter() - start
+    rate = files / elapsed if elapsed > 0 else 0.0
+    print(f"Worker {name} done: {pages} pages saved from {files} files, {failed} failed attempts "
+          f"in {elapsed:.1f}s ({rate:.2f} files/s)")
+
+
+def print_status(queue, window=STATUS_WINDOW):
+    s = queue.status(window)
+    window = max(s["window"], 1)
+    states = s["states"]
+    remaining = states.get("queued", 0) + states.get("leased", 0)
+    print(f"{s['total']} files: {states.get('done', 0)} done, {states.get('leased', 0)} in progress, "
+          f"{states.get('queued', 0)} queued, {states.get('failed', 0)} failed")
+    files_rate = s["recent_files"] / window
+    if files_rate:
+        print(f"Throughput over the last {format_duration(window)}: {files_rate * 60:.1f} files/min, "
+              f"{s['recent_pages'] / window:.2f} pages/s; "
+              + (f"{remaining} files left, about {format_duration(remaining / files_rate)} to go" if remaining else "all done"))
+    elif remaining:
+        print(f"No files finished in the last {format_duration(window)}; {remaining} files left")
+    now = time.time()
+    for w in s["workers"]:
+        seen = now - w["heartbeat"]
+        state = "gone" if seen > queue.lease_seconds else f"seen {format_duration(seen)} ago"
+        print(f"  {w['name']:<32} {state:<16} {w['leased']:>3} leased  {w['recent_files'] / window * 60:6.1f} files/min  "
+              f"{w['files']} files, {w['pages']} pages in total")
+    return remaining
+
+
+def status(args, queue):
+    if args.retry_failed:
+        print(f"Queued {queue.retry_failed()} failed files again")
+    while True:
+        remaining = print_status(queue, args.window)
+        if not args.watch or not remaining:
+            break
+        time.sleep(args.watch)
+        print()
+    if not args.watch:
+        for row in queue.conn.execute("SELECT file, attempts, error FROM jobs WHERE state = 'failed' ORDER BY id LIMIT 20"):
+            print(f"  Failed after {row['attempts']} attempts: {row['file']} ({row['error']})")
+
+
+def collect(args, queue):
+    # Append the records of every worker journal to the session journal in
+    # the order they were written (the last record per page wins on
+    # resume), and remove the worker journals
+    settings = queue.settings()
+    output = args.output or (settings and settings["output"])
+    if not output:
+        print(f"No jobs in {queue.path}; nothing to collect.")
+        return
+    if queue.remaining() and not args.force:
+        print(f"{queue.remaining()} jobs are not finished yet; collect once the workers are done (or use --force).")
+        return
+    main_path = os.path.join(output, JOURNAL_FILE)
+    paths = sorted(glob.glob(os.path.join(glob.escape(output), WORKER_JOURNAL.format("*"))))
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # Torn last line of a worker that crashed
+    records.sort(key=lambda record: record.get("time", 0))  # Stable: a worker's own order is kept on ties
+    with open(main_path, "a") as out:
+        for record in records:
+            out.write(json.dumps(record) + "\n")
+        out.flush()
+        os.fsync(out.fileno())
+    for path in paths:
+        os.remove(path)
+    print(f"Merged {len(records)} records from {len(paths)} worker journals into {main_path}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crop PDFs with workers on several machines sharing one job queue.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, help):
+        sub = commands.add_parser(name, help=help)
+        sub.add_argument("--queue", default=QUEUE_FILE, help=f"SQLite job queue on a filesystem every worker can reach (default: {QUEUE_FILE})")
+        return sub
+
+    sub = command("enqueue", "Queue every file of the input folder still to do, with the crop settings")
+    add_crop_arguments(sub, processes=False)  # Workers choose their own --workers and --renderer
+    add_scan_arguments(sub)
+    sub.add_argument("--force", action="store_true", help="Also queue files the session journal marks as done, and requeue done jobs")
+
+    sub = command("work", "Crop jobs from the queue until it is empty")
+    sub.add_argument("--input", help="Input folder as mounted on this machine (default: the one given to enqueue)")
+    sub.add_argument("--output", help="Output folder as mounted on this machine (default: the one given to enqueue)")
+    sub.add_argument("--renderer", default="auto", choices=["auto", *RENDERERS], help="Rendering backend (default: auto)")
+    sub.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes (default: all cores)")
+    sub.add_argument("--name", help="Worker name shown by status (default: host-pid)")
+    sub.add_argument("--lease", type=float, default=LEASE_SECONDS, help=f"Seconds before the jobs of a silent worker are given to another (default: {LEASE_SECONDS})")
+    sub.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help=f"Give up on a file after this many failed attempts (default: {MAX_ATTEMPTS})")
+    sub.add_argument("--wait", action="store_true", help="Keep polling for new jobs once the queue is empty")
+    sub.add_argument("--poll", type=float, default=POLL_INTERVAL, help=f"Seconds between looks at an empty queue (default: {POLL_INTERVAL})")
+
+    sub = command("status", "Show progress, throughput and workers")
+    sub.add_argument("--window", type=float, default=STATUS_WINDOW, help=f"Measure throughput over this many recent seconds (default: {STATUS_WINDOW})")
+    sub.add_argument("--watch", type=float, metavar="SECONDS", help="Print the status every SECONDS until the queue is done")
+    sub.add_argument("--retry-failed", action="store_true", help="Queue failed files again with a fresh set of attempts")
+
+    sub = command("collect", "Merge the worker journals into the session journal")
+    sub.add_argument("--output", help="Output folder as mounted on this machine (default: the one given to enqueue)")
+    sub.add_argument("--force", action="store_true", help="Merge even though jobs are unfinished")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command != "enqueue" and not os.path.exists(args.queue):
+        print(f"Job queue {args.queue} does not exist; run enqueue first.")
+        return
+    if args.command == "work":
+        queue = JobQueue(args.queue, args.lease, args.max_attempts)
+    else:
+        queue = JobQueue(args.queue)
+    try:
+        {"enqueue": enqueue, "work": work, "status": status, "collect": collect}[args.command](args, queue)
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
 
+import argparse
 import tkinter as tk
 from tkinter import messagebox
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import os
-from pdf2image import convert_from_path
 from pdf2image.exceptions import PDFInfoNotInstalledError
 import sys
+import threading
+import time
+
+from auto_detect import detect_certificate
+from crop_template import normalize_box, save_template
+from dedupe import Deduplicator
+from display_pyramid import build_pyramid, scale_for_display
+from image_core import to_pil
+from output_encoder import OutputSettings, describe, write_outputs
+from pdf_scanner import scan_pdfs
+from pdf_render import OUTPUT_DPI, PREVIEW_DPI, SOURCES, get_renderer, load_page_array, load_region_array, pixels_to_points, rotate_box, rotated_size, unrotate_box
+from raster_memory import RasterMemory
+from render_cache import RenderCache
+from render_prefetch import RenderPrefetcher, image_nbytes
+from save_writer import SaveWriter
+from session_journal import SessionJournal
+from timing import Instrumentation, add_arguments as add_timing_arguments, recorder
+from work_items import WorkList, output_name
 
 # Configuration
 INPUT_FOLDER = "input_pdfs"
@@ -17,6 +35,61 @@ ASPECT_RATIO = TARGET_WIDTH / TARGET_HEIGHT  # 1.5
 # Poppler Path
 POPPLER_PATH = r"c:\Users\rasheeque raheem\Downloads\PDF CUTTER\poppler-25.12.0\Library\bin"
 
+# Rendering backend: "pdfium" (in-process, needs pypdfium2), "poppler", or
+# "auto" to use pdfium when it is installed and poppler otherwise
+RENDERER = "auto"
+
+# Pages that are a single scanned JPEG are saved from the JPEG itself instead
+# of being rendered again (any other page is rendered)
+EMBEDDED_IMAGES = True
+
+# Background rendering
+PREFETCH_COUNT = 4          # Render up to this many upcoming PDFs ahead of the cursor, memory permitting
+PREFETCH_WORKERS = 2
+POLL_INTERVAL_MS = 50       # How often to check whether the current page has finished rendering
+
+# All page rasters held in memory (previews, display pyramids, the display
+# image, full-DPI crops being saved) are kept within this budget by dropping
+# the least recently used pages; they come back from the render cache on disk
+RASTER_MEMORY_MB = 512
+
+# Pre-place the crop box on the detected certificate (press S to accept)
+AUTO_DETECT = True
+
+# Window resizing: fast redraws while dragging, a high-quality one after this long without changes
+RESIZE_SETTLE_MS = 150
+
+# Background saving
+SAVE_WORKERS = 2
+SAVE_QUEUE_SIZE = 8         # Pressing S blocks only once this many saves are outstanding
+
+# On-disk cache of rendered previews, reused across sessions (0 disables it)
+CACHE_FOLDER = ".render_cache"
+CACHE_MAX_MB = 1024
+
+# Output format: "png" (PNG_COMPRESSION 0-9), "jpeg" (JPEG_QUALITY 1-100) or
+# "webp" (lossless). EXTRA_SIZES are made from the same crop in one pass,
+# e.g. [("_thumb", 150, 100)] also writes name_thumb.png at 150x100.
+OUTPUT_FORMAT = "png"
+PNG_COMPRESSION = 6
+JPEG_QUALITY = 90
+EXTRA_SIZES = []
+ENCODE_WORKERS = 2
+OUTPUT_COLOR = "rgb"  # or "gray": rendered and written as 8-bit grayscale
+
+# Input scanning: walk subfolders too (outputs mirror the folder layout),
+# keeping files that match INCLUDE and none of EXCLUDE (glob patterns)
+RECURSIVE = True
+INCLUDE = ["*.pdf"]
+EXCLUDE = []
+
+# A file with the same content as one already cropped (another name for the
+# same upload) gets a copy of its outputs instead of being shown again. With
+# PERCEPTUAL_DEDUPE, files whose pages merely look the same count too; that
+# renders every page at low resolution while scanning.
+DEDUPLICATE = True
+PERCEPTUAL_DEDUPE = False
+
 class PDFCropperApp:
     def __init__(self, root):
         self.root = root
@@ -24,20 +97,63 @@ class PDFCropperApp:
         self.root.geometry("1400x900")
         
         # Data
-        self.pdf_files = []
+        self.work = None # WorkList of (file, page) items
         self.current_index = 0
-        self.current_pil_image = None
+        self.preview = None # Low-res preview (unrotated RGB array, see image_core), used for display and selection
+        self.page_info = None # Page count/size/rotation from pdf_render.page_info
+        self.rotation = 0 # Degrees clockwise the page is shown (and saved) at
+        self.file_rotations = {} # file -> rotation, so every page of a file keeps it
         self.photo_image = None
         self.scale_factor = 1.0 # If we resize for display
+        self.offset_x = 0
+        self.offset_y = 0
+        self.pyramid = None # Successive halvings of the preview, see display_pyramid
+        self.image_id = None # Canvas item showing the page
+        self.display_key = None # Canvas/image size of the last redraw, to skip no-op redraws
+        self.display_hq = False
+        self.fast_redraw_id = None
+        self.settle_id = None
+        self.requested_at = None # When the current page was asked for, for the render_wait span
+        self.shown_at = None # When it was shown, for the interaction span
+        self.pinned_item = None # Page kept in memory because it is on screen
         
         # Selection state
         self.start_x = None
         self.start_y = None
         self.rect_id = None
-        self.selection_coords = None # (x1, y1, x2, y2) in original image coordinates
+        self.selection_coords = None # (x1, y1, x2, y2) in unrotated preview coordinates
+        
+        # Background rendering of upcoming files, within one memory budget
+        # shared with the display and save buffers; an evicted page's render
+        # is dropped from the prefetcher too, so it can actually be freed
+        self.memory = RasterMemory(RASTER_MEMORY_MB * 1024 * 1024, on_evict=lambda item, result: self.prefetcher.discard(item))
+        self.renderer = get_renderer(RENDERER, POPPLER_PATH)
+        self.render_cache = RenderCache(CACHE_FOLDER, CACHE_MAX_MB * 1024 * 1024) if CACHE_MAX_MB > 0 else None
+        self.prefetcher = RenderPrefetcher(
+            self._render_pdf,
+            max_ahead=PREFETCH_COUNT,
+            memory=self.memory,
+            workers=PREFETCH_WORKERS,
+            buffers=lambda result: {"preview": image_nbytes(result[0]), "pyramid": sum(image_nbytes(level) for level in result[3][1:])},
+        )
+        self.current_future = None
+        self.prefetch_lock = threading.Lock() # Orders the UI's and the work list thread's prefetcher updates
+        self.prefetch_item = None # Item the prefetcher was last pointed at by the UI
+        self.poll_id = None
+        self.journal = None # Per-file progress, so a restart resumes where we left off
+        self.dedupe = None # Copies of documents already cropped, see dedupe.Deduplicator
+        self.copied_files = set() # Files left out of the work list because they were copies
+        self.save_futures = {} # File -> futures of its pages' saves still running, for copies waiting on them
+        
+        # Saves run in the background so the UI advances as soon as S is pressed
+        self.writer = SaveWriter(workers=SAVE_WORKERS, max_pending=SAVE_QUEUE_SIZE)
+        self.output_settings = OutputSettings(OUTPUT_FORMAT, [("", TARGET_WIDTH, TARGET_HEIGHT), *EXTRA_SIZES],
+                                              PNG_COMPRESSION, JPEG_QUALITY, ENCODE_WORKERS, OUTPUT_COLOR)
+        self.save_errors = []
         
         # GUI Setup
         self._setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Load Files
         self._load_files()
@@ -50,6 +166,10 @@ class PDFCropperApp:
         self.lbl_status = tk.Label(control_frame, text="Ready", font=("Arial", 12))
         self.lbl_status.pack(side=tk.LEFT, padx=20)
         
+        # Background save failures show up here instead of in a dialog
+        self.lbl_errors = tk.Label(control_frame, text="", fg="#f44336", font=("Arial", 11))
+        self.lbl_errors.pack(side=tk.LEFT, padx=10)
+        
         btn_frame = tk.Frame(control_frame)
         btn_frame.pack(side=tk.RIGHT, padx=20)
         
@@ -62,6 +182,9 @@ class PDFCropperApp:
         self.btn_skip = tk.Button(btn_frame, text="Skip (N)", command=self.skip_next, bg="#f44336", fg="white", font=("Arial", 11))
         self.btn_skip.pack(side=tk.LEFT, padx=10)
         
+        self.btn_back = tk.Button(btn_frame, text="Back (B)", command=self.previous_file, bg="#9E9E9E", fg="white", font=("Arial", 11))
+        self.btn_back.pack(side=tk.LEFT, padx=10)
+        
         # Canvas Area (No Scrollbars needed for Fit-to-Screen)
         canvas_frame = tk.Frame(self.root, bg="#333333")
         canvas_frame.pack(fill=tk.BOTH, expand=True)
@@ -79,6 +202,9 @@ class PDFCropperApp:
         self.root.bind('<s>', lambda e: self.save_and_next())
         self.root.bind('<n>', lambda e: self.skip_next())
         self.root.bind('<r>', lambda e: self.rotate_image())
+        self.root.bind('<b>', lambda e: self.previous_file())
+        
+        self.root.after(500, self.refresh_status)
         
     def _load_files(self):
         # Create directories
@@ -89,21 +215,96 @@ class PDFCropperApp:
             messagebox.showinfo("Info", f"Created '{INPUT_FOLDER}'. Please add PDFs.")
             return
 
-        self.pdf_files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith('.pdf')]
-        
-        if not self.pdf_files:
-            messagebox.showinfo("Info", f"No PDF files found in '{INPUT_FOLDER}'.")
+        # Resume: leave out files (and pages) already saved/skipped in a previous session
+        self.journal = SessionJournal(OUTPUT_FOLDER)
+        if DEDUPLICATE:
+            self.dedupe = Deduplicator(self.journal, INPUT_FOLDER, [suffix for suffix, _, _ in self.output_settings.sizes],
+                                       self.renderer, PERCEPTUAL_DEDUPE)
+            
+        # Files are found by a lazy scan and split into pages as the cursor
+        # gets close to them, so the first page shows before the scan is done
+        self.work = WorkList(
+            scan_pdfs(INPUT_FOLDER, RECURSIVE, INCLUDE, EXCLUDE),
+            page_count=lambda f: self.renderer.page_info(os.path.join(INPUT_FOLDER, f))["pages"],
+            keep=lambda item: not self.journal.is_finished(item.file, os.path.join(INPUT_FOLDER, item.file), item.page),
+            keep_file=self.keep_file,
+            background=True,
+        )
+        if not self.work.get(0):
+            if not self.work.files_seen:
+                messagebox.showinfo("Info", f"No PDF files found in '{INPUT_FOLDER}'.")
+            else:
+                messagebox.showinfo("Info", f"All {self.work.files_seen} files were already processed or copies of processed ones (see {self.journal.path}).")
             return
+        if self.work.files_skipped > len(self.copied_files):
+            print(f"Resuming: skipped {self.work.files_skipped - len(self.copied_files)} files already done in a previous session.")
             
         self.load_current_pdf()
 
+    def keep_file(self, pdf_file):
+        # WorkList filter: leave out finished files, and copies of finished
+        # documents after copying their outputs
+        if self.journal.is_finished(pdf_file, os.path.join(INPUT_FOLDER, pdf_file)):
+            return False
+        if self.dedupe and self.dedupe.copy_finished(pdf_file):
+            self.copied_files.add(pdf_file)
+            return False
+        return True
+
+    def skip_copies(self):
+        # The file under the cursor may be a copy of one cropped since it was
+        # queued (e.g. the file just before it): reuse those crops and move on,
+        # then load whatever is under the cursor. If saves of the original are
+        # still running, poll until they are done rather than blocking the UI.
+        if self.poll_id:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
+        while self.dedupe:
+            item = self.current_item()
+            if item is None or (self.current_index > 0 and self.work.get(self.current_index - 1).file == item.file):
+                break
+            if not self.dedupe.is_copy(item.file):
+                break
+            original = self.dedupe.original(item.file)
+            if not all(future.done() for future in self.save_futures.get(original, ())):
+                # Nothing on screen to save or skip while waiting
+                self.preview = None
+                self.selection_coords = None
+                self.rect_id = None
+                self.canvas.delete("all")
+                self.image_id = None
+                self.lbl_status.config(text=f"Waiting for {original} to be saved...")
+                self.poll_id = self.root.after(POLL_INTERVAL_MS, self.skip_copies)
+                return
+            if not self.dedupe.copy_finished(item.file):
+                break
+            print(f"Copied: {item.file} is the same document as one already cropped")
+            while self.current_item() and self.current_item().file == item.file:
+                self.current_index += 1
+        self.load_current_pdf()
+
     def on_resize(self, event):
-        # Redraw image when window resizes
-        if self.current_pil_image:
-            self.display_image()
+        # <Configure> arrives in bursts while the window is dragged: coalesce
+        # them into one fast redraw, and do the high-quality pass only once
+        # resizing has settled
+        if self.preview is None:
+            return
+        if not self.fast_redraw_id:
+            self.fast_redraw_id = self.root.after_idle(self.fast_redraw)
+        if self.settle_id:
+            self.root.after_cancel(self.settle_id)
+        self.settle_id = self.root.after(RESIZE_SETTLE_MS, self.settled_redraw)
+
+    def fast_redraw(self):
+        self.fast_redraw_id = None
+        self.display_image(high_quality=False)
+
+    def settled_redraw(self):
+        self.settle_id = None
+        self.display_image()
 
-    def display_image(self):
-        if not self.current_pil_image:
+    def display_image(self, high_quality=True):
+        if self.preview is None:
             return
             
         # Get canvas dimensions
@@ -113,8 +314,8 @@ class PDFCropperApp:
         if canvas_width <= 1 or canvas_height <= 1:
             return # Too small or not ready
             
-        # Calculate scale factor to fit
-        img_w, img_h = self.current_pil_image.size
+        # Calculate scale factor to fit the page as shown, i.e. rotated
+        img_w, img_h = rotated_size(self.preview_size(), self.rotation)
         
         scale_w = canvas_width / img_w
         scale_h = canvas_height / img_h
@@ -124,46 +325,218 @@ class PDFCropperApp:
         new_w = int(img_w * self.scale_factor)
         new_h = int(img_h * self.scale_factor)
         
-        # Resize for display
-        resized_img = self.current_pil_image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        self.photo_image = ImageTk.PhotoImage(resized_img)
+        # Nothing changed since the last (at least as good) redraw
+        key = (canvas_width, canvas_height, new_w, new_h, self.rotation)
+        if self.display_key == key and (self.display_hq or not high_quality):
+            return
+        self.display_key = key
+        self.display_hq = high_quality
+        
+        # Resize for display, starting from the nearest pyramid level; only
+        # this small display image is rotated
+        item = self.current_item()
+        with recorder.span("display" if high_quality else "display_fast", output_name(item, '')):
+            resized_img = scale_for_display(self.pyramid, new_w, new_h, high_quality, self.rotation)
+            self.photo_image = ImageTk.PhotoImage(to_pil(resized_img))
+        # Tk keeps its own 32-bit copy of the display image
+        self.memory.track(item, "display", new_w * new_h * 4)
         
         # Center image
         self.offset_x = (canvas_width - new_w) // 2
         self.offset_y = (canvas_height - new_h) // 2
         
-        self.canvas.delete("all")
-        self.canvas.create_image(self.offset_x, self.offset_y, image=self.photo_image, anchor=tk.NW)
+        if self.image_id:
+            self.canvas.itemconfig(self.image_id, image=self.photo_image)
+            self.canvas.coords(self.image_id, self.offset_x, self.offset_y)
+        else:
+            self.image_id = self.canvas.create_image(self.offset_x, self.offset_y, image=self.photo_image, anchor=tk.NW)
         
-        # Clear selection on reload/resize
-        self.rect_id = None
-        self.selection_coords = None
+        # Keep the selection: re-project it onto the new scale
+        if self.selection_coords:
+            self.draw_selection()
+
+    def preview_size(self):
+        height, width = self.preview.shape[:2]
+        return width, height
+
+    def selection_to_canvas(self):
+        # selection_coords (unrotated preview) -> canvas coordinates
+        img_w, img_h = self.preview_size()
+        x1, y1, x2, y2 = rotate_box(self.selection_coords, self.rotation, img_w, img_h)
+        return (x1 * self.scale_factor + self.offset_x, y1 * self.scale_factor + self.offset_y,
+                x2 * self.scale_factor + self.offset_x, y2 * self.scale_factor + self.offset_y)
+
+    def canvas_to_selection(self, x1, y1, x2, y2):
+        # Canvas coordinates -> unrotated preview coordinates
+        box = (
+            (min(x1, x2) - self.offset_x) / self.scale_factor,
+            (min(y1, y2) - self.offset_y) / self.scale_factor,
+            (max(x1, x2) - self.offset_x) / self.scale_factor,
+            (max(y1, y2) - self.offset_y) / self.scale_factor,
+        )
+        img_w, img_h = self.preview_size()
+        return unrotate_box(box, self.rotation, img_w, img_h)
+
+    def draw_selection(self):
+        # Draw selection_coords onto the canvas
+        if self.rect_id:
+            self.canvas.delete(self.rect_id)
+        self.rect_id = self.canvas.create_rectangle(*self.selection_to_canvas(), outline="red", width=2, dash=(5, 5))
+
+    def _render_pdf(self, item):
+        # Runs on a prefetch thread - must not touch any Tk widgets.
+        # The prefetcher keeps the result in self.memory, and reuses pages
+        # visited or prefetched before while they are still there.
+        pdf_path = os.path.join(INPUT_FOLDER, item.file)
+        label = output_name(item, '')
+        with recorder.span("render", label):
+            pixels, info = load_page_array(self.renderer, pdf_path, dpi=PREVIEW_DPI, page=item.page, cache=self.render_cache)
+        
+        # Propose a crop box and build the display pyramid while we're still off the UI thread
+        with recorder.span("detect", label):
+            proposal = detect_certificate(pixels, ASPECT_RATIO) if AUTO_DETECT else None
+        with recorder.span("pyramid", label):
+            pyramid = build_pyramid(pixels)
+        return pixels, info, proposal, pyramid
+
+    def current_item(self):
+        return self.work.get(self.current_index) if self.work else None
 
     def load_current_pdf(self):
-        if self.current_index >= len(self.pdf_files):
-            messagebox.showinfo("Done", "All files processed!")
+        if self.poll_id:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
+
+        item = self.current_item()
+        if item is None:
+            self.stop_background()
+            self.finish_saves()
+            copies = ""
+            if self.dedupe and self.dedupe.files:
+                copies = (f"\n\n{self.dedupe.files} files were copies of documents already cropped; their "
+                          f"{self.dedupe.pages} pages were copied instead of being rendered and shown again.")
+                print(copies.strip())
+            if self.save_errors:
+                messagebox.showwarning("Done", f"All files processed, but {len(self.save_errors)} save(s) failed. See the console for details.{copies}")
+            else:
+                messagebox.showinfo("Done", f"All files processed!{copies}")
             self.root.quit()
             return
             
-        pdf_file = self.pdf_files[self.current_index]
-        self.lbl_status.config(text=f"Processing [{self.current_index + 1}/{len(self.pdf_files)}]: {pdf_file}")
+        # Only the current item is waited for; files further ahead are split
+        # into pages (page counts, journal and copy filters) on the work
+        # list's own thread, which then widens the prefetch window
+        upcoming = self.work.upcoming(self.current_index, PREFETCH_COUNT)
         
-        pdf_path = os.path.join(INPUT_FOLDER, pdf_file)
+        # Only the page on screen is exempt from eviction; the old page's
+        # display image goes away with the canvas below
+        if self.pinned_item is not None:
+            self.memory.track(self.pinned_item, "display", 0)
+            self.memory.unpin(self.pinned_item)
+        self.memory.pin(item)
+        self.pinned_item = item
         
-        try:
-            # Convert PDF to Image
-            images = convert_from_path(pdf_path, first_page=1, last_page=1, dpi=300, poppler_path=POPPLER_PATH)
-            if not images:
-                self.lbl_status.config(text=f"Error reading {pdf_file}")
-                return
+        # Drop the old page and hand the current + upcoming pages to the prefetcher
+        self.preview = None
+        self.rotation = self.file_rotations.get(item.file, self.journal.rotation_for(item.file))
+        self.rect_id = None
+        self.selection_coords = None
+        self.canvas.delete("all")
+        self.image_id = None
+        self.display_key = None
+        self.requested_at = time.perf_counter()
+        with self.prefetch_lock:
+            self.prefetch_item = item
+            self.current_future = self.prefetcher.update(item, upcoming)
+        expanding = self.work.prefetch(self.current_index + 1 + PREFETCH_COUNT)
+        if expanding is not None:
+            index = self.current_index
+            expanding.add_done_callback(lambda future: self.extend_prefetch(item, index))
+        self.wait_for_render()
+
+    def extend_prefetch(self, item, index):
+        # Runs on the work list's thread once more of the window is known;
+        # a stale call (the UI has moved on) must not retarget the prefetcher
+        with self.prefetch_lock:
+            if self.prefetch_item == item:
+                self.prefetcher.update(item, self.work.upcoming(index, PREFETCH_COUNT))
+
+    def stop_background(self):
+        with self.prefetch_lock:
+            self.prefetch_item = None
+        if self.work:
+            self.work.close()
+        self.prefetcher.shutdown()
+
+    def wait_for_render(self):
+        # Poll instead of blocking so the UI stays responsive while poppler runs
+        if not self.current_future.done():
+            self.update_status("Rendering")
+            self.poll_id = self.root.after(POLL_INTERVAL_MS, self.wait_for_render)
+            return
+        self.poll_id = None
             
-            self.current_pil_image = images[0]
+        item = self.current_item()
+        try:
+            self.preview, self.page_info, proposal, self.pyramid = self.current_future.result()
+            now = time.perf_counter()
+            recorder.add("render_wait", output_name(item, ''), self.requested_at, now - self.requested_at)
+            self.shown_at = now
+            self.update_status()
             self.display_image()
             
+            # Pre-place the detected box; S accepts it as-is
+            if proposal:
+                self.selection_coords, confidence = proposal
+                self.draw_selection()
+                self.lbl_status.config(text=self.lbl_status.cget("text") + f"    [auto box {confidence:.0%}]")
+            
         except PDFInfoNotInstalledError:
             messagebox.showerror("Error", "Poppler not found. Please check configuration.")
         except Exception as e:
+            self.journal.record(item.file, os.path.join(INPUT_FOLDER, item.file), "error", error=str(e), page=item.page, pages=item.pages)
+            self.lbl_status.config(text=f"Error reading {item.file} (page {item.page})")
             messagebox.showerror("Error", f"Failed to load PDF: {str(e)}")
+
+    def update_status(self, state="Processing"):
+        item = self.current_item()
+        ready, pending = self.prefetcher.stats(current=item)
+        memory = self.memory.usage()
+        page = f" - page {item.page}/{item.pages}" if item.pages > 1 else ""
+        self.lbl_status.config(
+            text=f"{state} [{self.work.file_position(item)}/{self.work.file_total()}]: {item.file}{page}"
+                 f"    (prefetch: {ready} ready, {pending} queued; saving: {self.writer.pending()}; "
+                 f"memory: {memory['bytes'] / (1024 * 1024):.0f}/{memory['budget'] / (1024 * 1024):.0f} MB)"
+        )
+
+    def refresh_status(self):
+        # Keep the prefetch/save queue depths in the status bar current
+        if self.preview is not None and self.current_item():
+            self.update_status()
+        self.show_save_errors()
+        self.root.after(500, self.refresh_status)
+
+    def show_save_errors(self):
+        errors = self.writer.pop_errors()
+        if errors:
+            self.save_errors.extend(errors)
+            name, e = errors[-1]
+            self.lbl_errors.config(text=f"{len(self.save_errors)} save(s) failed - last: {name}: {e}")
+            for name, e in errors:
+                print(f"Failed to save {name}: {e}")
+
+    def finish_saves(self):
+        # Make sure nothing queued is lost when the app goes away
+        if self.writer.pending():
+            self.lbl_status.config(text=f"Finishing {self.writer.pending()} queued save(s)...")
+            self.root.update_idletasks()
+        self.writer.flush()
+        self.show_save_errors()
+
+    def on_close(self):
+        self.stop_background()
+        self.finish_saves()
+        self.root.destroy()
             
     def on_press(self, event):
         x, y = event.x, event.y
@@ -175,11 +548,7 @@ class PDFCropperApp:
         # Check if we have an existing selection
         if self.selection_coords:
             # Convert image coords back to canvas coords for hit testing
-            ix1, iy1, ix2, iy2 = self.selection_coords
-            cx1 = ix1 * self.scale_factor + self.offset_x
-            cy1 = iy1 * self.scale_factor + self.offset_y
-            cx2 = ix2 * self.scale_factor + self.offset_x
-            cy2 = iy2 * self.scale_factor + self.offset_y
+            cx1, cy1, cx2, cy2 = self.selection_to_canvas()
             
             # Normalize for hit testing
             x1, y1 = min(cx1, cx2), min(cy1, cy2)
@@ -315,15 +684,8 @@ class PDFCropperApp:
         # Finalize coords (Canvas Coordinates)
         coords = self.canvas.coords(self.rect_id)
         if coords:
-            x1, y1, x2, y2 = coords
-            
             # Convert Canvas Coords -> Image Coords
-            img_x1 = (min(x1, x2) - self.offset_x) / self.scale_factor
-            img_y1 = (min(y1, y2) - self.offset_y) / self.scale_factor
-            img_x2 = (max(x1, x2) - self.offset_x) / self.scale_factor
-            img_y2 = (max(y1, y2) - self.offset_y) / self.scale_factor
-            
-            self.selection_coords = (img_x1, img_y1, img_x2, img_y2)
+            self.selection_coords = self.canvas_to_selection(*coords)
         
         self.interaction_mode = None
             
@@ -332,60 +694,115 @@ class PDFCropperApp:
             messagebox.showwarning("Warning", "Please draw a selection box first.")
             return
             
-        try:
-            x1, y1, x2, y2 = self.selection_coords
-            
-            # Crop
-            # Ensure we are within bounds of the ORIGINAL image
-            img_w, img_h = self.current_pil_image.size
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(img_w, x2)
-            y2 = min(img_h, y2)
-
-            if x2 <= x1 + 5 or y2 <= y1 + 5: # Small threshold
-                messagebox.showwarning("Error", "Selection too small.")
-                return
+        x1, y1, x2, y2 = self.selection_coords
+        
+        # Ensure we are within bounds of the preview image
+        img_w, img_h = self.preview_size()
+        x1 = max(0, x1)
+        y1 = max(0, y1)
+        x2 = min(img_w, x2)
+        y2 = min(img_h, y2)
 
-            crop = self.current_pil_image.crop((x1, y1, x2, y2))
-            
-            # Resize
-            # Use LANCZOS (formerly ANTIALIAS)
-            resized = crop.resize((TARGET_WIDTH, TARGET_HEIGHT), Image.Resampling.LANCZOS)
-            
-            # Save
-            if self.current_index < len(self.pdf_files):
-                current_file = self.pdf_files[self.current_index]
-                output_filename = os.path.splitext(current_file)[0] + ".png"
-                output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-                
-                resized.save(output_path, "PNG")
-                print(f"Saved: {output_path}")
+        if x2 <= x1 + 5 or y2 <= y1 + 5: # Small threshold
+            messagebox.showwarning("Error", "Selection too small.")
+            return
+
+        item = self.current_item()
+        if item is None:
+            return
+
+        # The selection is already on the unrotated page; rotation is applied to the crop only
+        box = (x1, y1, x2, y2)
+        self.record_interaction(item)
+        
+        # Render, resize and encode in the background and move on right away
+        self.track_save(item, self.writer.submit(output_name(item), self.write_crop, item, box, (img_w, img_h), self.rotation))
+        self.next_file()
+
+    def write_crop(self, item, box, page_size, rotation):
+        # Runs on a save thread - must not touch any Tk widgets
+        pdf_path = os.path.join(INPUT_FOLDER, item.file)
+        norm_box = normalize_box(box, page_size)
+        label = output_name(item, '')
+        # Room for the full-DPI crop is made in the memory budget before it is rendered
+        scale = OUTPUT_DPI / PREVIEW_DPI
+        crop_bytes = int((box[2] - box[0]) * scale) * int((box[3] - box[1]) * scale) * (1 if OUTPUT_COLOR == "gray" else 3)
+        try:
+            with self.memory.reserve("crop", crop_bytes):
+                # Render just the selected region at full DPI, straight into an array
+                # (or cut from the page's embedded JPEG scan, see EMBEDDED_IMAGES)
+                with recorder.span("crop", label):
+                    crop, source = load_region_array(self.renderer, pdf_path, pixels_to_points(box, PREVIEW_DPI), item.page,
+                                                     OUTPUT_DPI, OUTPUT_COLOR, EMBEDDED_IMAGES)
                 
-            self.skip_next()
-                 
+                # Resize (plus any EXTRA_SIZES), rotate the small result and save
+                outputs = write_outputs(crop, OUTPUT_FOLDER, label, self.output_settings, rotation)
+                del crop
+            output_filename = os.path.relpath(outputs[0].path, OUTPUT_FOLDER)  # Mirrors the input subfolder
+            print(f"Saved: {outputs[0].path} ({describe(outputs)}, {SOURCES[source]})")
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to save: {str(e)}")
+            self.journal.record(item.file, pdf_path, "error", norm_box, rotation, error=str(e), page=item.page, pages=item.pages)
+            raise
+        
+        # Remember this crop so crop_pdfs_batch.py can apply it to the rest
+        save_template(box, page_size, rotation)
+        self.journal.record(item.file, pdf_path, "saved", norm_box, rotation, output_filename, page=item.page, pages=item.pages)
 
     def rotate_image(self):
-        if not self.current_pil_image:
+        if self.preview is None:
             return
             
-        # Rotate 90 degrees clockwise (PIL rotate is counter-clockwise, so -90)
-        # expand=True resizing the canvas to fit the new dimensions
-        self.current_pil_image = self.current_pil_image.rotate(-90, expand=True)
-        
-        # Clear any existing selection as coords are invalid now
+        # Rotate 90 degrees clockwise. Rotation is just page state: the page
+        # buffer stays as it is, only the display image is transposed, and the
+        # full-DPI crop is rotated on save. A quarter turn swaps the box's
+        # aspect ratio on screen, so the selection has to be drawn again
+        self.rotation = (self.rotation + 90) % 360
+        self.file_rotations[self.current_item().file] = self.rotation
+        if self.rect_id:
+            self.canvas.delete(self.rect_id)
         self.rect_id = None
         self.selection_coords = None
-        
+        self.display_key = None
         self.display_image()
             
+    def record_interaction(self, item):
+        # Time from the page appearing to S or Skip
+        if self.shown_at is not None:
+            recorder.add("interaction", output_name(item, ''), self.shown_at, time.perf_counter() - self.shown_at)
+            self.shown_at = None
+
+    def track_save(self, item, future):
+        # Remember the save (or skip record) of a page until it is done, so
+        # copies of its file can wait for it (see skip_copies)
+        self.save_futures = {f: [x for x in futures if not x.done()] for f, futures in self.save_futures.items()
+                             if not all(x.done() for x in futures)}
+        self.save_futures.setdefault(item.file, []).append(future)
+
     def skip_next(self):
+        item = self.current_item()
+        if item is not None:
+            self.record_interaction(item)
+            # Journaled on a save thread: the record hashes the source PDF
+            self.track_save(item, self.writer.submit(output_name(item), self.journal.record, item.file, os.path.join(INPUT_FOLDER, item.file),
+                                                     "skipped", None, self.rotation, None, None, item.page, item.pages))
+        self.next_file()
+        
+    def next_file(self):
         self.current_index += 1
-        self.load_current_pdf()
+        self.skip_copies()
+        
+    def previous_file(self):
+        # Go back one page (e.g. to redo a crop); nothing is recorded
+        if self.current_index > 0:
+            self.current_index -= 1
+            self.load_current_pdf()
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = PDFCropperApp(root)
-    root.mainloop()
+    parser = argparse.ArgumentParser(description="Crop PDF certificates interactively.")
+    add_timing_arguments(parser)
+    args = parser.parse_args()
+    with Instrumentation(args.trace, args.profile):
+        root = tk.Tk()
+        app = PDFCropperApp(root)
+        root.mainloop()
+        app.writer.flush()
@@ -0,0 +1,192 @@
+
+# Watch-folder daemon: crops PDFs as they arrive in the input folder.
+#
+#   python crop_pdfs_watch.py [--auto] [--workers 4] [--queue-size 32]
+#
+# New files are picked up through inotify & co. (pip install watchdog) or by
+# polling, handed on once they have finished being written, and cropped by a
+# pool of worker processes with the stored template or auto-detection. Every
+# result goes to the session journal like the batch mode's. Live counters
+# (queue depth, in flight, done, latency) are printed every --stats-interval
+# seconds and written to watch_stats.json in the output folder.
+
+import argparse
+import json
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pdf2image.exceptions import PDFInfoNotInstalledError
+
+from crop_pdfs import EXCLUDE, INCLUDE
+from crop_pdfs_batch import add_crop_arguments, crop_pdf, file_rotation, init_worker, load_crop_box, output_settings, record_results
+from folder_watch import POLL_INTERVAL, SETTLE_SECONDS, FolderWatcher
+from session_journal import SessionJournal
+
+STATS_FILE = "watch_stats.json"
+LATENCY_WINDOW = 1000  # Latency percentiles are over this many recent files
+
+
+def init_watch_worker(renderer_name):
+    # Ctrl+C is handled by the daemon, which shuts the pool down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(renderer_name)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+class WatchStats:
+    """Live counters of the daemon, printed and written to a JSON file."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.files = self.saved = self.review = self.failed = 0
+        self.latency = deque(maxlen=LATENCY_WINDOW)  # arrival -> done, seconds
+        self.queue_wait = deque(maxlen=LATENCY_WINDOW)  # settled -> submitted, seconds
+
+    def snapshot(self, waiting, in_flight, settling):
+        elapsed = time.monotonic() - self.started
+        return {
+            "time": time.time(),
+            "uptime_s": round(elapsed, 1),
+            "settling": settling,
+            "queued": waiting,
+            "in_flight": in_flight,
+            "files": self.files,
+            "pages_saved": self.saved,
+            "pages_review": self.review,
+            "failed": self.failed,
+            "files_per_hour": round(self.files * 3600 / elapsed, 1) if elapsed > 0 else 0.0,
+            "latency_p50_s": percentile(self.latency, 50),
+            "latency_p95_s": percentile(self.latency, 95),
+            "queue_wait_p50_s": percentile(self.queue_wait, 50),
+        }
+
+
+def write_stats(path, snapshot):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(tmp, path)
+
+
+def format_stats(s):
+    latency = f"{s['latency_p50_s']:.1f}s / {s['latency_p95_s']:.1f}s" if s["latency_p50_s"] is not None else "-"
+    return (f"[watch] settling {s['settling']}, queued {s['queued']}, in flight {s['in_flight']}, "
+            f"{s['files']} files ({s['files_per_hour']:.0f}/h), {s['failed']} failed, latency p50/p95 {latency}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Watch a folder and crop PDFs as they arrive.")
+    add_crop_arguments(parser)
+    parser.add_argument("--queue-size", type=int, default=0, help="Files submitted to the workers at once (default: 4 per worker)")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, help=f"Seconds a new file must stay unchanged before it is cropped (default: {SETTLE_SECONDS})")
+    parser.add_argument("--poll", action="store_true", help="Poll the folder instead of using filesystem events")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help=f"Seconds between polls (default: {POLL_INTERVAL})")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="Seconds between status lines and stats file updates (default: 10)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Input folder {args.input} does not exist.")
+        return
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    journal = SessionJournal(args.output)
+    try:
+        settings = output_settings(args)
+        box, template_rotation = load_crop_box(args)
+    except ValueError as e:
+        print(e)
+        return
+
+    workers = max(1, args.workers or 1)
+    queue_size = args.queue_size or workers * 4
+    watcher = FolderWatcher(args.input, recursive=args.recursive, include=args.include or INCLUDE, exclude=args.exclude or EXCLUDE,
+                            settle=args.settle, poll_interval=args.poll_interval, use_polling=args.poll)
+    stats = WatchStats()
+    stats_path = os.path.join(args.output, STATS_FILE)
+    waiting = deque()  # (pdf_file, arrived, settled), not yet handed to the pool; at most queue_size
+    in_flight = {}  # future -> (pdf_file, pdf_path, rotation, arrived)
+    next_stats = time.monotonic() + args.stats_interval
+
+    mode = "auto-detect" if args.auto else f"template {args.template}"
+    print(f"Watching {args.input} ({watcher.mode}) with {workers} workers, {mode}. Ctrl+C to stop.")
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_watch_worker, initargs=(args.renderer,))
+    watcher.start()
+    try:
+        while True:
+            now = time.monotonic()
+            # Backpressure: only take as many settled files as the pool has room
+            # for; the rest stay with the watcher until a later pass
+            room = queue_size - len(in_flight) - len(waiting)
+            for pdf_file, arrived in watcher.ready(now, limit=max(0, room)):
+                waiting.append((pdf_file, arrived, now))
+
+            # Bounded hand-off: at most queue_size files are queued in or running on the pool
+            while waiting and len(in_flight) < queue_size:
+                pdf_file, arrived, settled = waiting.popleft()
+                pdf_path = os.path.join(args.input, pdf_file)
+                pages = journal.pending_pages(pdf_file, pdf_path)
+                if pages == []:
+                    continue  # Already done and unchanged
+                try:
+                    rotation = file_rotation(journal, pdf_file, template_rotation, box)
+                except ValueError as e:
+                    print(f"  Error processing {pdf_file}: {e}")
+                    journal.record(pdf_file, pdf_path, "error", box, journal.rotation_for(pdf_file), error=str(e), pages=0)
+                    stats.failed += 1
+                    continue
+                future = executor.submit(crop_pdf, pdf_path, pdf_file, args.output, box, rotation, settings, pages, args.min_confidence,
+                                         args.embedded)
+                in_flight[future] = (pdf_file, pdf_path, rotation, arrived)
+                stats.queue_wait.append(time.monotonic() - settled)
+
+            for future in [f for f in in_flight if f.done()]:
+                pdf_file, pdf_path, rotation, arrived = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except PDFInfoNotInstalledError:
+                    print("Error: Poppler is not installed or not found in PATH.")
+                    print("Please install Poppler and add it to your PATH, or set POPPLER_PATH in crop_pdfs.py.")
+                    return
+                except Exception as e:
+                    print(f"  Error processing {pdf_file}: {e}")
+                    journal.record(pdf_file, pdf_path, "error", box, rotation, error=str(e), pages=0)
+                    stats.failed += 1
+                    continue
+                totals = record_results(pdf_file, pdf_path, rotation, results, args.output, journal)
+                stats.files += 1
+                stats.saved += totals["saved"]
+                stats.review += totals["low_confidence"]
+                stats.failed += totals["error"] > 0
+                stats.latency.append(time.monotonic() - arrived)
+
+            if now >= next_stats:
+                next_stats = now + args.stats_interval
+                snapshot = stats.snapshot(len(waiting), len(in_flight), watcher.settling())
+                print(format_stats(snapshot))
+                write_stats(stats_path, snapshot)
+
+            time.sleep(0.2 if not in_flight else 0.05)
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        watcher.stop()
+        executor.shutdown(wait=True, cancel_futures=True)
+        snapshot = stats.snapshot(len(waiting), 0, watcher.settling())
+        write_stats(stats_path, snapshot)
+        print(format_stats(snapshot))
+
+
+if __name__ == "__main__":
+    main()
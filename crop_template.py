@@ -0,0 +1,46 @@
+
+import json
+import os
+import threading
+
+# The last crop made interactively is saved here so it can be replayed headlessly
+TEMPLATE_FILE = "crop_template.json"
+
+
+def normalize_box(box, page_size):
+    # (x1, y1, x2, y2) in any unit -> fractions of the page (0..1)
+    w, h = page_size
+    x1, y1, x2, y2 = box
+    return (x1 / w, y1 / h, x2 / w, y2 / h)
+
+
+def denormalize_box(box, page_size):
+    w, h = page_size
+    x1, y1, x2, y2 = box
+    return (x1 * w, y1 * h, x2 * w, y2 * h)
+
+
+def save_template(box, page_size, rotation=0, path=TEMPLATE_FILE):
+    # `box` is on the unrotated page; `rotation` is applied to the crop afterwards
+    data = {
+        "box": [round(v, 6) for v in normalize_box(box, page_size)],
+        "rotation": rotation % 360,
+    }
+    # Write then rename, so concurrent saves never leave a torn file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_template(path=TEMPLATE_FILE):
+    with open(path) as f:
+        data = json.load(f)
+
+    box = tuple(float(v) for v in data["box"])
+    rotation = int(data.get("rotation", 0)) % 360
+    if len(box) != 4 or not (0 <= box[0] < box[2] <= 1 and 0 <= box[1] < box[3] <= 1):
+        raise ValueError(f"Invalid crop box in {path}: {data['box']}")
+    if rotation % 90:
+        raise ValueError(f"Invalid rotation in {path}: {rotation}")
+    return box, rotation
@@ -0,0 +1,202 @@
+
+import os
+import shutil
+import socket
+import threading
+
+import cv2
+import numpy as np
+
+from render_cache import source_digest
+from work_items import WorkItem, output_name
+
+# Perceptual matching renders every page in grayscale at PHASH_DPI, shrinks
+# it to THUMB_WIDTH pixels wide and keeps a 64-bit difference hash of it.
+# Documents with the same number of pages whose hashes are within
+# PHASH_DISTANCE bits are candidates; they match if no thumbnail pixel differs
+# by more than PIXEL_TOLERANCE levels. The hash alone can't tell two
+# certificates apart that differ only in the name; the pixel check can, while
+# letting re-encoded or re-exported copies through.
+PHASH_DPI = 72
+THUMB_WIDTH = 128
+PHASH_DISTANCE = 8
+PIXEL_TOLERANCE = 32
+
+
+def page_dhash(gray):
+    # 9x8 area-averaged thumbnail, one bit per horizontally adjacent pair:
+    # unaffected by re-encoding, resolution and small rendering differences
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), "big")
+
+
+def page_thumb(gray):
+    height = max(1, round(gray.shape[0] * THUMB_WIDTH / gray.shape[1]))
+    return cv2.resize(gray, (THUMB_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+
+def _looks_same(a, b):
+    # a, b: [(dhash, thumbnail)] per page
+    return len(a) == len(b) and all(
+        bin(ha ^ hb).count("1") <= PHASH_DISTANCE and ta.shape == tb.shape
+        and np.abs(ta.astype(np.int16) - tb).max() <= PIXEL_TOLERANCE
+        for (ha, ta), (hb, tb) in zip(a, b))
+
+
+def _copy_file(src, dst):
+    # Temp file + rename, like every other output write
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    tmp = f"{dst}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Deduplicator:
+    """Recognises input files that are copies of another document and reuses its crops.
+
+    Files are grouped by content hash (the journal's source_hash), so a copy
+    under another name is found in this session or any later one. With
+    `perceptual`, files whose bytes differ but whose pages look the same
+    (re-saved or re-exported copies) are grouped too; that costs a low-res
+    render of every page and a small thumbnail per page kept in memory, so
+    it is off by default and only compares files seen in this session.
+
+    Once any file of a group is finished in the journal, the other files get
+    its outputs copied to their own output names and journal records of
+    their own (with duplicate_of), instead of being rendered and shown again.
+    """
+
+    def __init__(self, journal, input_folder, suffixes=("",), renderer=None, perceptual=False, since=None):
+        self.journal = journal
+        self.input_folder = input_folder
+        self.suffixes = suffixes  # Output size suffixes, see OutputSettings.sizes
+        self.renderer = renderer  # For perceptual hashing
+        self.perceptual = perceptual
+        self.since = since  # Only reuse crops journaled after this time (e.g. with --force)
+        self._lock = threading.Lock()
+        self._keys = {}  # file -> content hash of the document it is a copy of
+        self._first = {}  # content hash -> file processed for the group
+        self._waiting = {}  # file -> copies waiting for it to finish
+        self._done = set()
+        self._page_hashes = []  # [([(dhash, thumbnail)] per page, content hash)] with perceptual
+        self.files = 0  # Files served from a copy...
+        self.pages = 0  # ...and their pages, none of which were rendered or shown
+
+    def _key(self, pdf_file):
+        # Content hash of the document `pdf_file` is a copy of. Call it
+        # without holding the lock: hashing the file (and, with perceptual,
+        # rendering its pages) runs unlocked, so a GUI thread asking about
+        # another file isn't held up; only the lookups and inserts lock.
+        with self._lock:
+            if pdf_file in self._keys:
+                return self._keys[pdf_file]
+        pdf_path = os.path.join(self.input_folder, pdf_file)
+        key = source_digest(pdf_path)
+        hashes = None
+        if self.perceptual:
+            with self._lock:
+                seen = key in self._first
+            if not seen:
+                hashes = self._hash_pages(pdf_path)
+        with self._lock:
+            if pdf_file in self._keys:
+                return self._keys[pdf_file]  # Keyed by another thread meanwhile
+            if hashes is not None:
+                for other, other_key in self._page_hashes:
+                    if _looks_same(other, hashes):
+                        key = other_key
+                        break
+                else:
+                    self._page_hashes.append((hashes, key))
+            self._keys[pdf_file] = key
+            self._first.setdefault(key, pdf_file)
+            return key
+
+    def _hash_pages(self, pdf_path):
+        hashes = []
+        for page in range(1, self.renderer.page_info(pdf_path)["pages"] + 1):
+            thumb = page_thumb(self.renderer.render_page_array(pdf_path, page, dpi=PHASH_DPI, color="gray"))
+            hashes.append((page_dhash(thumb), thumb))
+        return hashes
+
+    def copy_finished(self, pdf_file):
+        """Reuse the crops of a finished copy of `pdf_file`, if there is one.
+
+        Copies its outputs (every size) to the output names of `pdf_file`
+        and journals them. Returns True if `pdf_file` is now done.
+        """
+        key = self._key(pdf_file)
+        with self._lock:
+            return self._copy(pdf_file, key)
+
+    def is_copy(self, pdf_file):
+        # Whether an earlier file seen in this session is the same document
+        return self.original(pdf_file) != pdf_file
+
+    def original(self, pdf_file):
+        # The file seen first in this session with the same document
+        key = self._key(pdf_file)
+        with self._lock:
+            return self._first[key]
+
+    def check(self, pdf_file):
+        # For pipelines with several files in flight: "copied" if a finished
+        # copy was reused, "wait" if a copy is still being processed (the file
+        # is handed back by original_done()), else "new"
+        key = self._key(pdf_file)
+        with self._lock:
+            if self._copy(pdf_file, key):
+                return "copied"
+            first = self._first[key]
+            if first in self._done:
+                self._first[key] = first = pdf_file  # That one failed; this file takes its place
+            if first != pdf_file:
+                self._waiting.setdefault(first, []).append(pdf_file)
+                return "wait"
+            return "new"
+
+    def original_done(self, pdf_file):
+        # `pdf_file` has been processed: serve the copies waiting for it.
+        # Returns the files that still have to be processed themselves, if it
+        # didn't finish; the first of them is the group's new original.
+        with self._lock:
+            self._done.add(pdf_file)
+            key = self._keys.get(pdf_file)
+            left = [f for f in self._waiting.pop(pdf_file, []) if not self._copy(f, key)]
+            if not left:
+                return []
+            self._first[key] = left[0]
+            if left[1:]:
+                self._waiting[left[0]] = left[1:]
+            return left[:1]
+
+    def _copy(self, pdf_file, key):
+        records = self.journal.finished_copy(key, exclude=pdf_file, since=self.since)
+        if records is None:
+            return False
+        pdf_path = os.path.join(self.input_folder, pdf_file)
+        output_folder = self.journal.output_folder
+        try:
+            for record in records:
+                item = WorkItem(pdf_file, record.get("page", 1), record.get("pages", 1))
+                output = None
+                if record["status"] == "saved":
+                    stem, ext = os.path.splitext(record["output"])
+                    output = output_name(item, ext)
+                    for suffix in self.suffixes:
+                        src = os.path.join(output_folder, stem + suffix + ext)
+                        if suffix == "" or os.path.exists(src):
+                            _copy_file(src, os.path.join(output_folder, os.path.splitext(output)[0] + suffix + ext))
+                self.journal.record(pdf_file, pdf_path, record["status"], record.get("box"), record.get("rotation", 0), output,
+                                    page=item.page, pages=item.pages, duplicate_of=record["file"])
+        except OSError as e:
+            print(f"Could not copy the crops of {records[0]['file']} to {pdf_file}: {e}")
+            return False  # Processed like any other file instead
+        self.files += 1
+        self.pages += len(records)
+        return True
@@ -0,0 +1,40 @@
+import cv2
+
+from image_core import resize, rotate
+from pdf_render import rotated_size
+
+# Stop halving once a level's shorter side would drop below this
+MIN_LEVEL_SIDE = 128
+
+
+def build_pyramid(pixels, min_side=MIN_LEVEL_SIDE):
+    # [full, 1/2, 1/4, ...] of a page array (see image_core) - an exact halving
+    # with INTER_AREA is a cheap box filter, and each level is made from the
+    # previous one
+    levels = [pixels]
+    while min(levels[-1].shape[:2]) // 2 >= min_side:
+        height, width = levels[-1].shape[:2]
+        levels.append(resize(levels[-1], (width // 2, height // 2)))
+    return levels
+
+
+def pick_level(pyramid, width, height):
+    # Smallest level that is still at least (width x height), so display
+    # scaling only ever shrinks by less than 2x
+    for level in reversed(pyramid):
+        if level.shape[1] >= width and level.shape[0] >= height:
+            return level
+    return pyramid[0]
+
+
+def scale_for_display(pyramid, width, height, high_quality=True, rotation=0):
+    # (width x height) is the size on screen, after rotating the unrotated
+    # pyramid clockwise by `rotation`. Scale first, then rotate, so only
+    # the small display image is ever rotated. Returns an array.
+    target = rotated_size((width, height), rotation)
+    level = pick_level(pyramid, *target)
+    if high_quality:
+        level = resize(level, target)
+    elif (level.shape[1], level.shape[0]) != target:
+        level = cv2.resize(level, target, interpolation=cv2.INTER_LINEAR)
+    return rotate(level, rotation)
@@ -0,0 +1,191 @@
+
+import os
+import threading
+import time
+
+from pdf_scanner import INCLUDE, scan_pdfs, wanted
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# A new file is handed out once its size and mtime have been stable this long
+SETTLE_SECONDS = 2.0
+POLL_INTERVAL = 1.0
+# A file that stays unchanged this long without looking complete (a truncated
+# or broken PDF) is given up on, until it changes again
+INCOMPLETE_SECONDS = 300.0
+
+
+def looks_complete(path):
+    # A fully written PDF ends with %%EOF (possibly followed by whitespace or
+    # junk), which a file still being copied usually doesn't
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+
+class FolderWatcher:
+    """Reports files that appear (or change) in a folder, once they are complete.
+
+    Files are picked like pdf_scanner.scan_pdfs picks them: by `include` and
+    `exclude` globs, in subfolders too with `recursive`, and named by their
+    path relative to `folder` with "/" separators. Uses inotify/FSEvents/ReadDirectoryChangesW through watchdog when it is
+    installed, so only changed files are ever looked at; otherwise the folder
+    is polled with os.scandir every `poll_interval` seconds. Either way a
+    file is only reported once its size and mtime have stopped changing for
+    `settle` seconds and it looks complete. One that is still incomplete
+    after `incomplete` seconds without a change is dropped (and logged).
+    """
+
+    def __init__(self, folder, recursive=False, include=INCLUDE, exclude=(),
+                 settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL, use_polling=False,
+                 incomplete=INCOMPLETE_SECONDS):
+        self.folder = folder
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.incomplete = incomplete
+        self.use_polling = use_polling or Observer is None
+        self._lock = threading.Lock()
+        self._settling = {}  # name -> (first seen, (size, mtime), last change)
+        self._known = {}  # name -> (size, mtime) when last reported or given up on, for polling
+        self._observer = None
+        self._next_poll = 0.0
+
+    @property
+    def mode(self):
+        return "polling" if self.use_polling else "events"
+
+    def start(self, existing=True):
+        # With existing=True, files already in the folder are reported too
+        if existing:
+            for name in self._scan(self.folder):
+                self.touch(name)
+        if not self.use_polling:
+            self._observer = Observer()
+            self._observer.schedule(self._handler(), self.folder, recursive=self.recursive)
+            self._observer.start()
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def _scan(self, folder):
+        # Names (relative to self.folder) of the wanted files under `folder`
+        prefix = os.path.relpath(folder, self.folder).replace(os.sep, "/")
+        prefix = "" if prefix == "." else prefix + "/"
+        return (prefix + name for name in scan_pdfs(folder, self.recursive, self.include, self.exclude)
+                if not prefix or wanted(prefix + name, self.include, self.exclude))
+
+    def _name(self, path):
+        # `path` relative to the folder if it is a file to watch, else None
+        name = os.path.relpath(os.path.abspath(path), os.path.abspath(self.folder)).replace(os.sep, "/")
+        if name.startswith("../") or (not self.recursive and "/" in name):
+            return None
+        return name if wanted(name, self.include, self.exclude) else None
+
+    def _handler(self):
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Moves into the folder (the usual "write then rename") report the new name
+                for path in (getattr(event, "dest_path", None), event.src_path):
+                    if not path:
+                        continue
+                    if event.is_directory:
+                        # A folder created or moved in may arrive with its files already in it
+                        if watcher.recursive and event.event_type in ("created", "moved") and os.path.isdir(path):
+                            if os.path.abspath(path).startswith(os.path.abspath(watcher.folder) + os.sep):
+                                for name in watcher._scan(path):
+                                    watcher.touch(name)
+                        continue
+                    name = watcher._name(path)
+                    if name is not None:
+                        watcher.touch(name)
+
+        return Handler()
+
+    def touch(self, name, now=None):
+        # Note that `name` was created or changed; it restarts its settle timer
+        now = now or time.monotonic()
+        with self._lock:
+            first = self._settling[name][0] if name in self._settling else now
+            self._settling[name] = (first, None, now)
+
+    def _poll(self, now):
+        if now < self._next_poll:
+            return
+        self._next_poll = now + self.poll_interval
+        seen = set()
+        for name in self._scan(self.folder):
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            seen.add(name)
+            if self._known.get(name) != (stat.st_size, stat.st_mtime):
+                with self._lock:
+                    if name not in self._settling:
+                        self._settling[name] = (now, None, now)
+        for name in set(self._known) - seen:
+            del self._known[name]
+
+    def ready(self, now=None, limit=None):
+        # Files that have settled since the last call, as [(name, first seen)].
+        # `first seen` is a time.monotonic() value, for latency accounting.
+        # With `limit`, at most that many are reported; the others stay
+        # settled here and are reported by a later call.
+        now = now or time.monotonic()
+        if self.use_polling:
+            self._poll(now)
+
+        with self._lock:
+            candidates = list(self._settling.items())
+
+        done = []
+        for name, (first, signature, changed) in candidates:
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._settling.pop(name, None)  # Deleted or moved away again
+                self._known.pop(name, None)
+                continue
+            current = (stat.st_size, stat.st_mtime)
+            if current != signature:
+                with self._lock:
+                    if name in self._settling:
+                        self._settling[name] = (first, current, now)
+                continue
+            if now - changed < self.settle or (limit is not None and len(done) >= limit):
+                continue
+            if not looks_complete(path):
+                if now - changed >= self.incomplete:
+                    # Stop reopening it; polling picks it up again once it changes
+                    with self._lock:
+                        self._settling.pop(name, None)
+                    self._known[name] = current
+                    print(f"Giving up on {name}: unchanged for {now - changed:.0f}s but still incomplete (no %%EOF)")
+                continue
+            with self._lock:
+                self._settling.pop(name, None)
+            self._known[name] = current
+            done.append((name, first))
+        return done
+
+    def settling(self):
+        with self._lock:
+            return len(self._settling)
@@ -0,0 +1,103 @@
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Pages and crops are plain uint8 NumPy arrays: (h, w) for "gray", (h, w, 3)
+# in RGB order for "rgb". Crops are views into the page buffer; colour
+# conversion, resizing and rotation only ever touch the small crop.
+COLOR_MODES = ("rgb", "gray")
+
+# Clockwise rotation -> cv2.rotate code
+CV2_ROTATIONS = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+
+def as_array(image):
+    # PIL image -> array (one copy); arrays are returned as they are
+    if isinstance(image, np.ndarray):
+        return image
+    return np.asarray(image)
+
+
+def pnm_to_array(data):
+    # Zero-copy view of a binary PPM (P6) or PGM (P5) image held in `data`,
+    # e.g. pdftoppm's stdout. Only 8-bit samples are supported; a maxval
+    # below 255 is scaled up to the full range (which copies).
+    magic = data[:2]
+    if magic not in (b"P5", b"P6"):
+        raise ValueError("Not a binary PPM/PGM image")
+    fields = []
+    pos = 2
+    while len(fields) < 3:
+        # Skip whitespace and comments between header fields
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            pos = data.index(b"\n", pos) + 1
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        fields.append(int(data[pos:end]))
+        pos = end
+    width, height, maxval = fields
+    if not 0 < maxval <= 255:
+        raise ValueError("16-bit PNM images are not supported" if maxval > 255 else "Invalid PNM maxval")
+    pos += 1  # Single whitespace byte before the pixel data
+    shape = (height, width, 3) if magic == b"P6" else (height, width)
+    pixels = np.frombuffer(data, dtype=np.uint8, count=int(np.prod(shape)), offset=pos).reshape(shape)
+    if maxval != 255:
+        pixels = (pixels.astype(np.uint16) * 255 // maxval).astype(np.uint8)
+    return pixels
+
+
+def crop_view(pixels, box):
+    # (x1, y1, x2, y2) in pixels, clamped to the image -> a view, no copy
+    height, width = pixels.shape[:2]
+    x1, y1, x2, y2 = (int(round(v)) for v in box)
+    x1, x2 = max(0, min(x1, width)), max(0, min(x2, width))
+    y1, y2 = max(0, min(y1, height)), max(0, min(y2, height))
+    return pixels[y1:y2, x1:x2]
+
+
+def to_bgr(pixels):
+    # For OpenCV windows; run it on the display-size image, not the page
+    if pixels.ndim == 2:
+        return cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+
+
+def convert(pixels, color):
+    # Convert to "rgb" or "gray"; a no-op if it already is
+    if color == "gray" and pixels.ndim == 3:
+        return cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    if color == "rgb" and pixels.ndim == 2:
+        return cv2.cvtColor(pixels, cv2.COLOR_GRAY2RGB)
+    return pixels
+
+
+def resize(pixels, size):
+    # Area averaging when shrinking (no aliasing, and cheaper than LANCZOS on
+    # a big crop); cubic when enlarging
+    width, height = size
+    if (pixels.shape[1], pixels.shape[0]) == (width, height):
+        return pixels
+    shrinking = width <= pixels.shape[1] and height <= pixels.shape[0]
+    return cv2.resize(pixels, (width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+
+
+def rotate(pixels, rotation):
+    # Clockwise by a multiple of 90 degrees; a lossless transpose
+    rotation %= 360
+    if not rotation:
+        return pixels
+    return cv2.rotate(pixels, CV2_ROTATIONS[rotation])
+
+
+def to_pil(pixels):
+    # Shares memory with `pixels` where PIL allows it
+    return Image.fromarray(np.ascontiguousarray(pixels))
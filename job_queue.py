@@ -0,0 +1,241 @@
+
+import json
+import sqlite3
+import time
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30  # Seconds before a failed job is retried, times its attempt count
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL UNIQUE,       -- Relative to the input folder
+    rotation INTEGER NOT NULL DEFAULT 0,
+    pages TEXT,                      -- JSON list of pages, NULL for all
+    state TEXT NOT NULL DEFAULT 'queued',  -- queued, leased, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,  -- Not leased again before this (retry delay)
+    worker TEXT,
+    lease_until REAL,
+    enqueued REAL,
+    finished REAL,
+    saved INTEGER NOT NULL DEFAULT 0,
+    review INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, available_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    started REAL,
+    heartbeat REAL,
+    files INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class JobQueue:
+    """Crop jobs, one input file each, in a SQLite file shared by workers on several machines.
+
+    Workers lease a few jobs at a time. A lease runs out after
+    `lease_seconds` unless renewed, so the jobs of a crashed or disconnected
+    worker go back to the queue. Failed jobs are retried up to
+    `max_attempts` times, each after a longer delay. Every change is one
+    short BEGIN IMMEDIATE transaction. The database keeps SQLite's rollback
+    journal: WAL needs shared memory, which network filesystems don't
+    provide.
+    """
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(SCHEMA)
+
+    def _write(self):
+        # One write transaction: `with self._write() as conn:`
+        return _Transaction(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+    def set_settings(self, settings):
+        # Crop settings of the run (box, output format...), read back by every worker
+        with self._write() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('settings', ?)", (json.dumps(settings),))
+
+    def settings(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+        return json.loads(row["value"]) if row else None
+
+    def add(self, jobs, requeue=False, batch_size=1000):
+        # jobs: iterable of (file, rotation, pages or None). Files already in
+        # the queue are left as they are, or with `requeue` queued again if
+        # they are done or failed. Returns the number added or requeued.
+        added = 0
+        batch = []
+        for job in jobs:
+            batch.append(job)
+            if len(batch) >= batch_size:
+                added += self._add(batch, requeue)
+                batch = []
+        if batch:
+            added += self._add(batch, requeue)
+        return added
+
+    def _add(self, batch, requeue):
+        now = time.time()
+        sql = "INSERT INTO jobs (file, rotation, pages, enqueued) VALUES (?, ?, ?, ?) ON CONFLICT (file) DO "
+        if requeue:
+            sql += ("UPDATE SET state = 'queued', rotation = excluded.rotation, pages = excluded.pages, "
+                    "enqueued = excluded.enqueued, attempts = 0, available_at = 0, finished = NULL, error = NULL "
+                    "WHERE state IN ('done', 'failed')")
+        else:
+            sql += "NOTHING"
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(sql, [(f, rotation % 360, json.dumps(pages) if pages is not None else None, now)
+                                   for f, rotation, pages in batch])
+            return conn.total_changes - before
+
+    def lease(self, worker, count):
+        # Up to `count` jobs for `worker`: queued ones, and ones whose lease
+        # ran out. Returns [(id, file, rotation, pages or None)].
+        now = time.time()
+        with self._write() as conn:
+            # Leases that ran out on their last attempt count as failed
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = 'lease expired', finished = ? "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            rows = conn.execute(
+                "SELECT id, file, rotation, pages FROM jobs "
+                "WHERE (state = 'queued' AND available_at <= ?) OR (state = 'leased' AND lease_until < ?) "
+                "ORDER BY id LIMIT ?",
+                (now, now, count),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                [(worker, now + self.lease_seconds, row["id"]) for row in rows],
+            )
+        return [(row["id"], row["file"], row["rotation"], json.loads(row["pages"]) if row["pages"] else None) for row in rows]
+
+    def renew(self, worker, job_ids):
+        # Extend the leases `worker` still holds
+        if not job_ids:
+            return
+        with self._write() as conn:
+            conn.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                [(time.time() + self.lease_seconds, job_id, worker) for job_id in job_ids],
+            )
+
+    def complete(self, job_id, worker, saved, review):
+        # Only counts if `worker` still holds the lease; if it ran out and
+        # someone else took the job, their (identical) outputs win
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'done', finished = ?, saved = ?, review = ?, error = NULL, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (time.time(), saved, review, job_id, worker),
+            )
+
+    def fail(self, job_id, worker, error):
+        # Back to the queue after a delay, or failed for good after max_attempts
+        now = time.time()
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "available_at = ? + attempts * ?, finished = CASE WHEN attempts >= ? THEN ? END, "
+                "error = ?, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (self.max_attempts, now, RETRY_DELAY, self.max_attempts, now, error, job_id, worker),
+            )
+
+    def release(self, worker):
+        # A worker stopping early hands its leases back, without using up an attempt
+        with self._write() as conn:
+            return conn.execute(
+                "UPDATE jobs SET state = 'queued', attempts = attempts - 1, lease_until = NULL "
+                "WHERE worker = ? AND state = 'leased'", (worker,)
+            ).rowcount
+
+    def retry_failed(self):
+        # Give every failed job a fresh set of attempts; returns how many
+        with self._write() as conn:
+            return conn.execute(
+                "UPDATE jobs SET state = 'queued', attempts = 0, available_at = 0, finished = NULL WHERE state = 'failed'"
+            ).rowcount
+
+    def heartbeat(self, worker, files=0, pages=0):
+        # Register or refresh a worker, adding to its totals
+        now = time.time()
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO workers (name, started, heartbeat, files, pages) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET heartbeat = excluded.heartbeat, "
+                "files = files + excluded.files, pages = pages + excluded.pages",
+                (worker, now, now, files, pages),
+            )
+
+    def remaining(self):
+        # Jobs not finished yet: queued (possibly waiting for a retry) or leased
+        return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'leased')").fetchone()[0]
+
+    def status(self, window=300):
+        # Counts by state, plus files and pages finished in the last `window`
+        # seconds overall and by worker, for the coordinator
+        now = time.time()
+        since = now - window
+        states = {row["state"]: row["n"] for row in self.conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")}
+        recent = self.conn.execute(
+            "SELECT COUNT(*) AS files, COALESCE(SUM(saved), 0) AS pages FROM jobs WHERE state = 'done' AND finished >= ?", (since,)
+        ).fetchone()
+        workers = [dict(row) for row in self.conn.execute(
+            "SELECT w.name, w.started, w.heartbeat, w.files, w.pages, "
+            "(SELECT COUNT(*) FROM jobs j WHERE j.worker = w.name AND j.state = 'done' AND j.finished >= ?) AS recent_files, "
+            "(SELECT COUNT(*) FROM jobs j WHERE j.worker = w.name AND j.state = 'leased') AS leased "
+            "FROM workers w ORDER BY w.name", (since,))]
+        if workers:
+            window = min(window, now - min(w["started"] for w in workers))  # A run younger than the window
+        return {
+            "states": states,
+            "total": sum(states.values()),
+            "window": window,
+            "recent_files": recent["files"],
+            "recent_pages": recent["pages"],
+            "workers": workers,
+        }
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers leasing at
+    # the same moment wait for each other (up to the connection timeout)
+    # instead of failing halfway with "database is locked"
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        except sqlite3.Error:
+            # A failed COMMIT leaves the transaction open; end it, so the
+            # caller can retry with a clean connection
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            raise
+        return False
@@ -0,0 +1,166 @@
+
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from image_core import as_array, convert, resize, rotate, to_pil
+from timing import recorder
+
+# Format name -> (PIL format, file extension)
+FORMATS = {
+    "png": ("PNG", ".png"),
+    "jpeg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+}
+
+# How far (relative) a crop's aspect ratio may be from the main output's,
+# as it will be resized: boxes are drawn at preview resolution, so they are
+# a few pixels off at full DPI, but never this far unless the box is for the
+# other orientation
+ASPECT_TOLERANCE = 0.05
+
+# What was written for one output size
+EncodedOutput = namedtuple("EncodedOutput", "path bytes encode_seconds")
+
+
+class OutputSettings:
+    """Output format, encoder options and target sizes for saved crops.
+
+    `sizes` is a list of (suffix, width, height); the first entry is the main
+    output (suffix usually ""), the rest are extra renditions such as a
+    thumbnail, all produced from the same crop in one pass.
+    """
+
+    def __init__(self, fmt="png", sizes=(("", 600, 400),), png_compression=6, jpeg_quality=90, workers=2, color="rgb"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format {fmt!r}, expected one of: {', '.join(FORMATS)}")
+        if not 0 <= png_compression <= 9:
+            raise ValueError("PNG compression level must be 0..9")
+        if not 1 <= jpeg_quality <= 100:
+            raise ValueError("JPEG quality must be 1..100")
+        self.fmt = fmt
+        self.sizes = [tuple(size) for size in sizes]
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+        self.workers = workers
+        self.color = color  # "rgb" or "gray" output
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def extension(self):
+        return FORMATS[self.fmt][1]
+
+    def save_options(self):
+        # Keyword arguments for Image.save()
+        if self.fmt == "png":
+            return {"compress_level": self.png_compression}
+        if self.fmt == "jpeg":
+            return {"quality": self.jpeg_quality, "optimize": True}
+        return {"lossless": True}
+
+    def executor(self):
+        # Shared encode pool, created on first use (per process, so batch
+        # workers each get their own)
+        with self._lock:
+            if self._executor is None and self.workers > 1:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="encode")
+            return self._executor
+
+    def __getstate__(self):
+        # Sent to batch worker processes without the thread pool
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def parse_size(text):
+    # "150x100" -> (150, 100)
+    w, _, h = text.lower().partition("x")
+    return int(w), int(h)
+
+
+def _encode(pixels, path, fmt, options, label=""):
+    # Encode to memory, then write with a temp file + rename so a crash never
+    # leaves a truncated image behind
+    start = time.perf_counter()
+    image = to_pil(pixels)
+    buffer = BytesIO()
+    image.save(buffer, fmt, **options)
+    data = buffer.getbuffer()
+    encode_seconds = time.perf_counter() - start
+    recorder.add("encode", label, start, encode_seconds)
+
+    # The host name keeps workers on different machines (see crop_pdfs_cluster)
+    # writing the same output from sharing a temp file
+    tmp = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with recorder.span("write", label):
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return EncodedOutput(path, len(data), encode_seconds)
+
+
+def write_outputs(crop, output_folder, name, settings, rotation=0):
+    # Resize `crop` (an RGB/gray array, e.g. a view into the rendered region,
+    # or a PIL image) to every target size, rotate and encode each one.
+    # Sizes are produced largest first, each area-downscaled from the
+    # previous one rather than from the full-DPI crop; colour conversion and
+    # rotation are done on the small results only. Encoding runs on the
+    # shared pool. `name` is the output name without extension. Returns
+    # [EncodedOutput], main output first. Raises ValueError if the crop's
+    # aspect ratio doesn't match the main output's before rotation, rather
+    # than squashing it.
+    source = as_array(crop)
+    _, width, height = settings.sizes[0]
+    if rotation % 180 == 90:
+        width, height = height, width
+    crop_height, crop_width = source.shape[:2]
+    if abs(crop_width * height / (crop_height * width) - 1) > ASPECT_TOLERANCE:
+        raise ValueError(f"Crop of {crop_width}x{crop_height} doesn't fit a {settings.sizes[0][1]}x{settings.sizes[0][2]} "
+                         f"output rotated by {rotation % 360}; was the box drawn for the other orientation?")
+    fmt = FORMATS[settings.fmt][0]
+    options = settings.save_options()
+    order = sorted(range(len(settings.sizes)), key=lambda i: -settings.sizes[i][1] * settings.sizes[i][2])
+
+    # Outputs mirror the input's subfolders, so `name` may contain a directory
+    os.makedirs(os.path.dirname(os.path.join(output_folder, name)) or ".", exist_ok=True)
+    jobs = {}
+    executor = settings.executor()
+    for i in order:
+        suffix, width, height = settings.sizes[i]
+        # Resize to the size before rotation, so only the output is rotated
+        with recorder.span("resize", name):
+            source = resize(source, (height, width) if rotation % 180 == 90 else (width, height))
+            pixels = rotate(convert(source, settings.color), rotation)
+        path = os.path.join(output_folder, name + suffix + settings.extension)
+        if executor is None:
+            jobs[i] = _encode(pixels, path, fmt, options, name)
+        else:
+            jobs[i] = executor.submit(_encode, pixels, path, fmt, options, name)
+
+    return [jobs[i] if executor is None else jobs[i].result() for i in range(len(settings.sizes))]
+
+
+def describe(outputs):
+    # Bytes written and encode time, for the console
+    main = outputs[0]
+    text = f"{main.bytes / 1024:.1f} KB, encoded in {main.encode_seconds * 1000:.1f} ms"
+    if len(outputs) > 1:
+        extra = sum(o.bytes for o in outputs[1:])
+        text += f"; {len(outputs) - 1} more sizes, {extra / 1024:.1f} KB"
+    return text
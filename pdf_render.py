@@ -0,0 +1,523 @@
+
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from pdf2image import pdfinfo_from_path
+from pdf2image.exceptions import PDFInfoNotInstalledError
+
+from image_core import as_array, convert, pnm_to_array, resize
+from render_cache import source_digest
+
+try:
+    import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
+except ImportError:
+    pdfium = None
+
+# Two-tier rendering: pages are shown at roughly screen resolution, and only
+# the selected region is rendered again at full output resolution on save.
+PREVIEW_DPI = 100
+OUTPUT_DPI = 300
+
+# Pages that are just a scanned JPEG wrapped in a PDF are cropped from the
+# JPEG itself (see load_region_array). The image must reach within
+# EMBEDDED_MARGIN (a fraction of the page size) of every page edge. The poppler
+# backend can't see where the image is drawn or what is drawn over it, so for
+# a page whose image list looks like a scan it also checks that a VERIFY_DPI
+# render of the page differs from the image by at most VERIFY_TOLERANCE grey
+# levels on average.
+EMBEDDED_MARGIN = 0.01
+VERIFY_DPI = 20
+VERIFY_TOLERANCE = 8
+# Pages whose poppler check result is remembered (see PopplerRenderer.page_jpeg)
+JPEG_MEMO_SIZE = 4096
+
+# load_region_array source -> how the console describes it
+SOURCES = {"embedded": "from the embedded JPEG", "render": "rendered"}
+
+
+def _poppler_command(name, poppler_path):
+    if sys.platform.startswith("win"):
+        name += ".exe"
+    if poppler_path:
+        return os.path.join(poppler_path, name)
+    return name
+
+
+def pixels_to_points(box, dpi):
+    # (x1, y1, x2, y2) in pixels at `dpi` -> PDF points (1/72 inch, top-left origin)
+    return tuple(v * 72.0 / dpi for v in box)
+
+
+def points_to_pixels(box, dpi):
+    return tuple(v * dpi / 72.0 for v in box)
+
+
+def rotate_box(box, rotation, width, height):
+    # Map a box on a (width x height) image onto the same image rotated
+    # clockwise by `rotation` degrees (0/90/180/270)
+    x1, y1, x2, y2 = box
+    rotation %= 360
+    if rotation == 90:
+        corners = [(height - y1, x1), (height - y2, x2)]
+    elif rotation == 180:
+        corners = [(width - x1, height - y1), (width - x2, height - y2)]
+    elif rotation == 270:
+        corners = [(y1, width - x1), (y2, width - x2)]
+    else:
+        corners = [(x1, y1), (x2, y2)]
+    (ax, ay), (bx, by) = corners
+    return (min(ax, bx), min(ay, by), max(ax, bx), max(ay, by))
+
+
+def unrotate_box(box, rotation, width, height):
+    # Inverse of rotate_box; (width x height) is the size of the *unrotated* image
+    rotation %= 360
+    if rotation in (90, 270):
+        width, height = height, width
+    return rotate_box(box, 360 - rotation, width, height)
+
+
+# Clockwise rotation -> the PIL transpose doing it (lossless, no resampling)
+TRANSPOSE_FOR_ROTATION = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+
+
+def rotated_size(size, rotation):
+    w, h = size
+    return (h, w) if rotation % 180 == 90 else (w, h)
+
+
+def rotate_image(image, rotation):
+    # Rotate clockwise by a multiple of 90 degrees
+    rotation %= 360
+    if not rotation:
+        return image
+    return image.transpose(TRANSPOSE_FOR_ROTATION[rotation])
+
+
+def _covers_page(bounds, page_size):
+    x1, y1, x2, y2 = bounds
+    w, h = page_size
+    return (abs(x1) <= w * EMBEDDED_MARGIN and abs(x2 - w) <= w * EMBEDDED_MARGIN
+            and abs(y1) <= h * EMBEDDED_MARGIN and abs(y2 - h) <= h * EMBEDDED_MARGIN)
+
+
+def _open_jpeg(data):
+    # The JPEG in `data`, not decoded yet, or None for colour spaces the
+    # croppers don't write (e.g. CMYK)
+    image = Image.open(BytesIO(data))
+    if image.format != "JPEG" or image.mode not in ("L", "RGB"):
+        return None
+    return image
+
+
+def _draft(image, color, size):
+    # Have the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding, as far
+    # as `size` allows, dropping the detail in the DCT domain: far cheaper
+    # than decoding everything and resizing. Returns the scale it decodes at.
+    full_width = image.size[0]
+    image.draft("L" if color == "gray" or image.mode == "L" else "RGB", size)
+    return image.size[0] / full_width
+
+
+def _jpeg_region(data, bounds, box, dpi, color):
+    # The part of a page image (placed at `bounds`) under `box`, both
+    # (x1, y1, x2, y2) in PDF points, at `dpi` or the image's own resolution
+    # if that is lower: upsampling the scan would add nothing the output
+    # resize doesn't. Returns an array like render_region_array, or None.
+    image = _open_jpeg(data)
+    if image is None:
+        return None
+    bx1, by1, bx2, by2 = bounds
+    x1, y1, x2, y2 = box
+    width, height = image.size
+    sx, sy = width / (bx2 - bx1), height / (by2 - by1)  # Image pixels per point
+    scale = min(1.0, dpi / 72.0 / min(sx, sy))
+    decoded = _draft(image, color, (math.ceil(width * scale), math.ceil(height * scale)))
+    # Cropped before converting to an array, so only the region is copied
+    left, top = max(0, round((x1 - bx1) * sx * decoded)), max(0, round((y1 - by1) * sy * decoded))
+    right = min(image.size[0], round((x2 - bx1) * sx * decoded))
+    bottom = min(image.size[1], round((y2 - by1) * sy * decoded))
+    if right <= left or bottom <= top:
+        return None
+    region = as_array(image.crop((left, top, right, bottom)))
+    size = (max(1, round((x2 - x1) * sx * scale)), max(1, round((y2 - y1) * sy * scale)))
+    return convert(resize(region, size), color)
+
+
+def _parse_pdfimages_list(output):
+    # Rows of `pdfimages -list` as dicts of the columns page_jpeg needs
+    rows = []
+    for line in output.splitlines()[2:]:  # Below the header and its underline
+        fields = line.split()
+        if len(fields) < 14:
+            continue
+        try:
+            rows.append({"type": fields[2], "width": int(fields[3]), "height": int(fields[4]), "enc": fields[8],
+                         "x_ppi": float(fields[12]), "y_ppi": float(fields[13])})
+        except ValueError:
+            continue
+    return rows
+
+
+def _parse_pdfinfo(info):
+    size = rot = None
+    for key, value in info.items():
+        # "Page size" without a page range, "Page    1 size" with one
+        if key.startswith("Page") and key.endswith("size"):
+            size = value
+        elif key.startswith("Page") and key.endswith("rot"):
+            rot = value
+    if not size:
+        raise ValueError("Could not read page size")
+
+    w, _, h = size.split()[:3]  # e.g. "595.276 x 841.89 pts (A4)"
+    w, h = float(w), float(h)
+    rotation = int(float(rot)) % 360 if rot else 0
+    if rotation % 180 == 90:
+        w, h = h, w
+    return {"pages": info["Pages"], "page_size": (w, h), "rotation": rotation}
+
+
+class PopplerRenderer:
+    """Renders with poppler's pdfinfo/pdftoppm command line tools.
+
+    Cropping from a page's embedded JPEG (page_jpeg) is off unless
+    `embedded_jpegs` is set: checking a page takes up to four poppler runs
+    (pdfimages -list, pdfinfo, pdfimages -j and a small render) where
+    rendering the region takes one, so it only pays off for large scans.
+    """
+
+    name = "poppler"
+
+    def __init__(self, poppler_path=None, embedded_jpegs=False):
+        self.poppler_path = poppler_path
+        self.embedded_jpegs = embedded_jpegs
+        self._jpeg_pages = OrderedDict()  # (source digest, page) -> bounds, or None if not a wrapped scan
+        self._jpeg_lock = threading.Lock()
+
+    def page_info(self, pdf_path, page=1):
+        # Page count, page size in PDF points as rendered (i.e. with the page's
+        # /Rotate applied) and the /Rotate value itself
+        info = pdfinfo_from_path(pdf_path, first_page=page, last_page=page, poppler_path=self.poppler_path)
+        try:
+            return _parse_pdfinfo(info)
+        except ValueError:
+            raise ValueError(f"Could not read page size of {os.path.basename(pdf_path)}")
+
+    def _env(self):
+        env = os.environ.copy()
+        if self.poppler_path is not None:
+            env["LD_LIBRARY_PATH"] = self.poppler_path + ":" + env.get("LD_LIBRARY_PATH", "")
+        return env
+
+    def _pdftoppm(self, pdf_path, page, dpi, extra_args=()):
+        # Run pdftoppm on a single page and return the PPM (or PGM, with
+        # -gray) it writes to stdout. Calling it directly (rather than through
+        # convert_from_path) skips the extra pdfinfo run and the temp file round trip.
+        command = [
+            _poppler_command("pdftoppm", self.poppler_path),
+            "-r", str(dpi),
+            "-f", str(page), "-l", str(page),
+            *extra_args,
+            "-singlefile",
+            pdf_path,
+        ]
+
+        try:
+            proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self._env())
+        except OSError:
+            raise PDFInfoNotInstalledError("Unable to run pdftoppm. Is poppler installed and in PATH?")
+
+        if proc.returncode != 0 or not proc.stdout:
+            raise RuntimeError(f"pdftoppm failed on {os.path.basename(pdf_path)}: {proc.stderr.decode(errors='replace').strip()}")
+        return proc.stdout
+
+    def _image(self, data):
+        image = Image.open(BytesIO(data))
+        image.load()
+        return image
+
+    def _region_args(self, box, dpi):
+        # pdftoppm's -x/-y/-W/-H crop options (not exposed by pdf2image) for
+        # `box` (x1, y1, x2, y2 in PDF points)
+        x1, y1, x2, y2 = points_to_pixels(box, dpi)
+        x = int(round(x1))
+        y = int(round(y1))
+        w = max(1, int(round(x2)) - x)
+        h = max(1, int(round(y2)) - y)
+        return ["-x", str(x), "-y", str(y), "-W", str(w), "-H", str(h)]
+
+    def render_page(self, pdf_path, page=1, dpi=PREVIEW_DPI):
+        return self._image(self._pdftoppm(pdf_path, page, dpi))
+
+    def render_region(self, pdf_path, box, page=1, dpi=OUTPUT_DPI):
+        # Render only `box` (x1, y1, x2, y2 in PDF points) of a page
+        return self._image(self._pdftoppm(pdf_path, page, dpi, self._region_args(box, dpi)))
+
+    # The *_array variants return a NumPy array (see image_core) viewing
+    # pdftoppm's output directly, with no decode copy
+    def render_page_array(self, pdf_path, page=1, dpi=PREVIEW_DPI, color="rgb"):
+        return pnm_to_array(self._pdftoppm(pdf_path, page, dpi, ["-gray"] if color == "gray" else []))
+
+    def render_region_array(self, pdf_path, box, page=1, dpi=OUTPUT_DPI, color="rgb"):
+        extra_args = self._region_args(box, dpi) + (["-gray"] if color == "gray" else [])
+        return pnm_to_array(self._pdftoppm(pdf_path, page, dpi, extra_args))
+
+    def page_jpeg(self, pdf_path, page=1):
+        # The JPEG stream of a page that is nothing but one image covering it
+        # (a wrapped scan) and where it is drawn (x1, y1, x2, y2 in PDF points),
+        # or None. pdfimages -j writes DCT images out as they are stored, but
+        # doesn't say where they are drawn or what else is on the page, so a
+        # small render of the page has to look like the image. `pdfimages
+        # -list` screens out other pages first, without extracting anything.
+        # The verdict is remembered per document and page, so cropping the
+        # page again only extracts the JPEG.
+        if not self.embedded_jpegs:
+            return None
+        key = (source_digest(pdf_path), page)
+        with self._jpeg_lock:
+            known = key in self._jpeg_pages
+            bounds = self._jpeg_pages.get(key)
+            if known:
+                self._jpeg_pages.move_to_end(key)
+        if known:
+            data = self._extract_jpeg(pdf_path, page) if bounds is not None else None
+            return (data, bounds) if data is not None else None
+        found = self._check_page_jpeg(pdf_path, page)
+        with self._jpeg_lock:
+            self._jpeg_pages[key] = found[1] if found is not None else None
+            while len(self._jpeg_pages) > JPEG_MEMO_SIZE:
+                self._jpeg_pages.popitem(last=False)
+        return found
+
+    def _extract_jpeg(self, pdf_path, page):
+        # The page's one image as stored, if it is a JPEG, else None
+        with tempfile.TemporaryDirectory() as tmp:
+            command = [_poppler_command("pdfimages", self.poppler_path), "-j", "-f", str(page), "-l", str(page),
+                       pdf_path, os.path.join(tmp, "image")]
+            try:
+                proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self._env())
+            except OSError:
+                return None
+            files = os.listdir(tmp)
+            if proc.returncode != 0 or len(files) != 1 or not files[0].endswith(".jpg"):
+                return None
+            with open(os.path.join(tmp, files[0]), "rb") as f:
+                return f.read()
+
+    def _check_page_jpeg(self, pdf_path, page):
+        # page_jpeg without the memo: (data, bounds) or None
+        command = [_poppler_command("pdfimages", self.poppler_path), "-list", "-f", str(page), "-l", str(page), pdf_path]
+        try:
+            proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self._env())
+        except OSError:
+            return None  # An older poppler without pdfimages: render instead
+        rows = _parse_pdfimages_list(proc.stdout.decode(errors="replace")) if proc.returncode == 0 else []
+        if len(rows) != 1 or rows[0]["type"] != "image" or rows[0]["enc"] != "jpeg":
+            return None
+        info = self.page_info(pdf_path, page)
+        if info["rotation"]:
+            return None
+        # The size it is drawn at, from its pixel size and resolution on the page
+        listed = rows[0]
+        if listed["x_ppi"] <= 0 or listed["y_ppi"] <= 0:
+            return None
+        w, h = info["page_size"]
+        drawn = (listed["width"] / listed["x_ppi"] * 72, listed["height"] / listed["y_ppi"] * 72)
+        if abs(drawn[0] - w) > w * EMBEDDED_MARGIN or abs(drawn[1] - h) > h * EMBEDDED_MARGIN:
+            return None
+
+        data = self._extract_jpeg(pdf_path, page)
+        if data is None:
+            return None
+        image = _open_jpeg(data)
+        if image is None:
+            return None
+        check = self.render_page_array(pdf_path, page, VERIFY_DPI, color="gray")
+        height, width = check.shape
+        _draft(image, "gray", (width, height))
+        pixels = resize(convert(as_array(image), "gray"), (width, height))
+        if np.abs(pixels.astype(np.int16) - check).mean() > VERIFY_TOLERANCE:
+            return None
+        return data, (0.0, 0.0, w, h)
+
+    def close(self):
+        pass
+
+
+class PdfiumRenderer:
+    """Renders in-process with PDFium (pypdfium2), straight into memory.
+
+    Recently used documents are kept open so moving between pages, or
+    rendering a preview and then a region of the same file, doesn't re-parse
+    the PDF. PDFium is not thread-safe, so all calls are serialized.
+    """
+
+    name = "pdfium"
+    embedded_jpegs = True  # page_jpeg only looks at the page objects
+    _lock = threading.Lock()
+
+    def __init__(self, max_open=8):
+        if pdfium is None:
+            raise ImportError("pypdfium2 is not installed")
+        self.max_open = max_open
+        self._documents = OrderedDict()  # path -> PdfDocument, least recently used first
+
+    def _document(self, pdf_path):
+        pdf = self._documents.pop(pdf_path, None)
+        if pdf is None:
+            pdf = pdfium.PdfDocument(pdf_path)
+            while len(self._documents) >= self.max_open:
+                self._documents.popitem(last=False)[1].close()
+        self._documents[pdf_path] = pdf
+        return pdf
+
+    def page_info(self, pdf_path, page=1):
+        with self._lock:
+            pdf = self._document(pdf_path)
+            pdf_page = pdf[page - 1]
+            try:
+                # get_size() already accounts for /Rotate, like pdfinfo + swap
+                return {"pages": len(pdf), "page_size": pdf_page.get_size(), "rotation": pdf_page.get_rotation()}
+            finally:
+                pdf_page.close()
+
+    def _render(self, pdf_path, page, dpi, box=None, grayscale=False):
+        # Returns the PdfBitmap; its buffer is owned by Python, so arrays
+        # viewing it stay valid after the page is closed
+        with self._lock:
+            pdf_page = self._document(pdf_path)[page - 1]
+            try:
+                crop = (0, 0, 0, 0)
+                if box:
+                    # pdfium crops by the amount to cut from each side: (left, bottom, right, top)
+                    w, h = pdf_page.get_size()
+                    x1, y1, x2, y2 = box
+                    crop = (max(0, x1), max(0, h - y2), max(0, w - x2), max(0, y1))
+                return pdf_page.render(scale=dpi / 72.0, crop=crop, rev_byteorder=True, grayscale=grayscale)
+            finally:
+                pdf_page.close()
+
+    def page_jpeg(self, pdf_path, page=1):
+        # The JPEG stream of a page that is nothing but one upright image
+        # covering it (a wrapped scan; an invisible OCR text layer is fine)
+        # and where it is drawn (x1, y1, x2, y2 in PDF points), or None
+        with self._lock:
+            pdf_page = self._document(pdf_path)[page - 1]
+            try:
+                if pdf_page.get_rotation():
+                    return None
+                image = None
+                for obj in pdf_page.get_objects(max_depth=0):
+                    if (obj.type == pdfium_c.FPDF_PAGEOBJ_TEXT
+                            and pdfium_c.FPDFTextObj_GetTextRenderMode(obj) == pdfium_c.FPDF_TEXTRENDERMODE_INVISIBLE):
+                        continue
+                    if obj.type != pdfium_c.FPDF_PAGEOBJ_IMAGE or image is not None:
+                        return None
+                    image = obj
+                if image is None or image.get_filters() != ["DCTDecode"]:
+                    return None
+                matrix = image.get_matrix()
+                if matrix.b or matrix.c or matrix.a <= 0 or matrix.d <= 0:
+                    return None  # Rotated or mirrored on the page
+                w, h = pdf_page.get_size()
+                left, bottom, right, top = image.get_bounds()
+                bounds = (left, h - top, right, h - bottom)
+                if not _covers_page(bounds, (w, h)):
+                    return None
+                return bytes(image.get_data()), bounds
+            finally:
+                pdf_page.close()
+
+    def render_page(self, pdf_path, page=1, dpi=PREVIEW_DPI):
+        return self._render(pdf_path, page, dpi).to_pil()
+
+    def render_region(self, pdf_path, box, page=1, dpi=OUTPUT_DPI):
+        return self._render(pdf_path, page, dpi, box).to_pil()
+
+    # The *_array variants return a NumPy array (see image_core) viewing
+    # PDFium's bitmap buffer, with no copy
+    def render_page_array(self, pdf_path, page=1, dpi=PREVIEW_DPI, color="rgb"):
+        return self._render(pdf_path, page, dpi, grayscale=color == "gray").to_numpy()
+
+    def render_region_array(self, pdf_path, box, page=1, dpi=OUTPUT_DPI, color="rgb"):
+        return self._render(pdf_path, page, dpi, box, grayscale=color == "gray").to_numpy()
+
+    def close(self):
+        with self._lock:
+            while self._documents:
+                self._documents.popitem()[1].close()
+
+
+RENDERERS = {"poppler": PopplerRenderer, "pdfium": PdfiumRenderer}
+
+
+def get_renderer(name="auto", poppler_path=None):
+    # "auto" prefers the in-process backend and falls back to poppler
+    if name == "auto":
+        name = "pdfium" if pdfium is not None else "poppler"
+    if name == "poppler":
+        return PopplerRenderer(poppler_path)
+    if name == "pdfium":
+        return PdfiumRenderer()
+    raise ValueError(f"Unknown renderer {name!r}, expected one of: auto, {', '.join(RENDERERS)}")
+
+
+def load_page(renderer, pdf_path, dpi=PREVIEW_DPI, page=1, cache=None):
+    # Render a page, going through the on-disk render cache when one is given.
+    # Returns (image, info) where info is the renderer's page_info() dict.
+    digest = None
+    if cache is not None:
+        digest = source_digest(pdf_path)
+        hit = cache.get(digest, dpi, page)
+        if hit:
+            return hit
+
+    info = renderer.page_info(pdf_path, page)
+    image = renderer.render_page(pdf_path, page, dpi)
+    if cache is not None:
+        cache.put(digest, dpi, page, image, info)
+    return image, info
+
+
+def load_page_array(renderer, pdf_path, dpi=PREVIEW_DPI, page=1, cache=None):
+    # Like load_page, but returns the page as an RGB array: the renderer's
+    # own buffer on a miss, a memory map of the cache file on a hit
+    digest = None
+    if cache is not None:
+        digest = source_digest(pdf_path)
+        hit = cache.get_array(digest, dpi, page)
+        if hit:
+            return hit
+
+    info = renderer.page_info(pdf_path, page)
+    pixels = renderer.render_page_array(pdf_path, page, dpi)
+    if cache is not None:
+        cache.put(digest, dpi, page, pixels, info)
+    return pixels, info
+
+
+def load_region_array(renderer, pdf_path, box, page=1, dpi=OUTPUT_DPI, color="rgb", embedded=True):
+    # render_region_array, except that with `embedded` a page that is just a
+    # wrapped JPEG scan is cropped from the JPEG itself, without rendering
+    # (see page_jpeg). Returns (pixels, source), source "embedded" or "render".
+    if embedded:
+        jpeg = renderer.page_jpeg(pdf_path, page)
+        if jpeg is not None:
+            pixels = _jpeg_region(*jpeg, box, dpi, color)
+            if pixels is not None:
+                return pixels, "embedded"
+    return renderer.render_region_array(pdf_path, box, page=page, dpi=dpi, color=color), "render"
@@ -0,0 +1,76 @@
+
+import fnmatch
+import os
+import re
+
+INCLUDE = ("*.pdf",)
+
+
+def natural_key(name):
+    # "file10.pdf" sorts after "file9.pdf"; ties broken by the exact name so
+    # the order is stable across runs and platforms
+    parts = re.split(r"(\d+)", name)
+    return tuple(int(part) if i % 2 else part.lower() for i, part in enumerate(parts)), name
+
+
+def _matches(path, patterns):
+    # Patterns are matched case-insensitively against the relative path
+    # ("sub/file.pdf") and the bare name, so "*.pdf" and "drafts/*" both work
+    name = path.rstrip("/").rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def wanted(path, include=INCLUDE, exclude=()):
+    # Whether scan_pdfs would yield the relative path `path` ("sub/file.pdf"),
+    # for files reported one at a time, e.g. by a folder watcher
+    include = [p.lower() for p in include]
+    exclude = [p.lower() for p in exclude]
+    parts = path.lower().split("/")
+    for depth, name in enumerate(parts[:-1], 1):
+        if name.startswith(".") or _matches("/".join(parts[:depth]) + "/", exclude):
+            return False
+    return _matches(path.lower(), include) and not _matches(path.lower(), exclude)
+
+
+def scan_pdfs(folder, recursive=True, include=INCLUDE, exclude=()):
+    """Yield PDF paths under `folder`, relative to it, in natural sort order.
+
+    Walks with os.scandir one directory at a time and yields as it goes, so
+    the first file is available right away even in a tree of 100k files.
+    Within a directory files come first, then subdirectories, both sorted
+    naturally. Paths use "/" separators. `include`/`exclude` are glob
+    patterns; a directory matching `exclude` is not walked at all.
+    """
+    include = [p.lower() for p in include]
+    exclude = [p.lower() for p in exclude]
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        files, dirs = [], []
+        try:
+            with os.scandir(os.path.join(folder, rel_dir) if rel_dir else folder) as entries:
+                for entry in entries:
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir():
+                            # "drafts/*" prunes the drafts folder itself
+                            skip = entry.name.startswith(".") or _matches(rel.lower() + "/", exclude)
+                            if recursive and not skip:
+                                dirs.append(entry.name)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue  # Vanished or unreadable entry
+                    lower = rel.lower()
+                    if _matches(lower, include) and not _matches(lower, exclude):
+                        files.append(entry.name)
+        except OSError as e:
+            print(f"Could not read {os.path.join(folder, rel_dir)}: {e}")
+            continue
+
+        for name in sorted(files, key=natural_key):
+            yield f"{rel_dir}/{name}" if rel_dir else name
+        # Reversed onto the stack, so subdirectories are walked in order
+        for name in sorted(dirs, key=natural_key, reverse=True):
+            stack.append(f"{rel_dir}/{name}" if rel_dir else name)
@@ -0,0 +1,137 @@
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+RASTER_MEMORY_MB = 512
+
+
+class RasterMemory:
+    """Byte budget for the page rasters a session holds in memory.
+
+    Each page (any hashable key) is an entry with a value, e.g. its rendered
+    preview and display pyramid, and the sizes of its buffers by kind
+    ("preview", "pyramid", "display"...). Short-lived buffers such as
+    full-DPI crops are counted while reserve() is held. When the total goes
+    over `budget`, the least recently used pages that aren't pinned are
+    evicted: dropped here and passed to `on_evict(key, value)`, which drops
+    any other reference to them. An evicted page comes back from the render
+    cache on disk if it is there, and is rendered again otherwise.
+    """
+
+    def __init__(self, budget=RASTER_MEMORY_MB * 1024 * 1024, on_evict=None):
+        self.budget = budget
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, {kind: bytes}), least recently used first
+        self._pinned = set()
+        self._transient = {}  # kind -> bytes reserved right now
+        self._total = 0
+        self.peak = 0
+        self.evictions = 0
+
+    def put(self, key, value, buffers):
+        # Add (or replace) a page; `buffers` is {kind: bytes}
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= sum(old[1].values())
+            self._entries[key] = (value, dict(buffers))
+            self._total += sum(buffers.values())
+            evicted = self._evict()
+        self._release(evicted)
+
+    def get(self, key):
+        # The page's value (now most recently used), or None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def track(self, key, kind, nbytes):
+        # Set the size of one buffer of a page that is already held, e.g. its
+        # display image after a redraw (0 once it is gone)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            buffers = entry[1]
+            self._total += nbytes - buffers.get(kind, 0)
+            if nbytes:
+                buffers[kind] = nbytes
+            else:
+                buffers.pop(kind, None)
+            self._entries.move_to_end(key)
+            evicted = self._evict()
+        self._release(evicted)
+
+    def pin(self, key):
+        # Pinned pages (the one on screen) are never evicted
+        with self._lock:
+            self._pinned.add(key)
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned.discard(key)
+
+    @contextmanager
+    def reserve(self, kind, nbytes):
+        # Count a buffer that only lives inside the with-block, making room
+        # for it first
+        with self._lock:
+            self._transient[kind] = self._transient.get(kind, 0) + nbytes
+            self._total += nbytes
+            evicted = self._evict()
+        self._release(evicted)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._transient[kind] -= nbytes
+                self._total -= nbytes
+
+    def _evict(self):
+        # With the lock held: drop LRU unpinned pages until the budget is met.
+        # Returns [(key, value)] for _release() to hand on outside the lock.
+        self.peak = max(self.peak, self._total)
+        evicted = []
+        for key in list(self._entries):
+            if self._total <= self.budget:
+                break
+            if key in self._pinned:
+                continue
+            value, buffers = self._entries.pop(key)
+            self._total -= sum(buffers.values())
+            evicted.append((key, value))
+        self.evictions += len(evicted)
+        return evicted
+
+    def _release(self, evicted):
+        if self.on_evict:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def available(self):
+        # Bytes left for pages that can be evicted: the budget less the pinned
+        # pages and the buffers reserved right now
+        with self._lock:
+            held = sum(sum(buffers.values()) for key, (_, buffers) in self._entries.items() if key in self._pinned)
+            return max(0, self.budget - held - sum(self._transient.values()))
+
+    def usage(self):
+        # Bytes held now (total and by kind), pages held, budget, peak and eviction count
+        with self._lock:
+            by_kind = {kind: n for kind, n in self._transient.items() if n}
+            for _, buffers in self._entries.values():
+                for kind, n in buffers.items():
+                    by_kind[kind] = by_kind.get(kind, 0) + n
+            return {
+                "bytes": self._total,
+                "budget": self.budget,
+                "pages": len(self._entries),
+                "by_kind": by_kind,
+                "peak": self.peak,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,165 @@
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+CACHE_FOLDER = ".render_cache"
+CACHE_MAX_MB = 1024
+
+# PIL mode -> channels stored per pixel in the raw files
+MODE_CHANNELS = {"L": 1, "RGB": 3, "RGBA": 4}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    # Content hash, so renamed or re-copied files still hit the cache
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_digests = OrderedDict()  # path -> (size, mtime_ns, digest), least recently used first
+_digests_lock = threading.Lock()
+DIGEST_MEMO_SIZE = 4096
+
+
+def source_digest(path):
+    # file_digest, remembered until the file's size or mtime changes: the
+    # pages of a bundle (journal records, cache keys...) share one hash
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        hit = _digests.get(path)
+        if hit is not None and hit[:2] == key:
+            _digests.move_to_end(path)
+            return hit[2]
+    digest = file_digest(path)
+    with _digests_lock:
+        _digests[path] = (*key, digest)
+        _digests.move_to_end(path)
+        while len(_digests) > DIGEST_MEMO_SIZE:
+            _digests.popitem(last=False)
+    return digest
+
+
+class RenderCache:
+    """On-disk LRU cache of rendered pages.
+
+    Each entry is a raw pixel file (loaded back with a memory map, no PNG
+    decode) plus a small JSON file with its shape and the page metadata.
+    Keys are (content hash, DPI, page index). Recency is the raw file's
+    mtime, so it survives restarts. A `max_bytes` of 0 or less disables it:
+    no folder is created and nothing is read or written.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total = 0
+        if max_bytes <= 0:
+            return
+
+        os.makedirs(folder, exist_ok=True)
+        found = []
+        for entry in os.scandir(folder):
+            if entry.name.endswith(".raw"):
+                key = entry.name[:-4]
+                stat = entry.stat()
+                found.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    def _paths(self, key):
+        base = os.path.join(self.folder, key)
+        return base + ".raw", base + ".json"
+
+    def get(self, digest, dpi, page=1):
+        # Returns (image, info) or None
+        hit = self.get_array(digest, dpi, page)
+        if hit is None:
+            return None
+        return Image.fromarray(hit[0]), hit[1]
+
+    def get_array(self, digest, dpi, page=1):
+        # Returns (read-only memory-mapped array, info) or None
+        if self.max_bytes <= 0:
+            return None
+        key = f"{digest}_{dpi}_{page}"
+        raw_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            width, height, mode = meta["width"], meta["height"], meta["mode"]
+            shape = (height, width) if mode == "L" else (height, width, MODE_CHANNELS[mode])
+            pixels = np.memmap(raw_path, dtype=np.uint8, mode="r", shape=shape)
+            os.utime(raw_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+        info = meta["info"]
+        info["page_size"] = tuple(info["page_size"])
+        return pixels, info
+
+    def put(self, digest, dpi, page, image, info):
+        # `image` is a PIL image or a uint8 array as rendered (see image_core)
+        if isinstance(image, np.ndarray):
+            pixels = image
+            channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+            mode = {1: "L", 3: "RGB", 4: "RGBA"}.get(channels)
+        else:
+            mode = image.mode
+            pixels = None
+        if self.max_bytes <= 0 or mode not in MODE_CHANNELS:
+            return
+        key = f"{digest}_{dpi}_{page}"
+        raw_path, meta_path = self._paths(key)
+
+        # Write to temp files and rename, so concurrent readers (prefetch
+        # threads, batch workers) never see a half-written entry
+        if pixels is None:
+            pixels = np.asarray(image)
+        pixels = np.ascontiguousarray(pixels)
+        tmp = f"{raw_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            pixels.tofile(tmp)
+            os.replace(tmp, raw_path)
+            meta = {"width": pixels.shape[1], "height": pixels.shape[0], "mode": mode, "info": info}
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp, meta_path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        with self._lock:
+            self._total += pixels.nbytes - self._entries.pop(key, 0)
+            self._entries[key] = pixels.nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def usage(self):
+        with self._lock:
+            return self._total, len(self._entries)
@@ -0,0 +1,104 @@
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Rough size of a 300 DPI A4 RGB page, used until a real render reports its size
+DEFAULT_PAGE_BYTES = 2480 * 3508 * 3
+
+
+def image_nbytes(image):
+    # Arrays know their size; PIL doesn't expose the buffer size, so estimate
+    # it from size and band count
+    if hasattr(image, "nbytes"):
+        return image.nbytes
+    return image.width * image.height * len(image.getbands())
+
+
+class RenderPrefetcher:
+    """Renders upcoming pages on background threads, ahead of the cursor.
+
+    The number of pages prefetched is bounded by `max_ahead`. With `memory`
+    (a RasterMemory) the renders also draw from its budget: a render in
+    flight reserves the size of the last finished one, a finished one is
+    put there with the sizes from `buffers(result)` ({kind: bytes}), pages
+    it still holds are reused without rendering, and no more pages are
+    prefetched than fit in what the pinned pages leave of the budget.
+    """
+
+    def __init__(self, render_func, max_ahead=4, memory=None, workers=2, buffers=lambda result: {"page": image_nbytes(result)}):
+        self.render_func = render_func
+        self.max_ahead = max_ahead
+        self.memory = memory
+        self.buffers = buffers
+        self.page_bytes = DEFAULT_PAGE_BYTES
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._futures = {}  # key -> Future, in scheduling order
+        self._lock = threading.Lock()
+
+    def depth(self):
+        # How many upcoming pages fit in the memory budget
+        if self.memory is None:
+            return self.max_ahead
+        return max(1, min(self.max_ahead, self.memory.available() // max(1, self.page_bytes)))
+
+    def _render(self, key):
+        if self.memory is None:
+            return self.render_func(key)
+        held = self.memory.get(key)
+        if held is not None:
+            return held
+        with self.memory.reserve("rendering", self.page_bytes):
+            result = self.render_func(key)
+        buffers = self.buffers(result)
+        self.page_bytes = max(1, sum(buffers.values()))
+        self.memory.put(key, result, buffers)
+        return result
+
+    def update(self, current, upcoming):
+        """Make `current` the active page and prefetch the next pages.
+
+        Work for pages that fell out of the window (e.g. skipped files) is
+        cancelled if it hasn't started, and finished results are released.
+        Returns the Future for `current`.
+        """
+        wanted = [current] + [key for key in upcoming if key != current][:self.depth()]
+
+        with self._lock:
+            for key in list(self._futures):
+                if key not in wanted:
+                    self._futures.pop(key).cancel()
+
+            for key in wanted:
+                if key not in self._futures:
+                    self._futures[key] = self._executor.submit(self._render, key)
+
+            return self._futures[current]
+
+    def discard(self, key):
+        # Forget a finished render, e.g. one a RasterMemory evicted, so its
+        # memory can be freed; the next update() asks for it again
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and future.done():
+                del self._futures[key]
+
+    def stats(self, current=None):
+        # (ready, pending) counts for pages other than `current`
+        ready = pending = 0
+        with self._lock:
+            for key, future in self._futures.items():
+                if key == current:
+                    continue
+                if future.done():
+                    ready += 1
+                else:
+                    pending += 1
+        return ready, pending
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
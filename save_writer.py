@@ -0,0 +1,54 @@
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SaveWriter:
+    """Runs save jobs (render crop, resize, encode, write) on background threads.
+
+    At most `max_pending` jobs are queued or running; submit() blocks once
+    that many are outstanding, so a fast operator can't build up unbounded
+    memory. Failures are collected for the UI to poll instead of raising.
+    """
+
+    def __init__(self, workers=2, max_pending=8):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="save")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._errors = deque()
+        self._closed = False
+
+    def submit(self, name, func, *args):
+        if self._closed:
+            raise RuntimeError("SaveWriter is closed")
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        return self._executor.submit(self._run, name, func, args)
+
+    def _run(self, name, func, args):
+        try:
+            return func(*args)
+        except Exception as e:
+            self._errors.append((name, e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def pop_errors(self):
+        errors = []
+        while self._errors:
+            errors.append(self._errors.popleft())
+        return errors
+
+    def flush(self):
+        # Wait for every queued save to finish; safe to call more than once
+        self._closed = True
+        self._executor.shutdown(wait=True)
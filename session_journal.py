@@ -0,0 +1,141 @@
+
+import json
+import os
+import threading
+import time
+
+from render_cache import file_digest, source_digest
+
+JOURNAL_FILE = "session_journal.jsonl"
+
+# Statuses that mean "don't show this file again"
+FINISHED = ("saved", "skipped")
+
+
+class SessionJournal:
+    """Append-only record of what happened to each input file.
+
+    One JSON object per line in OUTPUT_FOLDER/session_journal.jsonl; the
+    last line for a (file, page) wins. Restarting a session (or a batch run) uses it
+    to skip finished files, and crop_pdfs_batch.py --from-journal replays the
+    saved crops without any UI.
+    """
+
+    def __init__(self, output_folder, filename=JOURNAL_FILE):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, filename)
+        self.entries = {}  # (file, page) -> latest record
+        self.rotations = {}  # file -> rotation of its latest saved/skipped record
+        self.files_by_hash = {}  # source hash -> {file: None}, every file journaled with that content
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line after a crash
+                    self.entries[(record["file"], record.get("page", 1))] = record
+                    self.files_by_hash.setdefault(record.get("source_hash"), {})[record["file"]] = None
+                    if record["status"] in FINISHED:
+                        self.rotations[record["file"]] = record.get("rotation", 0)
+
+    def record(self, pdf_file, pdf_path, status, box=None, rotation=0, output=None, error=None, page=1, pages=1, duplicate_of=None,
+               source_hash=None):
+        # source_hash: the source's digest if the caller has it (one per file,
+        # not per page); otherwise source_digest() computes or recalls it
+        stat = os.stat(pdf_path)
+        record = {
+            "file": pdf_file,
+            "page": page,
+            "pages": pages,
+            "status": status,
+            "time": round(time.time(), 3),
+            "source_hash": source_hash or source_digest(pdf_path),
+            "source_size": stat.st_size,
+            "source_mtime": stat.st_mtime,
+            "rotation": rotation % 360,
+        }
+        if box is not None:
+            record["box"] = [round(v, 6) for v in box]  # Normalized, on the unrotated page
+        if output is not None:
+            record["output"] = output  # Relative to the output folder
+            record["output_hash"] = file_digest(os.path.join(self.output_folder, output))
+        if error is not None:
+            record["error"] = error
+        if duplicate_of is not None:
+            record["duplicate_of"] = duplicate_of  # Outputs copied from this file's, see dedupe
+
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[(pdf_file, page)] = record
+            self.files_by_hash.setdefault(record["source_hash"], {})[pdf_file] = None
+            if status in FINISHED:
+                self.rotations[pdf_file] = record["rotation"]
+        return record
+
+    def rotation_for(self, pdf_file, default=0):
+        # Last rotation used for any page of the file, so it can be reapplied
+        return self.rotations.get(pdf_file, default)
+
+    def is_finished(self, pdf_file, pdf_path, page=None):
+        # Finished = saved (output still on disk) or skipped, and the source
+        # hasn't changed since. With page=None, every page of the file must be.
+        first = self.entries.get((pdf_file, page or 1))
+        if not first or first.get("pages", 1) < 1:
+            return False  # pages == 0: failed before the page count was known
+        pages = [page] if page else range(1, first.get("pages", 1) + 1)
+
+        for p in pages:
+            record = self.entries.get((pdf_file, p))
+            if not record or record["status"] not in FINISHED:
+                return False
+            if record["status"] == "saved":
+                if not os.path.exists(os.path.join(self.output_folder, record.get("output", ""))):
+                    return False
+        return self._source_unchanged(pdf_path, first)
+
+    def pending_pages(self, pdf_file, pdf_path):
+        # Pages of a file still to do: None if the journal doesn't know the
+        # file (or it changed), so all pages; [] if it is finished
+        first = self.entries.get((pdf_file, 1))
+        if not first or first.get("pages", 1) < 1 or not self._source_unchanged(pdf_path, first):
+            return None
+        return [p for p in range(1, first.get("pages", 1) + 1)
+                if not self.is_finished(pdf_file, pdf_path, p)]
+
+    def finished_copy(self, source_hash, exclude=None, since=None):
+        # Page records of a file (other than `exclude`) with this content
+        # whose every page is finished, saved outputs still on disk, and
+        # recorded after `since` if given; None if there is no such file
+        for pdf_file in list(self.files_by_hash.get(source_hash, ())):
+            if pdf_file == exclude:
+                continue
+            first = self.entries.get((pdf_file, 1))
+            if not first or first.get("pages", 1) < 1:
+                continue
+            records = [self.entries.get((pdf_file, p)) for p in range(1, first["pages"] + 1)]
+            if all(r and r["status"] in FINISHED and r.get("source_hash") == source_hash
+                   and (since is None or r["time"] >= since)
+                   and (r["status"] != "saved" or os.path.exists(os.path.join(self.output_folder, r.get("output", ""))))
+                   for r in records):
+                return records
+        return None
+
+    def _source_unchanged(self, pdf_path, record):
+        # Size + mtime avoids re-hashing untouched files
+        try:
+            stat = os.stat(pdf_path)
+        except OSError:
+            return False
+        if stat.st_size == record.get("source_size") and stat.st_mtime == record.get("source_mtime"):
+            return True
+        return source_digest(pdf_path) == record.get("source_hash")
+
+    def saved(self):
+        # Latest record of every file whose crop was saved
+        return [record for record in self.entries.values() if record["status"] == "saved" and "box" in record]
@@ -0,0 +1,47 @@
+import argparse
+import json
+import os
+import sqlite3
+
+import crop_pdfs_cluster
+from crop_pdfs_cluster import QUEUE_RETRY_DELAY, WORKER_JOURNAL, collect, retry_queue
+from job_queue import JobQueue
+from session_journal import JOURNAL_FILE, SessionJournal
+
+
+def test_collect_merges_worker_records_in_time_order(tmp_path):
+    output = str(tmp_path)
+    # "b" saved the page after "a" had failed it; sorting by file name would
+    # put "a"'s error last and have it win on resume
+    records = {
+        "b-host-2": [{"file": "cert.pdf", "page": 1, "status": "saved", "time": 20.0}],
+        "a-host-1": [{"file": "cert.pdf", "page": 1, "status": "error", "time": 10.0},
+                     {"file": "other.pdf", "page": 1, "status": "saved", "time": 30.0}],
+    }
+    for worker, lines in records.items():
+        with open(os.path.join(output, WORKER_JOURNAL.format(worker)), "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in lines)
+
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    try:
+        collect(argparse.Namespace(output=output, force=False), queue)
+    finally:
+        queue.close()
+
+    with open(os.path.join(output, JOURNAL_FILE)) as f:
+        assert [json.loads(line)["time"] for line in f] == [10.0, 20.0, 30.0]
+    assert not any(name.startswith("session_journal.") and name != JOURNAL_FILE for name in os.listdir(output))
+    assert SessionJournal(output).entries[("cert.pdf", 1)]["status"] == "saved"
+
+
+def test_queue_calls_are_retried_while_the_database_is_busy(monkeypatch):
+    calls = []
+    monkeypatch.setattr(crop_pdfs_cluster.time, "sleep", lambda seconds: calls.append(seconds))
+
+    def lease(worker, count):
+        if len(calls) < 2:
+            raise sqlite3.OperationalError("database is locked")
+        return [(1, "cert.pdf", 0, None)]
+
+    assert retry_queue(lease, "w1", 4) == [(1, "cert.pdf", 0, None)]
+    assert calls == [QUEUE_RETRY_DELAY, QUEUE_RETRY_DELAY * 2]
@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+
+from dedupe import Deduplicator
+from session_journal import SessionJournal
+
+
+class SlowRenderer:
+    # Renders a blank page once `release` is set
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def page_info(self, pdf_path):
+        return {"pages": 1}
+
+    def render_page_array(self, pdf_path, page, dpi, color):
+        self.started.set()
+        self.release.wait(5)
+        return np.full((80, 60), 255, dtype=np.uint8)
+
+
+def test_lookups_dont_wait_for_a_perceptual_hash(tmp_path):
+    input_folder = tmp_path / "input"
+    input_folder.mkdir()
+    (input_folder / "a.pdf").write_bytes(b"%PDF-1.4 a")
+    (input_folder / "b.pdf").write_bytes(b"%PDF-1.4 b")
+    renderer = SlowRenderer()
+    dedupe = Deduplicator(SessionJournal(str(tmp_path)), str(input_folder), renderer=renderer, perceptual=True)
+
+    renderer.release.set()
+    assert not dedupe.is_copy("a.pdf")
+    renderer.release.clear()
+    renderer.started.clear()
+
+    hashing = threading.Thread(target=dedupe.is_copy, args=("b.pdf",))
+    hashing.start()
+    try:
+        assert renderer.started.wait(5)
+        # b.pdf is being rendered for its hash; a.pdf's answer doesn't wait for it
+        answered = []
+        lookup = threading.Thread(target=lambda: answered.append(dedupe.original("a.pdf")))
+        lookup.start()
+        lookup.join(1)
+        assert answered == ["a.pdf"]
+    finally:
+        renderer.release.set()
+        hashing.join()
+    assert dedupe.original("b.pdf") == "a.pdf"  # Both blank: the same document to the eye
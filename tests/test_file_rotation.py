@@ -0,0 +1,19 @@
+import pytest
+
+from crop_pdfs_batch import file_rotation
+from session_journal import SessionJournal
+
+
+def test_interactive_rotation_is_used_only_if_the_template_box_fits(tmp_path):
+    pdf_path = tmp_path / "cert.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 stand-in")
+    journal = SessionJournal(str(tmp_path))
+    box = (0.1, 0.1, 0.7, 0.5)
+
+    assert file_rotation(journal, "cert.pdf", 90, box) == 90  # Nothing chosen: the template's
+
+    journal.record("cert.pdf", str(pdf_path), "skipped", rotation=270)
+    assert file_rotation(journal, "cert.pdf", 90, box) == 270  # Upside down, same box shape
+    with pytest.raises(ValueError):
+        file_rotation(journal, "cert.pdf", 0, box)  # A quarter turn needs the other box shape
+    assert file_rotation(journal, "cert.pdf", 0, None) == 270  # Auto mode detects its own box
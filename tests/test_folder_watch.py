@@ -0,0 +1,70 @@
+import os
+
+from folder_watch import FolderWatcher
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_incomplete_file_is_given_up_on(tmp_path):
+    write(tmp_path / "broken.pdf", b"%PDF-1.4 truncated")
+    watcher = FolderWatcher(str(tmp_path), settle=1, incomplete=10, use_polling=True)
+    watcher.start()
+
+    assert watcher.ready(now=100) == []  # Size/mtime noted
+    assert watcher.ready(now=105) == []  # Settled, but no %%EOF yet
+    assert watcher.settling() == 1
+    assert watcher.ready(now=111) == []
+    assert watcher.settling() == 0
+    assert watcher.ready(now=200) == []  # Not picked up again while unchanged
+    assert watcher.settling() == 0
+
+    # Finishing the file brings it back
+    write(tmp_path / "broken.pdf", b"%PDF-1.4 complete\n%%EOF\n")
+    os.utime(tmp_path / "broken.pdf", ns=(0, 10**9))
+    watcher.ready(now=300)
+    assert watcher.ready(now=310) == [("broken.pdf", 300)]
+
+
+def test_known_files_are_forgotten_when_they_go_away(tmp_path):
+    write(tmp_path / "cert.pdf", b"%PDF-1.4\n%%EOF\n")
+    watcher = FolderWatcher(str(tmp_path), settle=1, use_polling=True)
+    watcher.start()
+    watcher.ready(now=100)
+    assert [name for name, _ in watcher.ready(now=105)] == ["cert.pdf"]
+
+    # A deletion event (as watchdog reports it) drops the file from the known set
+    os.remove(tmp_path / "cert.pdf")
+    watcher.touch("cert.pdf", now=106)
+    watcher.ready(now=106.5)
+    assert watcher._known == {}
+
+
+def test_subfolders_and_excludes_match_the_scanner(tmp_path):
+    for rel in ("a.pdf", "sub/b.pdf", "drafts/c.pdf", ".hidden/d.pdf", "sub/notes.txt"):
+        os.makedirs(os.path.dirname(tmp_path / rel), exist_ok=True)
+        write(tmp_path / rel, b"%PDF-1.4\n%%EOF\n")
+    watcher = FolderWatcher(str(tmp_path), recursive=True, exclude=["drafts/*"], settle=1, use_polling=True)
+    watcher.start()
+    watcher.ready(now=100)
+    assert sorted(name for name, _ in watcher.ready(now=105)) == ["a.pdf", "sub/b.pdf"]
+
+    flat = FolderWatcher(str(tmp_path), settle=1, use_polling=True)
+    flat.start()
+    flat.ready(now=100)
+    assert [name for name, _ in flat.ready(now=105)] == ["a.pdf"]
+
+
+def test_ready_leaves_files_beyond_the_limit_for_later(tmp_path):
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        write(tmp_path / name, b"%PDF-1.4\n%%EOF\n")
+    watcher = FolderWatcher(str(tmp_path), settle=1, use_polling=True)
+    watcher.start()
+    watcher.ready(now=100)
+    assert len(watcher.ready(now=105, limit=2)) == 2
+    assert watcher.settling() == 1
+    assert len(watcher.ready(now=106, limit=0)) == 0
+    assert len(watcher.ready(now=107, limit=2)) == 1  # Still settled: no second wait
+    assert watcher.settling() == 0
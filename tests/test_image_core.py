@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from display_pyramid import build_pyramid, scale_for_display
+from image_core import pnm_to_array
+
+
+def test_ppm_is_read_in_place():
+    data = b"P6\n3 2\n255\n" + bytes(range(18))
+    pixels = pnm_to_array(data)
+    assert pixels.shape == (2, 3, 3)
+    assert pixels[1, 2].tolist() == [15, 16, 17]
+    assert not pixels.flags.owndata  # A view of `data`
+
+
+def test_pgm_with_comments_between_fields():
+    data = b"P5 # made by pdftoppm\n4 # width\n# another comment\n1\n255\n" + bytes([0, 85, 170, 255])
+    assert pnm_to_array(data).tolist() == [[0, 85, 170, 255]]
+
+
+def test_smaller_maxval_is_scaled_to_the_full_range():
+    data = b"P5\n3 1\n15\n" + bytes([0, 5, 15])
+    assert pnm_to_array(data).tolist() == [[0, 85, 255]]
+
+
+@pytest.mark.parametrize("header, message", [
+    (b"P3\n1 1\n255\n", "Not a binary"),
+    (b"P5\n1 1\n65535\n", "16-bit"),
+    (b"P5\n1 1\n0\n", "maxval"),
+])
+def test_unsupported_pnm_is_rejected(header, message):
+    with pytest.raises(ValueError, match=message):
+        pnm_to_array(header + b"\0\0")
+
+
+def test_display_pyramid_is_built_from_the_page_array():
+    pixels = np.zeros((600, 400, 3), dtype=np.uint8)
+    pyramid = build_pyramid(pixels, min_side=100)
+    assert [level.shape[:2] for level in pyramid] == [(600, 400), (300, 200), (150, 100)]
+    assert scale_for_display(pyramid, 200, 120, rotation=90).shape == (120, 200, 3)
+    assert scale_for_display(pyramid, 120, 200, high_quality=False).shape == (200, 120, 3)
@@ -0,0 +1,115 @@
+import pytest
+
+import job_queue
+from job_queue import RETRY_DELAY, JobQueue
+
+
+class Clock:
+    # Stands in for the time module, so leases and retry delays can be stepped through
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lease_seconds=60, max_attempts=2)
+    queue.add([("a.pdf", 0, None), ("b.pdf", 90, [2, 3])])
+    yield queue
+    queue.close()
+
+
+def state(queue, file):
+    return dict(queue.conn.execute("SELECT * FROM jobs WHERE file = ?", (file,)).fetchone())
+
+
+def test_lease_hands_each_job_out_once(queue):
+    assert queue.lease("w1", 5) == [(1, "a.pdf", 0, None), (2, "b.pdf", 90, [2, 3])]
+    assert queue.lease("w2", 5) == []
+    assert queue.remaining() == 2
+
+
+def test_expired_lease_is_leased_again(queue, clock):
+    queue.lease("w1", 1)
+    clock.now += 30
+    queue.renew("w1", [1])
+    clock.now += 45  # Renewed, so still held
+    assert [job[1] for job in queue.lease("w2", 1)] == ["b.pdf"]
+
+    clock.now += 61
+    assert [job[1] for job in queue.lease("w2", 1)] == ["a.pdf"]
+    row = state(queue, "a.pdf")
+    assert (row["worker"], row["attempts"]) == ("w2", 2)
+    # The lease moved on: w1's late result doesn't count
+    queue.complete(1, "w1", saved=1, review=0)
+    assert state(queue, "a.pdf")["state"] == "leased"
+    queue.complete(1, "w2", saved=1, review=0)
+    assert state(queue, "a.pdf")["state"] == "done"
+
+
+def test_lease_running_out_on_the_last_attempt_fails_the_job(queue, clock):
+    queue.lease("w1", 1)
+    clock.now += 61
+    queue.lease("w2", 1)  # Attempt 2 of 2
+    clock.now += 61
+    queue.lease("w3", 1)
+    row = state(queue, "a.pdf")
+    assert (row["state"], row["error"]) == ("failed", "lease expired")
+
+
+def test_failed_job_is_retried_after_a_growing_delay(queue, clock):
+    queue.lease("w1", 1)
+    queue.fail(1, "w1", "boom")
+    row = state(queue, "a.pdf")
+    assert (row["state"], row["error"], row["available_at"]) == ("queued", "boom", clock.now + RETRY_DELAY)
+
+    clock.now += RETRY_DELAY - 1
+    assert [job[1] for job in queue.lease("w1", 2)] == ["b.pdf"]
+    clock.now += 1
+    assert [job[1] for job in queue.lease("w1", 1)] == ["a.pdf"]
+
+    # Out of attempts: failed for good, and no longer remaining
+    queue.fail(1, "w1", "boom again")
+    row = state(queue, "a.pdf")
+    assert (row["state"], row["finished"]) == ("failed", clock.now)
+    clock.now += 10 * RETRY_DELAY
+    assert [job[1] for job in queue.lease("w2", 2)] == ["b.pdf"]  # Its lease ran out meanwhile
+    assert queue.remaining() == 1
+
+
+def test_release_returns_leases_without_using_an_attempt(queue):
+    queue.lease("w1", 2)
+    assert queue.release("w1") == 2
+    row = state(queue, "a.pdf")
+    assert (row["state"], row["attempts"]) == ("queued", 0)
+    assert len(queue.lease("w2", 2)) == 2
+
+
+def test_retry_failed_gives_fresh_attempts(queue, clock):
+    for _ in range(2):
+        queue.lease("w1", 1)
+        queue.fail(1, "w1", "boom")
+        clock.now += 10 * RETRY_DELAY
+    assert state(queue, "a.pdf")["state"] == "failed"
+    assert queue.retry_failed() == 1
+    row = state(queue, "a.pdf")
+    assert (row["state"], row["attempts"], row["available_at"]) == ("queued", 0, 0)
+    assert [job[1] for job in queue.lease("w1", 1)] == ["a.pdf"]
+
+
+def test_add_requeues_only_with_requeue(queue):
+    queue.lease("w1", 1)
+    queue.complete(1, "w1", saved=1, review=0)
+    assert queue.add([("a.pdf", 0, None)]) == 0
+    assert queue.add([("a.pdf", 180, [1])], requeue=True) == 1
+    row = state(queue, "a.pdf")
+    assert (row["state"], row["rotation"], row["pages"]) == ("queued", 180, "[1]")
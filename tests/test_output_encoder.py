@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from output_encoder import OutputSettings, write_outputs
+
+
+def test_rotated_output_takes_a_box_of_the_other_orientation(tmp_path):
+    # Rotated by 90, a 600x400 output is cut from a 2:3 region of the page
+    settings = OutputSettings(sizes=(("", 600, 400),), workers=0)
+    outputs = write_outputs(np.zeros((300, 200, 3), dtype=np.uint8), str(tmp_path), "cert", settings, rotation=90)
+    with Image.open(outputs[0].path) as image:
+        assert image.size == (600, 400)
+
+
+def test_box_of_the_wrong_orientation_is_rejected(tmp_path):
+    settings = OutputSettings(sizes=(("", 600, 400),), workers=0)
+    with pytest.raises(ValueError):
+        write_outputs(np.zeros((200, 300, 3), dtype=np.uint8), str(tmp_path), "cert", settings, rotation=90)
+    with pytest.raises(ValueError):
+        write_outputs(np.zeros((300, 200, 3), dtype=np.uint8), str(tmp_path), "cert", settings)
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+from output_encoder import OutputSettings, write_outputs
+from session_journal import SessionJournal
+from work_items import WorkItem, output_name
+
+
+def test_nested_input_is_journaled_relative_to_output_folder(tmp_path):
+    # A file in a subfolder of the input is saved in the same subfolder of the
+    # output, and journaled by that relative path, as the CLI and GUI do
+    input_folder = tmp_path / "input_pdfs"
+    output_folder = tmp_path / "output_images"
+    (input_folder / "2024" / "march").mkdir(parents=True)
+    output_folder.mkdir()
+    pdf_file = os.path.join("2024", "march", "cert.pdf")
+    pdf_path = str(input_folder / pdf_file)
+    with open(pdf_path, "wb") as f:
+        f.write(b"%PDF-1.4 stand-in")
+
+    item = WorkItem(pdf_file, 1, 1)
+    pixels = np.zeros((40, 60, 3), dtype=np.uint8)
+    outputs = write_outputs(pixels, str(output_folder), output_name(item, ""), OutputSettings(sizes=(("", 60, 40),)))
+    output_filename = os.path.relpath(outputs[0].path, str(output_folder))
+    assert output_filename == output_name(item, ".png")
+
+    journal = SessionJournal(str(output_folder))
+    record = journal.record(pdf_file, pdf_path, "saved", (0.1, 0.1, 0.5, 0.4), output=output_filename)
+    assert record["output_hash"]
+    assert journal.is_finished(pdf_file, pdf_path)
+    # And a restarted session sees it as done
+    assert SessionJournal(str(output_folder)).is_finished(pdf_file, pdf_path)
@@ -0,0 +1,46 @@
+import os
+
+from pdf_scanner import scan_pdfs
+
+
+def touch(folder, *paths):
+    for path in paths:
+        full = os.path.join(folder, *path.split("/"))
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "wb"):
+            pass
+
+
+def test_natural_order_files_before_subfolders(tmp_path):
+    touch(tmp_path, "file10.pdf", "file9.pdf", "File2.PDF", "notes.txt",
+          "sub10/a.pdf", "sub9/b.pdf", "sub9/deeper/c.pdf")
+    assert list(scan_pdfs(str(tmp_path))) == [
+        "File2.PDF", "file9.pdf", "file10.pdf",
+        "sub9/b.pdf", "sub9/deeper/c.pdf", "sub10/a.pdf",
+    ]
+
+
+def test_paths_use_forward_slashes(tmp_path):
+    # Also on Windows, where os.path.join would give backslashes
+    touch(tmp_path, "2024/march/cert.pdf")
+    assert list(scan_pdfs(str(tmp_path))) == ["2024/march/cert.pdf"]
+
+
+def test_excluded_folders_are_not_walked(tmp_path, monkeypatch):
+    touch(tmp_path, "keep/a.pdf", "drafts/b.pdf", "drafts/old/c.pdf", "keep/skip-me.pdf", ".hidden/d.pdf")
+    walked = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        walked.append(os.path.relpath(path, tmp_path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", recording_scandir)
+    assert list(scan_pdfs(str(tmp_path), exclude=("drafts/*", "skip-*"))) == ["keep/a.pdf"]
+    assert sorted(walked) == [".", "keep"]
+
+
+def test_not_recursive_and_include(tmp_path):
+    touch(tmp_path, "a.pdf", "b.pdf", "sub/c.pdf")
+    assert list(scan_pdfs(str(tmp_path), recursive=False)) == ["a.pdf", "b.pdf"]
+    assert list(scan_pdfs(str(tmp_path), include=("sub/*",))) == ["sub/c.pdf"]
@@ -0,0 +1,33 @@
+from pdf_render import PopplerRenderer, _parse_pdfimages_list
+
+LISTING = """\
+page   num  type   width height color comp bpc  enc interp  object ID x-ppi y-ppi size ratio
+--------------------------------------------------------------------------------------------
+   1     0 image    2550  3300  rgb     3   8  jpeg   no         7  0   300   300  822K  10%
+   1     1 smask    2550  3300  gray    1   8  image  no         8  0   300   300 1024B 0.0%
+"""
+
+
+def test_parse_pdfimages_list():
+    rows = _parse_pdfimages_list(LISTING)
+    assert [row["type"] for row in rows] == ["image", "smask"]
+    assert rows[0] == {"type": "image", "width": 2550, "height": 3300, "enc": "jpeg", "x_ppi": 300.0, "y_ppi": 300.0}
+
+
+def test_parse_pdfimages_list_without_images():
+    assert _parse_pdfimages_list(LISTING.split("\n", 2)[0] + "\n" + "-" * 92 + "\n") == []
+
+
+def test_poppler_page_check_is_remembered(tmp_path, monkeypatch):
+    pdf_path = tmp_path / "scan.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 stand-in")
+    checks = []
+    renderer = PopplerRenderer()
+    monkeypatch.setattr(renderer, "_check_page_jpeg", lambda path, page: checks.append(page) or (b"jpeg", (0, 0, 10, 10)))
+    monkeypatch.setattr(renderer, "_extract_jpeg", lambda path, page: b"jpeg")
+
+    assert renderer.page_jpeg(str(pdf_path)) is None  # Off unless asked for
+    renderer.embedded_jpegs = True
+    assert renderer.page_jpeg(str(pdf_path)) == (b"jpeg", (0, 0, 10, 10))
+    assert renderer.page_jpeg(str(pdf_path)) == (b"jpeg", (0, 0, 10, 10))
+    assert checks == [1]
@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+
+from render_cache import RenderCache
+
+
+def test_zero_budget_disables_the_cache(tmp_path):
+    folder = str(tmp_path / "cache")
+    cache = RenderCache(folder, 0)
+    assert not os.path.exists(folder)
+
+    cache.put("digest", 100, 1, np.zeros((4, 4, 3), dtype=np.uint8), {"page_size": (1, 1)})
+    assert cache.get_array("digest", 100, 1) is None
+    assert not os.path.exists(folder)
+
+
+def test_cache_round_trip(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), 1 << 20)
+    pixels = np.arange(48, dtype=np.uint8).reshape(4, 4, 3)
+    cache.put("digest", 100, 2, pixels, {"page_size": (1, 1)})
+    hit, info = cache.get_array("digest", 100, 2)
+    assert np.array_equal(hit, pixels)
+    assert info["page_size"] == (1, 1)
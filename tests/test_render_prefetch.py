@@ -0,0 +1,55 @@
+import threading
+
+from raster_memory import RasterMemory
+from render_prefetch import RenderPrefetcher
+
+PAGE = 100
+
+
+def test_prefetch_draws_from_the_raster_memory_budget():
+    rendered = []
+    memory = RasterMemory(budget=10 * PAGE)
+    prefetcher = RenderPrefetcher(lambda key: rendered.append(key) or key, max_ahead=8, memory=memory, workers=1,
+                                  buffers=lambda result: {"preview": PAGE})
+    try:
+        assert prefetcher.update("a", []).result() == "a"
+        assert memory.usage()["by_kind"] == {"preview": PAGE}
+        assert prefetcher.depth() == 8
+
+        # The page on screen and its display image leave room for fewer pages ahead
+        memory.pin("a")
+        memory.track("a", "display", 5 * PAGE)
+        assert prefetcher.depth() == 4
+        with memory.reserve("crop", 3 * PAGE):
+            assert prefetcher.depth() == 1
+
+        # A page still held is reused rather than rendered again
+        prefetcher.discard("a")
+        assert prefetcher.update("a", []).result() == "a"
+        assert rendered == ["a"]
+    finally:
+        prefetcher.shutdown()
+
+
+def test_renders_in_flight_are_counted():
+    started, release = threading.Event(), threading.Event()
+
+    def render(key):
+        started.set()
+        release.wait(5)
+        return key
+
+    memory = RasterMemory(budget=10 * PAGE)
+    prefetcher = RenderPrefetcher(render, memory=memory, workers=1, buffers=lambda result: {"preview": PAGE})
+    prefetcher.page_bytes = 2 * PAGE
+    try:
+        future = prefetcher.update("a", [])
+        assert started.wait(5)
+        assert memory.usage()["by_kind"] == {"rendering": 2 * PAGE}
+        release.set()
+        future.result()
+        assert memory.usage()["by_kind"] == {"preview": PAGE}
+        assert prefetcher.page_bytes == PAGE
+    finally:
+        release.set()
+        prefetcher.shutdown()
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from image_core import rotate
+from pdf_render import rotate_box, rotated_size, unrotate_box
+
+WIDTH, HEIGHT = 300, 200  # Not square, so a mixed-up width and height shows
+BOX = (30, 20, 120, 80)
+
+
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+def test_box_round_trips(rotation):
+    rotated = rotate_box(BOX, rotation, WIDTH, HEIGHT)
+    assert unrotate_box(rotated, rotation, WIDTH, HEIGHT) == BOX
+
+
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+def test_box_follows_the_rotated_pixels(rotation):
+    page = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    x1, y1, x2, y2 = BOX
+    page[y1:y2, x1:x2] = 255
+    shown = rotate(page, rotation)
+    assert (shown.shape[1], shown.shape[0]) == rotated_size((WIDTH, HEIGHT), rotation)
+
+    ys, xs = np.nonzero(shown)
+    assert rotate_box(BOX, rotation, WIDTH, HEIGHT) == (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
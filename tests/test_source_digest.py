@@ -0,0 +1,15 @@
+import os
+
+from render_cache import file_digest, source_digest
+
+
+def test_source_digest_is_recomputed_when_the_file_changes(tmp_path):
+    path = str(tmp_path / "cert.pdf")
+    with open(path, "wb") as f:
+        f.write(b"first version")
+    assert source_digest(path) == file_digest(path)
+
+    with open(path, "wb") as f:
+        f.write(b"second, longer version")
+    os.utime(path, ns=(0, 10**9))
+    assert source_digest(path) == file_digest(path)
@@ -0,0 +1,31 @@
+import argparse
+import pstats
+import threading
+
+import pytest
+
+from timing import Instrumentation, add_arguments
+
+
+def test_unknown_trace_format_is_a_usage_error(capsys):
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    assert parser.parse_args(["--trace", "run.json"]).trace == "run.json"
+    with pytest.raises(SystemExit) as exit_info:
+        parser.parse_args(["--trace", "run.txt"])
+    assert exit_info.value.code == 2
+    assert "unknown trace format for run.txt" in capsys.readouterr().err
+
+
+def busy_in_a_thread():
+    return sum(i * i for i in range(1000))
+
+
+def test_profile_includes_worker_threads(tmp_path):
+    path = str(tmp_path / "run.prof")
+    with Instrumentation(profile=path):
+        worker = threading.Thread(target=busy_in_a_thread)
+        worker.start()
+        worker.join()
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    assert "busy_in_a_thread" in functions
@@ -0,0 +1,26 @@
+import threading
+
+from work_items import WorkItem, WorkList
+
+
+def test_background_list_expands_off_the_calling_thread():
+    caller = threading.current_thread()
+    counted_on = []
+
+    def page_count(pdf_file):
+        counted_on.append(threading.current_thread())
+        return 2
+
+    work = WorkList(["a.pdf", "b.pdf", "c.pdf"], page_count, background=True)
+    try:
+        assert work.get(0) == WorkItem("a.pdf", 1, 2)
+        # Only what is already known; nothing is expanded on this thread
+        assert work.upcoming(0, 3) == [WorkItem("a.pdf", 2, 2)]
+
+        work.prefetch(4).result()
+        assert work.upcoming(0, 3) == [WorkItem("a.pdf", 2, 2), WorkItem("b.pdf", 1, 2), WorkItem("b.pdf", 2, 2)]
+        assert work.get(5) == WorkItem("c.pdf", 2, 2)
+        assert work.get(6) is None
+        assert caller not in counted_on
+    finally:
+        work.close()
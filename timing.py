@@ -0,0 +1,256 @@
+
+import argparse
+import cProfile
+import csv
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import namedtuple
+
+# One timed step for one page. `label` is the page's output name without
+# extension (work_items.output_name(item, '')), `start` is time.perf_counter()
+# seconds, which is one clock for every thread and process on the machine.
+Span = namedtuple("Span", "name label start seconds pid thread")
+
+# File extension -> trace format written by SpanRecorder.write()
+TRACE_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".json": "chrome"}
+
+
+class _NullSpan:
+    # Returned by span() while recording is off: no clock reads, no allocation
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "label", "start")
+
+    def __init__(self, recorder, name, label):
+        self.recorder = recorder
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add(self.name, self.label, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class SpanRecorder:
+    """Collects timed spans (render, display, interaction, crop, encode, write...) in memory.
+
+    Off by default: span() then hands back a shared no-op context manager and
+    add() returns right away, so instrumented code pays one attribute check
+    per step. Spans can be recorded from any thread; worker processes send
+    theirs back with traced_call().
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = []  # list.append is atomic, so threads need no lock
+
+    def span(self, name, label=""):
+        # with recorder.span("crop", label): ...
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, label)
+
+    def add(self, name, label, start, seconds):
+        # For steps timed by hand, e.g. interaction time across UI callbacks
+        if self.enabled:
+            self.spans.append(Span(name, label, start, seconds, os.getpid(), threading.current_thread().name))
+
+    def take(self):
+        # Remove and return everything recorded so far
+        spans, self.spans = self.spans, []
+        return spans
+
+    def summary(self):
+        # {name: (count, total s, p50 s, p95 s)}, slowest total first
+        by_name = {}
+        for span in self.spans:
+            by_name.setdefault(span.name, []).append(span.seconds)
+        result = {}
+        for name, values in sorted(by_name.items(), key=lambda kv: -sum(kv[1])):
+            values.sort()
+            result[name] = (len(values), sum(values), values[len(values) // 2],
+                            values[min(len(values) - 1, int(len(values) * 0.95))])
+        return result
+
+    def write(self, path):
+        """Write the spans to `path`: .csv, .jsonl, or .json for Chrome's trace-event format.
+
+        Start times are written relative to the first span. The Chrome trace
+        opens in chrome://tracing or https://ui.perfetto.dev, one row per
+        process and thread.
+        """
+        fmt = TRACE_FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise ValueError(f"Unknown trace format for {path}, expected one of: {', '.join(TRACE_FORMATS)}")
+        spans = sorted(self.spans, key=lambda s: s.start)
+        origin = spans[0].start if spans else 0.0
+        rows = [{"name": s.name, "label": s.label, "start_s": round(s.start - origin, 6), "seconds": round(s.seconds, 6),
+                 "pid": s.pid, "thread": s.thread} for s in spans]
+        with open(path, "w", newline="") as f:
+            if fmt == "csv":
+                writer = csv.DictWriter(f, fieldnames=["name", "label", "start_s", "seconds", "pid", "thread"])
+                writer.writeheader()
+                writer.writerows(rows)
+            elif fmt == "jsonl":
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+            else:
+                json.dump({"traceEvents": _chrome_events(spans, origin), "displayTimeUnit": "ms"}, f)
+
+
+def _chrome_events(spans, origin):
+    # Complete ("X") events in microseconds; Chrome wants integer thread ids,
+    # so thread names are numbered per process and named with metadata events
+    tids = {}
+    events = []
+    for s in spans:
+        key = (s.pid, s.thread)
+        if key not in tids:
+            tids[key] = len(tids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": s.pid, "tid": tids[key], "args": {"name": s.thread}})
+        events.append({"name": s.name, "cat": "crop", "ph": "X", "pid": s.pid, "tid": tids[key],
+                       "ts": round((s.start - origin) * 1e6, 1), "dur": round(s.seconds * 1e6, 1),
+                       "args": {"label": s.label}})
+    return events
+
+
+# The process-wide recorder the tools and their modules record into
+recorder = SpanRecorder()
+
+# Set in batch worker processes by configure_worker(): profile each traced_call()
+_profile_calls = False
+
+
+def configure_worker(trace=False, profile=False):
+    # Called from a worker process initializer with Instrumentation.worker_options()
+    global _profile_calls
+    recorder.enabled = trace
+    _profile_calls = profile
+
+
+class _StatsHolder:
+    # What pstats.Stats() accepts besides a file name: something with create_stats() and .stats
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def traced_call(func, *args):
+    # Runs in a worker process: func(*args), plus the spans recorded meanwhile
+    # and, with profiling on, the call's cProfile stats. Returns (result, spans, stats).
+    if not _profile_calls:
+        return func(*args), recorder.take(), None
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func, *args)
+    finally:
+        profiler.create_stats()
+    return result, recorder.take(), profiler.stats
+
+
+def _trace_file(path):
+    # argparse type for --trace, so an unknown extension is a usage error
+    # (parser.error) before anything runs, not a traceback
+    if os.path.splitext(path)[1].lower() not in TRACE_FORMATS:
+        raise argparse.ArgumentTypeError(f"unknown trace format for {path}, expected one of: {', '.join(TRACE_FORMATS)}")
+    return path
+
+
+def add_arguments(parser):
+    parser.add_argument("--trace", metavar="FILE", type=_trace_file,
+                        help="Record how long every step of every page takes and write it to FILE: "
+                             ".csv, .jsonl, or .json (Chrome trace, open in chrome://tracing or ui.perfetto.dev)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Run under cProfile, every thread and worker process included, and write the stats to FILE (python -m pstats FILE)")
+
+
+class Instrumentation:
+    """--trace and --profile for one run of a tool, as a context manager.
+
+    Turns the span recorder and cProfile on for the duration of the block,
+    and writes the trace and profile files when it exits, also on Ctrl+C or
+    an error. cProfile only sees the thread it was enabled in (before Python
+    3.12), so every thread started inside the block gets a profiler of its
+    own, merged into the profile at the end. Without either option it does nothing. Batch runs pass
+    worker_options() to their worker processes and hand what traced_call()
+    returns to collect().
+    """
+
+    def __init__(self, trace=None, profile=None):
+        if trace and os.path.splitext(trace)[1].lower() not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format for {trace}, expected one of: {', '.join(TRACE_FORMATS)}")
+        self.trace = trace
+        self.profile = profile
+        self.profiler = None
+        self._worker_stats = []
+        self._thread_profilers = []
+        self._lock = threading.Lock()
+
+    def worker_options(self):
+        return bool(self.trace), bool(self.profile)
+
+    def collect(self, spans, stats=None):
+        recorder.spans.extend(spans)
+        if stats:
+            self._worker_stats.append(stats)
+
+    def _profile_thread(self, frame, event, arg):
+        # threading.setprofile() hook: runs on the first call in each new
+        # thread and replaces itself with a profiler for that thread
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: cProfile is built on sys.monitoring, which is
+            # process-wide, so self.profiler already sees this thread
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self._thread_profilers.append(profiler)
+
+    def __enter__(self):
+        recorder.enabled = bool(self.trace)
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            threading.setprofile(self._profile_thread)
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler:
+            self.profiler.disable()
+            threading.setprofile(None)
+            stats = pstats.Stats(self.profiler)
+            with self._lock:
+                for profiler in self._thread_profilers:
+                    stats.add(profiler)
+            for worker_stats in self._worker_stats:
+                stats.add(_StatsHolder(worker_stats))
+            stats.dump_stats(self.profile)
+            print(f"Profile written to {self.profile}")
+        if self.trace:
+            recorder.enabled = False
+            recorder.write(self.trace)
+            print(f"Trace of {len(recorder.spans)} spans written to {self.trace}")
+            for name, (count, total, p50, p95) in recorder.summary().items():
+                print(f"  {name:<12} {count:>6}x  p50 {p50 * 1000:8.1f} ms  p95 {p95 * 1000:8.1f} ms  total {total:8.1f} s")
+        return False
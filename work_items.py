@@ -0,0 +1,112 @@
+
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# One page of one input PDF; `pages` is the document's page count
+WorkItem = namedtuple("WorkItem", "file page pages")
+
+
+def output_name(item, ext=".png"):
+    # Single-page PDFs keep their plain name; pages of bundles get a suffix
+    stem = os.path.splitext(item.file)[0]
+    if item.pages > 1:
+        return f"{stem}_p{item.page:0{len(str(item.pages))}d}{ext}"
+    return stem + ext
+
+
+class WorkList:
+    """(file, page) work items, expanded lazily from a list or iterator of files.
+
+    Files are pulled from `pdf_files` (e.g. the pdf_scanner.scan_pdfs
+    generator) and a file's page count is only looked up when the cursor (or
+    the prefetch window) gets close to it, so a huge folder or a folder of
+    large bundles starts instantly and no page is rendered before it is needed.
+
+    With `background`, files are expanded (page counts, filters) on a
+    thread of the list's own: get() only waits when the item asked for isn't
+    known yet, and upcoming() returns the items known so far while
+    prefetch() extends the window without waiting.
+    """
+
+    def __init__(self, pdf_files, page_count, keep=None, keep_file=None, background=False):
+        self._files = iter(pdf_files)
+        self.page_count = page_count  # file -> number of pages
+        self.keep = keep  # Optional filter, e.g. to leave out finished pages
+        self.keep_file = keep_file  # Optional cheaper filter applied before the page count
+        self.items = []
+        self.files_seen = 0
+        self.files_skipped = 0  # Left out by keep_file
+        self.exhausted = False
+        self._positions = {}
+        # One thread does all the expanding, so files stay in order
+        self._expander = ThreadPoolExecutor(max_workers=1, thread_name_prefix="worklist") if background else None
+        self._expander_thread = None
+
+    def _next_file(self):
+        for pdf_file in self._files:
+            self.files_seen += 1
+            self._positions[pdf_file] = self.files_seen
+            if self.keep_file is None or self.keep_file(pdf_file):
+                return pdf_file
+            self.files_skipped += 1
+        self.exhausted = True
+        return None
+
+    def ensure(self, count):
+        # Expand files until at least `count` items exist (or we run out)
+        if len(self.items) >= count or self.exhausted:
+            return len(self.items) >= count
+        if self._expander is not None and threading.current_thread() is not self._expander_thread:
+            return self._expander.submit(self._expand, count).result()
+        return self._expand(count)
+
+    def prefetch(self, count):
+        # Start expanding up to `count` items in the background; returns a
+        # Future (None if there is nothing to do, or no background thread)
+        if self._expander is None or len(self.items) >= count or self.exhausted:
+            return None
+        return self._expander.submit(self._expand, count)
+
+    def _expand(self, count):
+        if self._expander is not None:
+            self._expander_thread = threading.current_thread()
+        while len(self.items) < count and not self.exhausted:
+            pdf_file = self._next_file()
+            if pdf_file is None:
+                break
+            try:
+                pages = self.page_count(pdf_file)
+            except Exception as e:
+                print(f"Could not read page count of {pdf_file}: {e}")
+                pages = 1  # Still show it, so the render error is reported
+            for page in range(1, pages + 1):
+                item = WorkItem(pdf_file, page, pages)
+                if self.keep is None or self.keep(item):
+                    self.items.append(item)
+        return len(self.items) >= count
+
+    def get(self, index):
+        if self.ensure(index + 1):
+            return self.items[index]
+        return None
+
+    def upcoming(self, index, count):
+        # With `background`, only the items known so far; see prefetch()
+        if self._expander is None:
+            self.ensure(index + 1 + count)
+        return self.items[index + 1:index + 1 + count]
+
+    def close(self):
+        if self._expander is not None:
+            self._expander.shutdown(wait=False, cancel_futures=True)
+
+    def file_position(self, item):
+        # 1-based position of the item's file in the input list
+        return self._positions[item.file]
+
+    def file_total(self):
+        # Number of input files as far as they are known: "1234" once the
+        # scan is complete, "1234+" while more may follow
+        return str(self.files_seen) if self.exhausted else f"{self.files_seen}+"